@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    Database size and read/write latency of stored roadmaps and feedback,
+    uncompressed vs the compressed column types.
+
+    Usage:
+        python benchmarks/bench_compression.py [--rows N]
+
+    A synthetic corpus of roadmaps and tutor feedback is written to a fresh
+    SQLite file per setup, then every row is read back by id.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskstarter.compression import (CompressedJSON, CompressedText, Compressor,  # noqa: E402
+                                      set_compressor, train_dictionary, zstandard)
+
+
+WORDS = ('learning material roadmap chapter section summary student question answer concept '
+         'theory example exercise review model data analysis result method lecture topic '
+         'history space program mission early development first satellite').split()
+
+FEEDBACK_OPENERS = ["That's a much better attempt!", 'Good start!', "You're on the right track.",
+                    'Not quite yet.', 'Great job!']
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def make_roadmap(rng):
+    offset = 0
+    structure = []
+    for chapter in range(1, rng.randint(4, 10)):
+        entry = {'level': 1, 'title': f'{chapter}. {sentence(rng, 4)}', 'summary': sentence(rng, 15),
+                 'start': offset, 'page_start': chapter * 7}
+        offset += rng.randint(2000, 9000)
+        subsections = []
+        for sub in range(1, rng.randint(1, 5)):
+            subsections.append({'level': 2, 'title': f'{chapter}.{sub} {sentence(rng, 5)}',
+                                'summary': sentence(rng, 12), 'start': offset, 'end': offset + 1500})
+            offset += 1500
+        entry['end'] = offset
+        if subsections:
+            entry['subsections'] = subsections
+        structure.append(entry)
+    return {'document_title': sentence(rng, 6), 'structure': structure}
+
+
+def make_feedback(rng):
+    return f'{rng.choice(FEEDBACK_OPENERS)} {sentence(rng, 20)} Can you explain {sentence(rng, 8).lower()[:-1]}?'
+
+
+def make_corpus(rows, seed=7):
+    rng = random.Random(seed)
+    return [(make_roadmap(rng), make_feedback(rng)) for _ in range(rows)]
+
+
+def run(name, corpus, roadmap_type, feedback_type, encode_roadmap):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    engine = sa.create_engine(f'sqlite:///{path}')
+    metadata = sa.MetaData()
+    table = sa.Table('rows', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('roadmap', roadmap_type),
+                     sa.Column('feedback', feedback_type))
+    metadata.create_all(engine)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for row_id, (roadmap, feedback) in enumerate(corpus, 1):
+            conn.execute(table.insert().values(id=row_id, roadmap=encode_roadmap(roadmap), feedback=feedback))
+    write = time.perf_counter() - start
+
+    ids = list(range(1, len(corpus) + 1))
+    random.Random(1).shuffle(ids)
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        for row_id in ids:
+            conn.execute(sa.select(table.c.roadmap, table.c.feedback).where(table.c.id == row_id)).one()
+    read = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql('VACUUM')
+    engine.dispose()
+    size = os.path.getsize(path)
+    print(f'{name:<28} {size / 1024:10.0f} {write / len(corpus) * 1e6:10.1f} {read / len(corpus) * 1e6:10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.rows)
+    samples = [json.dumps(roadmap, separators=(',', ':')).encode('utf-8') for roadmap, _ in corpus[:500]]
+    samples += [feedback.encode('utf-8') for _, feedback in corpus[:500]]
+
+    print(f'{args.rows} rows, zstandard {"available" if zstandard else "not installed"}')
+    print(f'{"setup":<28} {"size KB":>10} {"write us":>10} {"read us":>10}')
+
+    run('text, indented JSON', corpus, sa.Text, sa.Text, lambda roadmap: json.dumps(roadmap, indent=2))
+
+    codecs = ['zlib'] + (['zstd'] if zstandard else [])
+    setups = [('compact JSON', Compressor('none'))]
+    for codec in codecs:
+        setups.append((codec, Compressor(codec)))
+        setups.append((f'{codec} + dictionary',
+                       Compressor(codec, dictionaries=[train_dictionary(samples, codec=codec)])))
+
+    for name, compressor in setups:
+        set_compressor(compressor)
+        run(name, corpus, CompressedJSON, CompressedText, lambda roadmap: roadmap)
+
+
+if __name__ == '__main__':
+    main()
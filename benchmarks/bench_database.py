@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+    SQLite write throughput under parallel uploads, default settings vs the
+    tuned connection settings of database.py.
+
+    Usage:
+        python benchmarks/bench_database.py [--writers N] [--uploads M] [--readers R]
+
+    Each writer process registers M uploads the way the uploader does: an
+    insert, then a status update in its own transaction. Reader processes
+    keep listing materials meanwhile. Reported are committed transactions
+    per second and how many failed with "database is locked".
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskstarter.database import engine_options, tune_sqlite_engine  # noqa: E402
+
+
+SETUPS = {
+    # pysqlite defaults: rollback journal, full sync, 5s lock wait
+    'default': None,
+    'tuned': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL', 'SQLITE_BUSY_TIMEOUT': 30},
+}
+
+metadata = sa.MetaData()
+materials = sa.Table('learning_materials', metadata,
+                     sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('user_id', sa.Integer, index=True),
+                     sa.Column('title', sa.String(255)),
+                     sa.Column('processing_status', sa.String(50)),
+                     sa.Column('content_hash', sa.String(64)))
+
+
+def make_engine(url, setup):
+    config = SETUPS[setup]
+    if config is None:
+        return sa.create_engine(url)
+    engine = sa.create_engine(url, **engine_options(url, config))
+    tune_sqlite_engine(engine, config)
+    return engine
+
+
+def writer(url, setup, user_id, uploads, results):
+    engine = make_engine(url, setup)
+    committed = locked = 0
+    for i in range(uploads):
+        try:
+            with engine.begin() as conn:
+                material_id = conn.execute(materials.insert().values(
+                    user_id=user_id, title=f'upload {i}', processing_status='UPLOADED',
+                    content_hash=f'{user_id:08x}{i:056x}')).inserted_primary_key[0]
+            committed += 1
+            with engine.begin() as conn:
+                conn.execute(materials.update().where(materials.c.id == material_id)
+                             .values(processing_status='AI_ANALYSIS_PENDING'))
+            committed += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    results.put((committed, locked))
+
+
+def reader(url, setup, stop):
+    engine = make_engine(url, setup)
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                conn.execute(sa.select(materials.c.id, materials.c.title)
+                             .where(materials.c.user_id == 1)).fetchall()
+        except OperationalError:
+            pass
+
+
+def run(setup, writers, uploads, readers):
+    url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    engine = make_engine(url, setup)
+    metadata.create_all(engine)
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    reader_processes = [multiprocessing.Process(target=reader, args=(url, setup, stop)) for _ in range(readers)]
+    writer_processes = [multiprocessing.Process(target=writer, args=(url, setup, user_id, uploads, results))
+                        for user_id in range(1, writers + 1)]
+    for process in reader_processes:
+        process.start()
+
+    start = time.perf_counter()
+    for process in writer_processes:
+        process.start()
+    totals = [results.get() for _ in writer_processes]
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for process in writer_processes + reader_processes:
+        process.join()
+
+    committed = sum(result[0] for result in totals)
+    locked = sum(result[1] for result in totals)
+    print(f'{setup:<10} {committed / elapsed:12.1f} {locked:8d} {elapsed:10.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--uploads', type=int, default=200)
+    parser.add_argument('--readers', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f'{args.writers} writers x {args.uploads} uploads, {args.readers} readers')
+    print(f'{"setup":<10} {"commits/s":>12} {"locked":>8} {"seconds":>10}')
+    for setup in SETUPS:
+        run(setup, args.writers, args.uploads, args.readers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the article text extractors.
+
+    Usage:
+        python benchmarks/bench_extract.py [CORPUS_DIR] [--repeat N]
+
+    CORPUS_DIR holds saved pages (*.html / *.htm). Without one, a set of
+    synthetic pages with navigation, sidebars, scripts and comments is
+    generated. Reports pages/s, MB/s and average output size per engine.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskstarter.content.extract import HAS_LXML, DensityExtractor, SelectorExtractor  # noqa: E402
+
+
+WORDS = ('learning material roadmap chapter section summary student question answer concept '
+         'theory example exercise review model data analysis result method lecture topic').split()
+
+
+def sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def synthetic_page(rng):
+    nav = ''.join(f'<li><a href="/p/{i}">{rng.choice(WORDS)}</a></li>' for i in range(40))
+    sidebar = ''.join(f'<div class="widget"><a href="/t/{i}">{sentence(rng, 4)}</a></div>' for i in range(20))
+    paragraphs = ''.join(f'<p>{sentence(rng, rng.randint(20, 60))} <a href="/x">{rng.choice(WORDS)}</a> '
+                         f'{sentence(rng, rng.randint(10, 40))}</p>' for _ in range(rng.randint(10, 40)))
+    script = 'var x = ' + '{"k": "' + 'v' * 2000 + '"};'
+    wrapper = rng.choice(['<article>{}</article>', '<div id="content">{}</div>',
+                          '<div class="entry"><div class="inner">{}</div></div>'])
+    return (f'<!DOCTYPE html><html><head><title>Page</title><style>body{{color:red}}</style>'
+            f'<script>{script}</script></head><body>'
+            f'<header><nav><ul>{nav}</ul></nav></header>'
+            f'<div class="layout">{wrapper.format("<h1>Title</h1>" + paragraphs)}'
+            f'<aside>{sidebar}</aside></div>'
+            f'<!-- tracking -->{"<div class=ad>Sponsored</div>" * 5}'
+            f'<footer><p>Copyright, all rights reserved</p></footer>'
+            f'<script>{script}</script></body></html>').encode('utf-8')
+
+
+def load_corpus(directory):
+    pages = []
+    for pattern in ('*.html', '*.htm'):
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def run(name, extractor, pages, repeat):
+    total_bytes = sum(len(page) for page in pages) * repeat
+    output_chars = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            output_chars += len(extractor.extract(page))
+    elapsed = time.perf_counter() - start
+    count = len(pages) * repeat
+    print(f'{name:<28} {count / elapsed:10.1f} {total_bytes / elapsed / 1e6:8.2f} '
+          f'{output_chars / count:12.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', nargs='?', help='directory of saved HTML pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=200, help='synthetic pages to generate')
+    args = parser.parse_args()
+
+    if args.corpus:
+        pages = load_corpus(args.corpus)
+        if not pages:
+            parser.error(f'no .html files in {args.corpus}')
+    else:
+        rng = random.Random(42)
+        pages = [synthetic_page(rng) for _ in range(args.pages)]
+
+    engines = [('selector (html.parser)', SelectorExtractor('html.parser'))]
+    if HAS_LXML:
+        engines.append(('selector (lxml)', SelectorExtractor('lxml')))
+    engines.append(('density (html.parser)', DensityExtractor('html.parser')))
+    if HAS_LXML:
+        engines.append(('density (lxml)', DensityExtractor('lxml')))
+
+    size = sum(len(page) for page in pages)
+    print(f'{len(pages)} pages, {size / 1e6:.2f} MB, repeat {args.repeat}, lxml '
+          f'{"available" if HAS_LXML else "not installed"}')
+    print(f'{"engine":<28} {"pages/s":>10} {"MB/s":>8} {"avg chars":>12}')
+    for name, extractor in engines:
+        run(name, extractor, pages, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    Login throughput under different password hashing policies.
+
+    Usage:
+        python benchmarks/bench_passwords.py [--clients N] [--seconds S] [--workers W]
+
+    N client threads verify passwords as fast as they can for S seconds
+    while one more thread stands in for ordinary requests, doing a small
+    bit of work in a loop. Reported are logins per second, their p95
+    latency and how many ordinary requests went through meanwhile.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flaskstarter.user.passwords import PasswordHasher  # noqa: E402
+
+
+METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:1000000', 'pbkdf2:sha256:600000']
+
+
+def other_requests(stop, counter):
+    while not stop.is_set():
+        hashlib.sha256(b'x' * 4096).digest()
+        time.sleep(0.001)
+        counter[0] += 1
+
+
+def run(method, clients, seconds, workers):
+    hasher = PasswordHasher(method, workers=workers)
+    pwhash = hasher.hash('correct horse battery staple')
+    latencies = []
+    stop = threading.Event()
+    others = [0]
+
+    def client():
+        while not stop.is_set():
+            start = time.perf_counter()
+            hasher.verify(pwhash, 'correct horse battery staple')
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    threads.append(threading.Thread(target=other_requests, args=(stop, others)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    hasher.shutdown()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    pool = f'pool of {workers}' if workers else 'no pool'
+    print(f'{method:<24} {pool:<12} {len(latencies) / seconds:10.1f} {p95 * 1000:10.0f} {others[0] / seconds:12.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    print(f'{args.clients} concurrent logins, {os.cpu_count()} CPUs')
+    print(f'{"method":<24} {"":<12} {"logins/s":>10} {"p95 ms":>10} {"other req/s":>12}')
+    for method in METHODS:
+        for workers in (0, args.workers):
+            run(method, args.clients, args.seconds, workers)
+
+
+if __name__ == '__main__':
+    main()
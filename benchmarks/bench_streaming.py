@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    Time to the first question of a generated test: request_ai vs
+    request_ai_stream.
+
+    Usage:
+        python benchmarks/bench_streaming.py [--latency SECONDS] [--runs N]
+
+    Runs against the fake backend, which spreads --latency over the pieces
+    of a streamed answer like the model does over its tokens. Reported are
+    the seconds until the first question can be shown and until the last.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('FLASKSTARTER_INSTANCE_PATH', tempfile.mkdtemp())
+
+from flaskstarter import create_app  # noqa: E402
+from flaskstarter.test_learning_function.tasks import call_AI_for_test_generation  # noqa: E402
+from flaskstarter.utils import request_ai, request_ai_stream  # noqa: E402
+
+
+def whole(prompt):
+    start = time.perf_counter()
+    answer = request_ai(prompt, use_cache=False)
+    elapsed = time.perf_counter() - start
+    assert answer['questions']
+    return elapsed, elapsed
+
+
+def streamed(prompt):
+    start = time.perf_counter()
+    first = None
+    for _ in request_ai_stream(prompt, 'questions', use_cache=False):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=2.0)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    class Config(object):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        CACHE_TYPE = 'NullCache'
+        AI_BACKEND = 'fake'
+        AI_FAKE_LATENCY = args.latency
+
+    app = create_app(Config)
+    with app.app_context():
+        prompt = call_AI_for_test_generation('all', 'exam', 'Just finished reading', material='Some text.').text
+        print(f'{args.runs} runs, {args.latency}s per answer')
+        print(f'{"setup":<10} {"first (s)":>10} {"last (s)":>10}')
+        for name, run in (('whole', whole), ('streamed', streamed)):
+            times = [run(prompt) for _ in range(args.runs)]
+            print(f'{name:<10} {sum(t[0] for t in times) / args.runs:10.3f} '
+                  f'{sum(t[1] for t in times) / args.runs:10.3f}')
+
+
+if __name__ == '__main__':
+    main()
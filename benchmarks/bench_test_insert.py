@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+    Writing a generated test: the old per-object loop vs
+    Test.create_with_questions.
+
+    Usage:
+        python benchmarks/bench_test_insert.py [--tests N] [--questions 10,50,200]
+
+    Each setup writes N tests with the given number of questions plus their
+    first attempt, one transaction per test, into a fresh SQLite database.
+    Reported are the statements sent per test and the time per test.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('FLASKSTARTER_INSTANCE_PATH', tempfile.mkdtemp())
+
+from flaskstarter import create_app  # noqa: E402
+from flaskstarter.extensions import db  # noqa: E402
+from flaskstarter.user import Users  # noqa: E402
+from flaskstarter.learning_marterial_uploader import LearningMaterial  # noqa: E402
+from flaskstarter.test_learning_function.models import Test, Question, TestAttempt  # noqa: E402
+
+
+def per_object(user_id, material_id, questions):
+    test = Test(name='Benchmark test', user_id=user_id, material_id=material_id,
+                spec_scope='all', spec_goal='exam', spec_understanding='Just finished reading')
+    db.session.add(test)
+    for i, text in enumerate(questions):
+        db.session.add(Question(question_text=text, order=i + 1, test=test))
+    attempt = TestAttempt(user_id=user_id, test=test)
+    db.session.add(attempt)
+    db.session.commit()
+    return test.id, attempt.id
+
+
+def bulk(user_id, material_id, questions):
+    ids = Test.create_with_questions(user_id, material_id, 'Benchmark test', questions, spec_scope='all',
+                                     spec_goal='exam', spec_understanding='Just finished reading')
+    db.session.commit()
+    return ids
+
+
+class Config(object):
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    CACHE_TYPE = 'NullCache'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tests', type=int, default=200)
+    parser.add_argument('--questions', default='10,50,200')
+    args = parser.parse_args()
+
+    app = create_app(Config)
+    with app.app_context():
+        db.create_all()
+        user = Users(name='bench', email='bench@example.com', password='benchpassword')
+        db.session.add(user)
+        db.session.flush()
+        material = LearningMaterial(user_id=user.id, title='Material', source_type='URL')
+        db.session.add(material)
+        db.session.commit()
+        user_id, material_id = user.id, material.id
+
+        statements = [0]
+        event.listen(db.engine, 'before_cursor_execute', lambda *a: statements.__setitem__(0, statements[0] + 1))
+
+        print(f'{args.tests} tests per setup')
+        print(f'{"questions":>9} {"setup":<12} {"statements":>10} {"ms/test":>10}')
+        for count in [int(value) for value in args.questions.split(',')]:
+            questions = [f'Question {i} about the material, explain it in your own words?' for i in range(count)]
+            for name, write in (('per object', per_object), ('bulk', bulk)):
+                statements[0] = 0
+                start = time.perf_counter()
+                for _ in range(args.tests):
+                    write(user_id, material_id, questions)
+                elapsed = time.perf_counter() - start
+                print(f'{count:>9} {name:<12} {statements[0] / args.tests:10.1f} '
+                      f'{elapsed / args.tests * 1000:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+from .cache import ResponseCache, get_response_cache, make_key, file_identity
+from .streaming import JSONArrayStream
+from .errors import (AIError, AITimeout, AIQuotaExceeded, AIUnavailable, AICircuitOpen, AIInvalidResponse,
+                     AIRequestError, classify)
+from .repair import loads_lenient, repair_json
+from .schemas import (TestQuestions, Feedback, FileRoadmap, RoadmapChapter, RoadmapSubsection, ChunkSections,
+                      ChunkSection, api_schema, validate_response)
+from .resilience import CircuitBreaker, call_with_retries, get_circuit_breaker
+from .governor import AIBusy, Governor, get_governor, set_ai_user, ai_user_key, is_throttled, user_workers
+from .prompts import PromptTemplate, RenderedPrompt, register_prompt, get_prompt, render_prompt, select_version
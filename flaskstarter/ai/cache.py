@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+    Response cache in front of the model.
+
+    Identical requests (same model, prompt, generation config and attached
+    file) are answered from disk instead of calling the API again.
+"""
+
+import hashlib
+import json
+
+from flask import current_app, has_app_context
+
+from ..compression import compress_text, decompress_text
+from ..sqlite_cache import SQLiteCache
+
+
+def file_identity(file_object):
+    """Stable identity of an attached file.
+
+    Prefer the content hash reported by the API so that re-uploads of the
+    same bytes share cache entries, then fall back to the file name/URI.
+    """
+    if file_object is None:
+        return None
+    if isinstance(file_object, str):
+        return file_object
+    return (getattr(file_object, 'sha256_hash', None)
+            or getattr(file_object, 'uri', None)
+            or getattr(file_object, 'name', None)
+            or repr(file_object))
+
+
+def make_key(model_name, prompt, generation_config=None, file_object=None):
+    key = json.dumps({
+        'model': model_name,
+        'prompt': prompt,
+        'config': generation_config or {},
+        'file': file_identity(file_object),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(SQLiteCache):
+    """Stores decoded JSON responses of the model."""
+
+    def get_response(self, key):
+        value = self.get(key)
+        if value is None:
+            return None
+        return json.loads(decompress_text(value))
+
+    def set_response(self, key, response):
+        self.set(key, compress_text(json.dumps(response, separators=(',', ':'))))
+
+
+def get_response_cache():
+    """The app's response cache, or None when caching is disabled."""
+
+    if not has_app_context() or not current_app.config.get('AI_CACHE_ENABLED'):
+        return None
+
+    cache = current_app.extensions.get('ai_response_cache')
+    if cache is None:
+        config = current_app.config
+        cache = ResponseCache(config['AI_CACHE_PATH'],
+                              ttl=config['AI_CACHE_TTL'],
+                              max_entries=config['AI_CACHE_MAX_ENTRIES'],
+                              max_bytes=config['AI_CACHE_MAX_BYTES'])
+        current_app.extensions['ai_response_cache'] = cache
+    return cache
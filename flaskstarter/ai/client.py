@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+    Process wide model client.
+
+    The backend is built once in `create_app` and shared by every request
+    and worker thread, so the API is configured a single time and the
+    underlying gRPC channel stays warm. Set `AI_BACKEND = 'fake'` to run the
+    whole app offline, e.g. for load tests.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import google.generativeai as genai
+from flask import current_app
+
+from .governor import governed
+
+
+class GeminiBackend(object):
+    """Talks to the Gemini API through google-generativeai."""
+
+    def __init__(self, api_key, model_name, generation_config=None, timeout=None):
+        self.model_name = model_name
+        self.generation_config = dict(generation_config or {})
+        self.timeout = timeout
+        self._models = {}
+        self._lock = threading.Lock()
+
+        genai.configure(api_key=api_key)
+
+    def _model(self, model_name):
+        model = self._models.get(model_name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(model_name)
+                if model is None:
+                    model = genai.GenerativeModel(model_name)
+                    self._models[model_name] = model
+        return model
+
+    def _request_options(self, timeout=None):
+        # The call's own deadline, but never longer than AI_REQUEST_TIMEOUT
+        timeout = min(filter(None, (timeout, self.timeout)), default=None)
+        return {'timeout': timeout} if timeout else None
+
+    def generate(self, contents, generation_config=None, model_name=None, timeout=None):
+        """Returns the text of the model's answer."""
+        config = dict(self.generation_config, **(generation_config or {}))
+        response = self._model(model_name or self.model_name).generate_content(
+            contents,
+            generation_config=genai.types.GenerationConfig(**config),
+            request_options=self._request_options(timeout)
+        )
+        return response.text
+
+    def generate_stream(self, contents, generation_config=None, model_name=None, timeout=None):
+        """Yields the text of the model's answer as it is generated."""
+        config = dict(self.generation_config, **(generation_config or {}))
+        response = self._model(model_name or self.model_name).generate_content(
+            contents,
+            generation_config=genai.types.GenerationConfig(**config),
+            request_options=self._request_options(timeout),
+            stream=True
+        )
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def upload_file(self, path, display_name=None):
+        return genai.upload_file(path=path, display_name=display_name)
+
+    def get_file(self, name):
+        return genai.get_file(name=name)
+
+
+FakeFile = namedtuple('FakeFile', 'name display_name sha256_hash')
+
+
+class FakeBackend(object):
+    """Offline stand-in with the same interface as `GeminiBackend`.
+
+    Answers are canned JSON shaped after the keys the prompt asks for, and
+    `latency` seconds are slept per call to mimic the real API. Streamed
+    answers come in `stream_chunk_size` character pieces with the latency
+    spread over them.
+    """
+
+    stream_chunk_size = 16
+
+    def __init__(self, model_name='fake-model', generation_config=None, latency=0.0):
+        self.model_name = model_name
+        self.generation_config = dict(generation_config or {})
+        self.latency = latency
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _sleep(self, timeout=None):
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f'No answer within {timeout:.1f}s')
+        if self.latency:
+            time.sleep(self.latency)
+
+    def generate(self, contents, generation_config=None, model_name=None, timeout=None):
+        self._sleep(timeout)
+        return json.dumps(self.fake_response(self._prompt(contents, generation_config)))
+
+    def generate_stream(self, contents, generation_config=None, model_name=None, timeout=None):
+        text = json.dumps(self.fake_response(self._prompt(contents, generation_config)))
+        size = self.stream_chunk_size
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'Stream not finished within {timeout:.1f}s')
+            yield chunk
+
+    @staticmethod
+    def _prompt(contents, generation_config):
+        # The keys asked for are in the prompt or in the response schema
+        prompt = contents[0] if isinstance(contents, (list, tuple)) else contents
+        schema = (generation_config or {}).get('response_schema')
+        return str(prompt) + (json.dumps(schema) if schema else '')
+
+    @staticmethod
+    def fake_response(prompt):
+        if 'feedback_text' in prompt:
+            return {'feedback_text': 'Good start! Can you explain your reasoning in more detail?'}
+        if 'generated_question_count' in prompt:
+            questions = [f'Fake question {i}?' for i in range(1, 6)]
+            return {'generated_question_count': len(questions), 'questions': questions}
+        if 'start_text' in prompt:
+            return {
+                'document_title': 'Fake document',
+                'sections': [{'level': 1, 'title': 'Fake section', 'summary': 'A fake section.',
+                              'start_text': ''}],
+            }
+        if 'document_title' in prompt:
+            return {
+                'document_title': 'Fake document',
+                'structure': [
+                    {'level': 1, 'title': f'{i}. Fake chapter', 'summary': 'A fake chapter.'}
+                    for i in range(1, 4)
+                ],
+            }
+        return {}
+
+    def upload_file(self, path, display_name=None):
+        self._sleep()
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        sha256_hash = base64.b64encode(digest.digest()).decode('ascii')
+        fake_file = FakeFile(f'files/fake-{digest.hexdigest()[:16]}', display_name, sha256_hash)
+        with self._lock:
+            self._files[fake_file.name] = fake_file
+        return fake_file
+
+    def get_file(self, name):
+        with self._lock:
+            return self._files.get(name) or FakeFile(name, None, None)
+
+
+def _deadline(timeout):
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+def _remaining(deadline):
+    return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+
+class AIClient(object):
+    """Flask extension holding the app's model backend."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        if config['AI_BACKEND'] == 'fake':
+            backend = FakeBackend(model_name=config['AI_MODEL_NAME'],
+                                  generation_config=config['AI_GENERATION_CONFIG'],
+                                  latency=config['AI_FAKE_LATENCY'])
+        else:
+            backend = GeminiBackend(api_key=os.environ.get('GOOGLE_API_KEY'),
+                                    model_name=config['AI_MODEL_NAME'],
+                                    generation_config=config['AI_GENERATION_CONFIG'],
+                                    timeout=config['AI_REQUEST_TIMEOUT'])
+        app.extensions['ai_client'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['ai_client']
+
+    @property
+    def model_name(self):
+        return self.backend.model_name
+
+    @property
+    def generation_config(self):
+        return self.backend.generation_config
+
+    # Calls to the API wait for the governor, see ai/governor.py. The wait
+    # counts against `timeout`, the seconds the caller has for the call.
+
+    def generate(self, contents, generation_config=None, model_name=None, timeout=None):
+        deadline = _deadline(timeout)
+        with governed(timeout):
+            return self.backend.generate(contents, generation_config, model_name, timeout=_remaining(deadline))
+
+    def generate_stream(self, contents, generation_config=None, model_name=None, timeout=None):
+        deadline = _deadline(timeout)
+        # The slot is held until the stream is consumed or closed
+        with governed(timeout):
+            yield from self.backend.generate_stream(contents, generation_config, model_name,
+                                                    timeout=_remaining(deadline))
+
+    def upload_file(self, path, display_name=None):
+        with governed():
+            return self.backend.upload_file(path, display_name)
+
+    def get_file(self, name):
+        return self.backend.get_file(name)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    Errors of calls to the model.
+
+    Whatever the backend raises is turned into one of these by `classify`,
+    so callers can tell a timeout from a quota error from an unusable
+    answer. `transient` errors are worth another try.
+"""
+
+import concurrent.futures
+import json
+
+
+class AIError(Exception):
+    """A call to the model failed."""
+
+    transient = False
+    message = 'The AI service failed, please try again.'  # for users
+
+
+class AITimeout(AIError):
+    """No answer before the call's deadline."""
+
+    transient = True
+    message = 'The AI service took too long to answer, please try again.'
+
+
+class AIQuotaExceeded(AIError):
+    """The provider refused the call for rate or quota (429)."""
+
+    transient = True
+    message = 'The AI service is busy right now, please try again in a minute.'
+
+
+class AIUnavailable(AIError):
+    """The provider is down or failing (5xx, connection errors)."""
+
+    transient = True
+    message = 'The AI service is unavailable right now, please try again later.'
+
+
+class AICircuitOpen(AIUnavailable):
+    """Failing fast, the provider failed too often lately."""
+
+    transient = False
+
+
+class AIInvalidResponse(AIError):
+    """The answer isn't the JSON asked for, even after repair."""
+
+    transient = True
+    message = 'The AI returned an unusable answer, please try again.'
+
+
+class AIRequestError(AIError):
+    """The provider rejected the request itself (4xx), retrying won't help."""
+
+
+def _status_code(error):
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    return code if isinstance(code, int) else None
+
+
+def classify(error):
+    """The `AIError` for an exception raised by a call to the model."""
+    if isinstance(error, AIError):
+        return error
+
+    code = _status_code(error)
+    if isinstance(error, (TimeoutError, concurrent.futures.TimeoutError)) or code in (408, 504):
+        typed = AITimeout(str(error) or 'Timed out')
+    elif code == 429:
+        typed = AIQuotaExceeded(str(error))
+    elif isinstance(error, ConnectionError) or (code is not None and code >= 500):
+        typed = AIUnavailable(str(error))
+    elif code is not None and 400 <= code < 500:
+        typed = AIRequestError(str(error))
+    elif isinstance(error, (json.JSONDecodeError, ValueError)):
+        # The SDK raises ValueError for answers without text, e.g. blocked ones
+        typed = AIInvalidResponse(str(error))
+    else:
+        typed = AIError(f'{type(error).__name__}: {error}')
+    typed.__cause__ = error
+    return typed
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+    Rate limit and concurrency limit of the calls to the model, shared by
+    every process on a host through a SQLite file.
+
+    A call first waits in a queue, then takes a token from a bucket refilled
+    at AI_RATE_LIMIT per second and one of AI_MAX_CONCURRENCY slots. Waiting
+    calls are served round robin over users: a call joins the round after
+    its user's previous call, so a user who queues ten calls doesn't hold
+    back one who queues a single call. No user holds more than
+    AI_MAX_CONCURRENCY_PER_USER slots, so pools working for one user are
+    sized with `user_workers`. A call gives up with `AIBusy` after
+    AI_QUEUE_TIMEOUT seconds, and is retried like a timeout.
+
+    When the provider answers 429 or 503 everybody pauses for a backoff that
+    doubles on every further refusal and the rate is halved; every call
+    that goes through raises it again by AI_RATE_RECOVERY.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context
+from flask_login import current_user
+
+from .errors import AIError
+
+
+class AIBusy(AIError):
+    """No slot for a call to the model within the queue timeout."""
+
+    transient = True
+    message = 'Too many AI requests right now, please try again in a minute.'
+
+
+def is_throttled(error):
+    """Whether the provider refused a call for load (HTTP 429 or 503)."""
+    code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    return code in (429, 503)
+
+
+def set_ai_user(user_id):
+    """Counts the calls of the current app context against `user_id`,
+    for jobs and threads that work on behalf of a user."""
+    g.ai_user = user_id
+
+
+def ai_user_key():
+    """Who a call to the model is made for, for fairness between users."""
+    if has_app_context() and g.get('ai_user') is not None:
+        return str(g.ai_user)
+    if has_request_context() and current_user.is_authenticated:
+        return str(current_user.id)
+    return 'background'
+
+
+class Governor(object):
+    """
+    Token bucket plus concurrency limit kept in SQLite.
+
+    :param path: location of the SQLite file, created if needed
+    :param rate: calls per second, 0 for no limit
+    :param burst: tokens the bucket holds
+    :param max_concurrent: calls in flight on the host, 0 for no limit
+    :param per_user: calls in flight per user, 0 for no limit
+    :param queue_timeout: seconds a call waits before `AIBusy`
+    :param lease: seconds after which a slot is given back, for processes
+                  that died holding one
+    """
+
+    poll_interval = 0.05
+    min_rate_factor = 0.1
+
+    def __init__(self, path, rate=5, burst=10, max_concurrent=8, per_user=2, queue_timeout=30,
+                 lease=300, backoff=2, backoff_max=60, recovery=0.1):
+        self.path = path
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.queue_timeout = queue_timeout
+        self.lease = lease
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.recovery = recovery
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS bucket ('
+                     'id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL NOT NULL, updated REAL NOT NULL, '
+                     'rate_factor REAL NOT NULL, backoff_until REAL NOT NULL, backoff_level INTEGER NOT NULL, '
+                     'round INTEGER NOT NULL)')
+        conn.execute('INSERT OR IGNORE INTO bucket VALUES (1, ?, ?, 1.0, 0, 0, 0)', (self.burst, time.time()))
+        conn.execute('CREATE TABLE IF NOT EXISTS slots ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, user_key TEXT NOT NULL, '
+                     'acquired REAL NOT NULL, expires REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS waiters ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, user_key TEXT NOT NULL, round INTEGER NOT NULL, '
+                     'enqueued REAL NOT NULL, deadline REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS rounds (user_key TEXT PRIMARY KEY, next_round INTEGER NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL)')
+
+    def _count(self, conn, name, amount=1):
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                     (name, amount))
+
+    def acquire(self, user_key, timeout=None):
+        """Waits for a slot, returns its id for `release`."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        enqueued = time.time()
+        deadline = enqueued + timeout
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            waiter_id = self._enqueue(conn, user_key, enqueued, deadline)
+        try:
+            while True:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    now = time.time()
+                    slot_id, wait = self._admit(conn, waiter_id, user_key, now)
+                    if slot_id is not None:
+                        waited = now - enqueued
+                        self._count(conn, 'acquired')
+                        self._count(conn, 'wait_seconds', waited)
+                        conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                                     'ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)',
+                                     ('wait_seconds_max', waited))
+                        return slot_id
+                if now + wait > deadline:
+                    with conn:
+                        conn.execute('BEGIN IMMEDIATE')
+                        self._count(conn, 'timed_out')
+                    raise AIBusy(f'No capacity for a model call within {timeout:g}s')
+                time.sleep(min(wait, self.poll_interval))
+        except BaseException:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM waiters WHERE id = ?', (waiter_id,))
+            raise
+
+    def _enqueue(self, conn, user_key, enqueued, deadline):
+        current = conn.execute('SELECT round FROM bucket').fetchone()[0]
+        conn.execute('DELETE FROM rounds WHERE next_round <= ?', (current,))
+        row = conn.execute('SELECT next_round FROM rounds WHERE user_key = ?', (user_key,)).fetchone()
+        round_ = max(current, row[0] if row else current)
+        conn.execute('INSERT OR REPLACE INTO rounds (user_key, next_round) VALUES (?, ?)', (user_key, round_ + 1))
+        return conn.execute('INSERT INTO waiters (user_key, round, enqueued, deadline) VALUES (?, ?, ?, ?)',
+                            (user_key, round_, enqueued, deadline)).lastrowid
+
+    def _admit(self, conn, waiter_id, user_key, now):
+        """(slot id, None) when the waiter may go, else (None, seconds to wait)."""
+        conn.execute('DELETE FROM slots WHERE expires <= ?', (now,))
+        conn.execute('DELETE FROM waiters WHERE deadline <= ? AND id != ?', (now, waiter_id))
+
+        tokens, updated, rate_factor, backoff_until = conn.execute(
+            'SELECT tokens, updated, rate_factor, backoff_until FROM bucket').fetchone()
+        rate = self.rate * rate_factor
+        tokens = min(self.burst, tokens + max(now - updated, 0) * rate)
+        conn.execute('UPDATE bucket SET tokens = ?, updated = ?', (tokens, now))
+
+        if backoff_until > now:
+            return None, backoff_until - now
+        if self.max_concurrent and conn.execute('SELECT COUNT(*) FROM slots').fetchone()[0] >= self.max_concurrent:
+            return None, self.poll_interval
+
+        # Earliest round first, skipping users at their limit
+        per_user = self.per_user or 2 ** 31
+        next_waiter = conn.execute(
+            'SELECT w.id, w.round FROM waiters w '
+            'LEFT JOIN (SELECT user_key, COUNT(*) AS n FROM slots GROUP BY user_key) s '
+            'ON s.user_key = w.user_key '
+            'WHERE COALESCE(s.n, 0) < ? ORDER BY w.round, w.id LIMIT 1', (per_user,)).fetchone()
+        if next_waiter is None or next_waiter[0] != waiter_id:
+            return None, self.poll_interval
+
+        if self.rate:
+            if tokens < 1:
+                return None, (1 - tokens) / rate
+            conn.execute('UPDATE bucket SET tokens = tokens - 1')
+        conn.execute('UPDATE bucket SET round = MAX(round, ?)', (next_waiter[1],))
+        conn.execute('DELETE FROM waiters WHERE id = ?', (waiter_id,))
+        slot_id = conn.execute('INSERT INTO slots (user_key, acquired, expires) VALUES (?, ?, ?)',
+                               (user_key, now, now + self.lease)).lastrowid
+        return slot_id, None
+
+    def release(self, slot_id, throttled=False):
+        """Gives the slot back; `throttled` if the provider refused the call."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM slots WHERE id = ?', (slot_id,))
+            if throttled:
+                level, backoff_until = conn.execute('SELECT backoff_level, backoff_until FROM bucket').fetchone()
+                delay = min(self.backoff * 2 ** level, self.backoff_max) * random.uniform(0.5, 1.0)
+                conn.execute('UPDATE bucket SET backoff_level = backoff_level + 1, backoff_until = ?, '
+                             'rate_factor = MAX(rate_factor / 2, ?), tokens = 0',
+                             (max(backoff_until, now + delay), self.min_rate_factor))
+                self._count(conn, 'throttled')
+            else:
+                conn.execute('UPDATE bucket SET backoff_level = 0, rate_factor = MIN(rate_factor + ?, 1.0)',
+                             (self.recovery,))
+
+    @contextmanager
+    def slot(self, user_key, timeout=None):
+        """Holds a slot for the block, see `acquire`."""
+        slot_id = self.acquire(user_key, timeout)
+        throttled = False
+        try:
+            yield
+        except Exception as e:
+            throttled = is_throttled(e)
+            raise
+        finally:
+            self.release(slot_id, throttled)
+
+    def stats(self):
+        """Queue depth, calls in flight and wait times, shared by all processes."""
+        now = time.time()
+        conn = self._connect()
+        counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        queued, oldest = conn.execute('SELECT COUNT(*), MIN(enqueued) FROM waiters WHERE deadline > ?',
+                                      (now,)).fetchone()
+        in_flight = conn.execute('SELECT COUNT(*) FROM slots WHERE expires > ?', (now,)).fetchone()[0]
+        tokens, rate_factor, backoff_until = conn.execute(
+            'SELECT tokens, rate_factor, backoff_until FROM bucket').fetchone()
+        acquired = int(counters.get('acquired', 0))
+        return {
+            'queue_depth': queued,
+            'oldest_wait': now - oldest if oldest else 0.0,
+            'in_flight': in_flight,
+            'tokens': tokens,
+            'rate': self.rate * rate_factor,
+            'backoff_remaining': max(backoff_until - now, 0.0),
+            'acquired': acquired,
+            'timed_out': int(counters.get('timed_out', 0)),
+            'throttled': int(counters.get('throttled', 0)),
+            'wait_avg': counters.get('wait_seconds', 0.0) / acquired if acquired else 0.0,
+            'wait_max': counters.get('wait_seconds_max', 0.0),
+        }
+
+
+def get_governor():
+    """The app's governor, or None when it is disabled."""
+
+    if not has_app_context() or not current_app.config.get('AI_GOVERNOR_ENABLED'):
+        return None
+
+    governor = current_app.extensions.get('ai_governor')
+    if governor is None:
+        config = current_app.config
+        governor = Governor(config['AI_GOVERNOR_PATH'],
+                            rate=config['AI_RATE_LIMIT'],
+                            burst=config['AI_RATE_BURST'],
+                            max_concurrent=config['AI_MAX_CONCURRENCY'],
+                            per_user=config['AI_MAX_CONCURRENCY_PER_USER'],
+                            queue_timeout=config['AI_QUEUE_TIMEOUT'],
+                            lease=config['AI_SLOT_LEASE'],
+                            backoff=config['AI_THROTTLE_BACKOFF'],
+                            backoff_max=config['AI_THROTTLE_BACKOFF_MAX'],
+                            recovery=config['AI_RATE_RECOVERY'])
+        current_app.extensions['ai_governor'] = governor
+    return governor
+
+
+def user_workers(workers):
+    """`workers` capped at the calls one user may have in flight, for thread
+    pools fanning out one user's calls: more threads would only queue."""
+    governor = get_governor()
+    if governor is None or not governor.per_user:
+        return max(workers, 1)
+    return max(min(workers, governor.per_user), 1)
+
+
+@contextmanager
+def governed(timeout=None):
+    """Holds a governor slot for the current user around a model call,
+    waiting at most `timeout` seconds (AI_QUEUE_TIMEOUT if shorter)."""
+    governor = get_governor()
+    if governor is None:
+        yield
+        return
+    if timeout is not None:
+        timeout = min(timeout, governor.queue_timeout)
+    with governor.slot(ai_user_key(), timeout):
+        yield
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+    Registry of the prompts sent to the model.
+
+    Each prompt is registered under a name and a version, e.g.
+
+        register_prompt('test_feedback', 1, '''... {question} ...''',
+                        truncate={'history': 'tail'})
+
+    Templates are parsed once at registration, so rendering only joins
+    strings. A rendered prompt knows its estimated token count, and the
+    variable parts named in `truncate` are cut to keep it under the
+    template's `max_tokens` (PROMPT_MAX_TOKENS by default): 'head' keeps
+    the beginning of the value, 'tail' its end.
+
+    The latest version of a prompt is used unless PROMPT_VERSIONS says
+    otherwise, either one version or weights to split users between
+    versions for an A/B test. The version used is saved with what the
+    prompt produced.
+"""
+
+import hashlib
+import random
+import textwrap
+from collections import namedtuple
+from string import Formatter
+
+from flask import current_app
+
+from ..content.chunking import CHARS_PER_TOKEN, estimate_tokens, split_text
+
+RenderedPrompt = namedtuple('RenderedPrompt', 'text name version tokens truncated')
+
+_registry = {}
+
+TRUNCATION_MARK = '[...]'
+
+
+class PromptTemplate(object):
+    """
+    A versioned prompt, precompiled.
+
+    :param truncate: {field: 'head' | 'tail'} of the fields that may be cut
+    :param max_tokens: budget of the rendered prompt, None for the app's
+    """
+
+    def __init__(self, name, version, template, truncate=None, max_tokens=None):
+        self.name = name
+        self.version = version
+        self.truncate = dict(truncate or {})
+        self.max_tokens = max_tokens
+
+        self._parts = [(literal, field) for literal, field, _, _ in
+                       Formatter().parse(textwrap.dedent(template).strip())]
+        self.fields = {field for _, field in self._parts if field}
+        self.fixed_tokens = estimate_tokens(''.join(literal for literal, _ in self._parts))
+
+        unknown = set(self.truncate) - self.fields
+        if unknown:
+            raise ValueError(f'Prompt {name} v{version} has no field(s) {sorted(unknown)} to truncate')
+
+    @property
+    def label(self):
+        return f'{self.name}@{self.version}'
+
+    def render(self, max_tokens=None, **values):
+        values = {field: '' if values.get(field) is None else str(values[field]) for field in self.fields}
+        truncated = []
+        if max_tokens:
+            budgets = self._budgets(values, max_tokens)
+            for field, budget in budgets.items():
+                if estimate_tokens(values[field]) > budget:
+                    values[field] = _truncate(values[field], budget, self.truncate[field])
+                    truncated.append(field)
+
+        text = ''.join(literal + (values[field] if field else '') for literal, field in self._parts)
+        return RenderedPrompt(text, self.name, self.label, estimate_tokens(text), tuple(sorted(truncated)))
+
+    def _budgets(self, values, max_tokens):
+        """Tokens per truncatable field: the budget left by everything else,
+        shared so that short values keep all of theirs."""
+        fixed = self.fixed_tokens + sum(estimate_tokens(value) for field, value in values.items()
+                                        if field not in self.truncate)
+        left = max(max_tokens - fixed, 0)
+        sizes = sorted((estimate_tokens(values[field]), field) for field in self.truncate)
+        budgets = {}
+        for position, (size, field) in enumerate(sizes):
+            share = left // (len(sizes) - position)
+            budgets[field] = min(size, share)
+            left -= budgets[field]
+        return budgets
+
+
+def _truncate(value, tokens, keep):
+    max_chars = tokens * CHARS_PER_TOKEN
+    if max_chars <= len(TRUNCATION_MARK) + 1:
+        return TRUNCATION_MARK
+    max_chars -= len(TRUNCATION_MARK) + 1
+    if keep == 'tail':
+        tail = value[-max_chars:]
+        # Start on a line, the oldest entries are the ones dropped
+        newline = tail.find('\n')
+        if 0 <= newline < len(tail) // 2:
+            tail = tail[newline + 1:]
+        return TRUNCATION_MARK + '\n' + tail
+    # Cut on the strongest boundary that fits, like the roadmap chunks;
+    # a value with no text to split (only whitespace) is sliced instead
+    chunks = split_text(value, max_chars // CHARS_PER_TOKEN)
+    head = chunks[0].text if chunks else value[:max_chars]
+    return head + '\n' + TRUNCATION_MARK
+
+
+def register_prompt(name, version, template, truncate=None, max_tokens=None):
+    prompt = PromptTemplate(name, version, template, truncate, max_tokens)
+    _registry.setdefault(name, {})[version] = prompt
+    return prompt
+
+
+def get_prompt(name, version=None):
+    """The registered template, the latest version by default."""
+    versions = _registry[name]
+    return versions[version if version is not None else max(versions)]
+
+
+def select_version(name, key=None):
+    """
+    Version of `name` to use. PROMPT_VERSIONS maps a name to a version or
+    to {version: weight}; `key` (e.g. the user id) then keeps the same
+    version for the same user.
+    """
+    choice = current_app.config['PROMPT_VERSIONS'].get(name)
+    if choice is None:
+        return max(_registry[name])
+    if not isinstance(choice, dict):
+        return int(choice)
+
+    total = sum(choice.values())
+    if key is None:
+        point = random.uniform(0, total)
+    else:
+        digest = hashlib.sha256(f'{name}:{key}'.encode('utf-8')).digest()
+        point = int.from_bytes(digest[:8], 'big') / 2 ** 64 * total
+    for version, weight in sorted(choice.items()):
+        point -= weight
+        if point < 0:
+            return int(version)
+    return int(max(choice))
+
+
+def render_prompt(name, key=None, version=None, **values):
+    """Renders `name` (see `select_version`) within its token budget."""
+    prompt = get_prompt(name, version if version is not None else select_version(name, key))
+    rendered = prompt.render(max_tokens=prompt.max_tokens or current_app.config['PROMPT_MAX_TOKENS'], **values)
+    if rendered.truncated:
+        current_app.logger.info(f'Prompt {rendered.version} cut to ~{rendered.tokens} tokens, '
+                                f'truncated: {", ".join(rendered.truncated)}')
+    return rendered
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    Parsing model output that is almost, but not quite, JSON.
+
+    Models wrap answers in ```json fences, add a sentence around them or
+    leave trailing commas. `loads_lenient` fixes those before giving up.
+    An answer cut off at the output limit is not repaired: it fails, so
+    the call is retried instead of saving a clipped last element.
+"""
+
+import json
+import re
+
+_fence = re.compile(r'^\s*```[a-zA-Z]*\s*|\s*```\s*$')
+_trailing_comma = re.compile(r',(\s*[}\]])')
+
+
+def _strip_strings(text):
+    # Trailing comma fixes must not touch commas inside strings
+    parts, start, in_string, escaped = [], 0, False, False
+    for pos, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+                parts.append(('string', text[start:pos + 1]))
+                start = pos + 1
+        elif char == '"':
+            parts.append(('code', text[start:pos]))
+            start = pos
+            in_string = True
+    parts.append(('string' if in_string else 'code', text[start:]))
+    return parts, in_string
+
+
+def _drop_trailing_commas(text):
+    parts, _ = _strip_strings(text)
+    return ''.join(_trailing_comma.sub(r'\1', part) if kind == 'code' else part for kind, part in parts)
+
+
+def repair_json(text):
+    """
+    Valid JSON from `text` with cosmetic faults only: fences, prose around
+    the value, trailing commas. Raises ValueError for a truncated answer
+    (an unterminated string or unclosed brackets), which can't be completed
+    without guessing what was cut off.
+    """
+    text = _fence.sub('', text.strip())
+    starts = [pos for pos in (text.find('{'), text.find('[')) if pos != -1]
+    if starts:
+        text = text[min(starts):]
+
+    parts, in_string = _strip_strings(text)
+    if in_string:
+        raise ValueError('Answer cut off inside a string')
+    depth = 0
+    for kind, part in parts:
+        if kind == 'string':
+            continue
+        for char in part:
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    break
+        if depth == 0:
+            break
+    if depth > 0:
+        raise ValueError('Answer cut off, unclosed brackets')
+    text = _drop_trailing_commas(text)
+
+    # Cut text after the top-level value
+    try:
+        end = json.JSONDecoder().raw_decode(text)[1]
+    except ValueError:
+        return text
+    return text[:end]
+
+
+def loads_lenient(text):
+    """`json.loads`, repairing near-valid JSON; raises ValueError if that fails."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return json.loads(repair_json(text))
+    except ValueError as e:
+        raise ValueError(f'Not valid JSON, even after repair: {e}') from e
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+    Retries, deadlines and a circuit breaker around calls to the model.
+
+    `call_with_retries` gives a call AI_CALL_DEADLINE seconds in total and
+    tries it up to AI_MAX_ATTEMPTS times. Only transient errors are
+    retried, after a jittered exponential delay. A retry is never started
+    when its delay would not fit before the deadline.
+
+    After AI_BREAKER_THRESHOLD timeouts or provider failures in a row the
+    circuit breaker opens. Calls then fail at once with `AICircuitOpen`
+    instead of piling up on a provider that is down. After
+    AI_BREAKER_RESET seconds a single trial call is let through, and its
+    outcome closes the breaker or opens it again. The breaker is kept per
+    process.
+"""
+
+import random
+import threading
+import time
+
+from flask import current_app
+
+from .errors import (AICircuitOpen, AIInvalidResponse, AIQuotaExceeded, AIRequestError, AITimeout,
+                     AIUnavailable, classify)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """Fails fast after `threshold` provider failures in a row."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises `AICircuitOpen` unless a call may go ahead."""
+        if not self.threshold:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN  # this call is the trial
+                return
+            retry_in = max(self.reset_timeout - (time.monotonic() - self.opened_at), 0)
+            raise AICircuitOpen(f'The AI provider is failing, not calling it for {retry_in:.0f}s')
+
+    def record(self, error=None):
+        """Records the outcome of a call, `error` as classified."""
+        provider_failed = isinstance(error, (AITimeout, AIUnavailable)) and not isinstance(error, AICircuitOpen)
+        # Any answer from the provider, even a refusal, shows it is up
+        answered = error is None or isinstance(error, (AIInvalidResponse, AIQuotaExceeded, AIRequestError))
+        with self._lock:
+            if provider_failed:
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= self.threshold:
+                    if self.state != OPEN:
+                        current_app.logger.warning(f'AI circuit breaker opened after: {error}')
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            elif answered:
+                if self.state != CLOSED:
+                    current_app.logger.info('AI circuit breaker closed')
+                self.state = CLOSED
+                self.failures = 0
+            elif self.state == HALF_OPEN:
+                self.state = OPEN  # the trial never reached the provider, the next call tries
+
+
+def get_circuit_breaker():
+    breaker = current_app.extensions.get('ai_circuit_breaker')
+    if breaker is None:
+        breaker = CircuitBreaker(current_app.config['AI_BREAKER_THRESHOLD'],
+                                 current_app.config['AI_BREAKER_RESET'])
+        current_app.extensions['ai_circuit_breaker'] = breaker
+    return breaker
+
+
+def retry_delay(attempt, base, cap):
+    # Full jitter, so callers that failed together don't retry together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retries(func, deadline=None):
+    """
+    Calls `func(timeout)` until it succeeds, `timeout` being the seconds
+    left before the deadline. Raises the last error as an `AIError`.
+    """
+    config = current_app.config
+    breaker = get_circuit_breaker()
+    if deadline is None:
+        deadline = time.monotonic() + config['AI_CALL_DEADLINE']
+
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise AITimeout('The call ran out of time')
+        breaker.before_call()
+        try:
+            result = func(remaining)
+        except Exception as e:
+            error = classify(e)
+            breaker.record(error)
+            attempt += 1
+            if not error.transient or attempt >= config['AI_MAX_ATTEMPTS']:
+                raise error
+            delay = retry_delay(attempt, config['AI_RETRY_BACKOFF'], config['AI_RETRY_BACKOFF_MAX'])
+            if time.monotonic() + delay >= deadline:
+                raise error
+            current_app.logger.info(f'AI call failed ({type(error).__name__}: {error}), '
+                                    f'retry {attempt} in {delay:.1f}s')
+            time.sleep(delay)
+            continue
+        breaker.record()
+        return result
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+    Shapes of the model's JSON answers.
+
+    Passed to the API as `response_schema`, so the model is held to them
+    and prompts don't need to spell out the format with a long example,
+    and used to validate every answer before it is saved. The API takes
+    a subset of JSON schema (see `api_schema`), so nesting is spelled out
+    instead of recursive and lengths are checked by validators.
+"""
+
+from functools import lru_cache
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from .errors import AIInvalidResponse
+
+
+class TestQuestions(BaseModel):
+    generated_question_count: int = Field(description='Number of questions generated')
+    questions: List[str] = Field(description='One open-ended question per item')
+
+    @field_validator('questions')
+    @classmethod
+    def _not_empty(cls, questions):
+        questions = [question.strip() for question in questions if question.strip()]
+        if not questions:
+            raise ValueError('no questions')
+        return questions
+
+
+class Feedback(BaseModel):
+    feedback_text: str
+
+    @field_validator('feedback_text')
+    @classmethod
+    def _not_blank(cls, feedback_text):
+        if not feedback_text.strip():
+            raise ValueError('empty feedback')
+        return feedback_text
+
+
+class RoadmapSubsection(BaseModel):
+    level: int
+    title: str
+    page_start: Optional[int] = None
+    summary: str
+
+
+class RoadmapChapter(BaseModel):
+    level: int
+    title: str
+    page_start: Optional[int] = None
+    summary: str
+    subsections: List[RoadmapSubsection] = []
+
+
+class FileRoadmap(BaseModel):
+    document_title: str
+    structure: List[RoadmapChapter]
+
+
+class ChunkSection(BaseModel):
+    level: int
+    title: str
+    summary: str
+    start_text: str = Field(description='The first 5 to 10 words of the section, copied exactly')
+
+
+class ChunkSections(BaseModel):
+    document_title: Optional[str] = None
+    sections: List[ChunkSection]
+
+
+def validate_response(schema, data):
+    """`data` as an instance of `schema`, `AIInvalidResponse` if it doesn't fit."""
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        raise AIInvalidResponse(f'Answer does not match {schema.__name__}: {e}') from e
+
+
+def validate_element(schema, key, element):
+    """One element of the `key` list of `schema`, validated as it streams in.
+
+    It is checked as a list of one, so the field's own validators apply
+    too. `AIInvalidResponse` if it doesn't fit.
+    """
+    partial = schema.model_construct()
+    try:
+        schema.__pydantic_validator__.validate_assignment(partial, key, [element])
+    except ValidationError as e:
+        raise AIInvalidResponse(f'{key} element does not match {schema.__name__}: {e}') from e
+    return getattr(partial, key)[0]
+
+
+_API_SCHEMA_KEYS = ('type', 'format', 'description', 'nullable', 'enum', 'required')
+
+
+def _api_node(node, definitions):
+    if '$ref' in node:
+        node = definitions[node['$ref'].rsplit('/', 1)[-1]]
+    if 'anyOf' in node:
+        # Optional[X] comes as anyOf X / null
+        variants = [variant for variant in node['anyOf'] if variant.get('type') != 'null']
+        converted = _api_node(variants[0], definitions)
+        converted['nullable'] = True
+        if 'description' in node:
+            converted['description'] = node['description']
+        return converted
+
+    converted = {key: node[key] for key in _API_SCHEMA_KEYS if key in node}
+    if 'properties' in node:
+        converted['properties'] = {name: _api_node(child, definitions)
+                                   for name, child in node['properties'].items()}
+    if 'items' in node:
+        converted['items'] = _api_node(node['items'], definitions)
+    return converted
+
+
+@lru_cache(maxsize=None)
+def api_schema(schema):
+    """`schema` as the JSON schema subset the API takes as `response_schema`."""
+    json_schema = schema.model_json_schema()
+    return _api_node(json_schema, json_schema.get('$defs', {}))
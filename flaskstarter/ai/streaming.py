@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    Incremental parsing of a JSON answer while the model streams it.
+
+    The answers we stream are objects whose payload is a list under one
+    key, e.g. {"generated_question_count": 8, "questions": ["...", ...]} or
+    {"document_title": "...", "structure": [{...}, ...]}. `JSONArrayStream`
+    is fed the text as it arrives and hands out every element of that list
+    as soon as its closing character has been seen.
+"""
+
+import json
+
+from .repair import loads_lenient
+
+
+class JSONArrayStream(object):
+    """
+    Yields the elements of the list under `key` of a streamed JSON object.
+
+        stream = JSONArrayStream('questions')
+        for chunk in chunks:
+            for question in stream.feed(chunk):
+                ...
+        answer = stream.result()  # the whole object, parsed normally
+
+    Only `key` at the top level of the object is looked at. Text before
+    the object (such as a ```json fence) is skipped, and so are elements
+    that aren't valid JSON, `result` then fails on the whole answer.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_key = None  # last string seen at the top level
+        self._capturing = False  # inside the list under `key`
+        self._element_start = None
+        self.skipped = 0  # malformed elements left out
+
+    def feed(self, chunk):
+        """Adds text, returns the list elements completed by it."""
+        self.text += chunk
+        elements = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        try:
+                            self._last_key = json.loads(text[self._string_start:pos + 1])
+                        except ValueError:
+                            self._last_key = None
+                    elif self._capturing and self._depth == 2 and self._element_start == self._string_start:
+                        self._take(pos + 1, elements)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+                if self._capturing and self._depth == 2 and self._element_start is None:
+                    self._element_start = pos
+            elif char in '{[':
+                if self._depth == 0 and char == '[':
+                    continue  # only an object is expected at the top
+                if self._capturing and self._depth == 2 and self._element_start is None:
+                    self._element_start = pos
+                self._depth += 1
+                if self._depth == 2 and char == '[' and self._last_key == self.key:
+                    self._capturing = True
+            elif char in '}]':
+                if self._capturing and self._depth == 2:
+                    # end of the list, a pending number/true/false/null ends too
+                    if self._element_start is not None:
+                        self._take(pos, elements)
+                    self._capturing = False
+                self._depth = max(self._depth - 1, 0)
+                if self._capturing and self._depth == 2 and self._element_start is not None:
+                    self._take(pos + 1, elements)
+            elif char == ',':
+                if self._capturing and self._depth == 2 and self._element_start is not None:
+                    self._take(pos, elements)
+            elif not char.isspace():
+                if self._capturing and self._depth == 2 and self._element_start is None:
+                    self._element_start = pos
+        self._pos = len(text)
+        return elements
+
+    def _take(self, end, elements):
+        text = self.text[self._element_start:end]
+        self._element_start = None
+        try:
+            elements.append(json.loads(text))
+        except ValueError:
+            # Not handed out; whether the answer is usable is up to `result`
+            self.skipped += 1
+
+    def result(self):
+        """The whole answer, once the stream has ended."""
+        return loads_lenient(self.text)
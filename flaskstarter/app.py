@@ -3,12 +3,14 @@
 from flask import Flask
 
 from .config import DefaultConfig
-from .user import Users, UsersAdmin
+from .user import Users, UsersAdmin, PasswordHashBusy
 from .settings import settings
 from .tasks import tasks, MyTaskModelAdmin
 from .frontend import frontend, ContactUsAdmin
 from flask_migrate import Migrate
-from .extensions import db, mail, cache, login_manager, admin, migrate
+from .extensions import db, mail, cache, login_manager, admin, migrate, ai_client
+from .compression import init_compression
+from .database import configure_database, init_database_engines
 from .utils import INSTANCE_FOLDER_PATH, pretty_date
 from .learning_marterial_uploader import learning_material_uploader_bp
 from .test_learning_function import test_learning_function_bp
@@ -62,7 +64,9 @@ def configure_app(app, config=None):
 def configure_extensions(app):
 
     # flask-sqlalchemy
+    configure_database(app)
     db.init_app(app)
+    init_database_engines(app, db)
 
     # flask-mail
     mail.init_app(app)
@@ -70,10 +74,18 @@ def configure_extensions(app):
     # flask-cache
     cache.init_app(app)
 
-    # flask-admin
-    admin.add_view(ContactUsAdmin(db.session))
-    admin.add_view(UsersAdmin(db.session))
-    admin.add_view(MyTaskModelAdmin(db.session))
+    # shared AI model client
+    ai_client.init_app(app)
+
+    # compressed columns, text files and caches
+    init_compression(app)
+
+    # flask-admin. The views are added to the shared Admin once, init_app
+    # registers them with every app created (e.g. one per test).
+    if not any(isinstance(view, UsersAdmin) for view in admin._views):
+        admin.add_view(ContactUsAdmin(db.session))
+        admin.add_view(UsersAdmin(db.session))
+        admin.add_view(MyTaskModelAdmin(db.session))
     admin.init_app(app)
 
     #adding new table to DB
@@ -81,7 +93,7 @@ def configure_extensions(app):
 
     @login_manager.user_loader
     def load_user(id):
-        return Users.query.get(id)
+        return Users.load_cached(id)
     login_manager.setup_app(app)
 
 
@@ -132,3 +144,8 @@ def configure_error_handlers(app):
     @app.errorhandler(500)
     def server_error_page(error):
         return "Oops! Internal server error. Please try after sometime.", 500
+
+    # Views that hash passwords catch it themselves, this covers the others
+    @app.errorhandler(PasswordHashBusy)
+    def password_hash_busy(error):
+        return "Oops! The server is busy. Please try again in a moment.", 503
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+    Helpers around the Flask-Caching `cache`, with hit/miss counters.
+
+    Values are grouped in namespaces ('user', 'tasks', ...). Each namespace
+    counts its hits and misses in this process and logs its hit rate every
+    CACHE_STATS_LOG_EVERY lookups; `cache_stats()` returns the counters,
+    served to admins as JSON at /cache-stats.
+
+    Per user listings are kept under '<namespace>:<user id>' and dropped
+    when a row of the model they list is written, see
+    `invalidate_user_cache_on_change`.
+"""
+
+import threading
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .extensions import cache
+
+
+class CacheStats(object):
+    """Hit and miss counters of one namespace."""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def lookups(self):
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.lookups
+
+        log_every = current_app.config['CACHE_STATS_LOG_EVERY']
+        if log_every and lookups % log_every == 0:
+            current_app.logger.info(f'{self.namespace} cache: {self.hit_rate:.1%} hits '
+                                    f'({self.hits} hits, {self.misses} misses)')
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hit_rate, 4)}
+
+
+_stats = {}
+
+
+def _stats_for(namespace):
+    stats = _stats.get(namespace)
+    if stats is None:
+        stats = _stats.setdefault(namespace, CacheStats(namespace))
+    return stats
+
+
+def cache_stats():
+    """Counters of every namespace used in this process."""
+    return {namespace: stats.as_dict() for namespace, stats in sorted(_stats.items())}
+
+
+def cache_key(namespace, key):
+    return f'{namespace}:{key}'
+
+
+def cache_get(namespace, key):
+    value = cache.get(cache_key(namespace, key))
+    _stats_for(namespace).record(value is not None)
+    return value
+
+
+def cache_set(namespace, key, value, timeout=None):
+    cache.set(cache_key(namespace, key), value, timeout=timeout)
+
+
+def cache_delete(namespace, key):
+    cache.delete(cache_key(namespace, key))
+
+
+def invalidate_user(user_id):
+    """Drops the cached copy of a user, call after changing or deleting one."""
+    cache_delete('user', user_id)
+
+
+def cached_for_user(namespace, user_id, loader, timeout=None):
+    """`loader()` cached per user, for values that are never None.
+
+    Kept CACHE_LISTING_TIMEOUT seconds unless `timeout` is given.
+    """
+    value = cache_get(namespace, user_id)
+    if value is None:
+        value = loader()
+        if timeout is None:
+            timeout = current_app.config['CACHE_LISTING_TIMEOUT']
+        cache_set(namespace, user_id, value, timeout=timeout)
+    return value
+
+
+def _pending_invalidations(session):
+    return session.info.setdefault('cache_invalidations', set())
+
+
+def invalidate_for_user_on_commit(session, namespace, user_id):
+    """Drop the user's `namespace` listing once `session` commits.
+
+    For writes that bypass the ORM events, such as bulk inserts.
+    """
+    _pending_invalidations(session).add((namespace, user_id))
+
+
+def invalidate_user_cache_on_change(model, namespace, user_attr='user_id'):
+    """Drop the user's `namespace` listing whenever a `model` row is written.
+
+    Deletion waits for the commit, so the listing isn't reloaded before the
+    change is visible to other connections.
+    """
+
+    def changed(mapper, connection, target):
+        session = Session.object_session(target)
+        user_id = getattr(target, user_attr)
+        if session is not None and user_id is not None:
+            invalidate_for_user_on_commit(session, namespace, user_id)
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for namespace, user_id in session.info.pop('cache_invalidations', ()):
+        cache_delete(namespace, user_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_invalidations(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('cache_invalidations', None)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+    Transparent compression of stored text and JSON.
+
+    Every blob starts with a codec tag and the id of the dictionary it was
+    compressed with (0 for none), so values written with any codec or
+    dictionary can still be read after the configuration changes. zstd is
+    used when the `zstandard` package is installed, zlib otherwise.
+
+    Dictionaries trained on our own content (`flask
+    train-compression-dictionary`) help a lot with many small, similar
+    values such as roadmaps and feedback. Every dictionary ever used is
+    kept in COMPRESSION_DICTIONARY_DIR, the newest compresses new values.
+"""
+
+import glob
+import json
+import os
+import re
+import struct
+import zlib
+from collections import Counter
+
+from sqlalchemy import types
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is used instead
+    zstandard = None
+
+
+# Tags are control bytes, which never start text or JSON stored before
+# compression was introduced, so those values are still read as is.
+RAW, ZLIB, ZSTD = b'\x00', b'\x01', b'\x02'
+HEADER = struct.Struct('>cI')  # tag, dictionary id
+
+# Values smaller than this aren't worth compressing
+MIN_SIZE = 64
+
+# zlib only looks back 32KB, a larger dictionary is wasted
+ZLIB_MAX_DICTIONARY = 32 * 1024
+
+_fragment = re.compile(rb'[^\n,.;:{}\[\]]*[\n,.;:{}\[\]]')
+
+
+def dictionary_id(dictionary):
+    return (zlib.crc32(dictionary) or 1) if dictionary else 0
+
+
+class Compressor(object):
+    """
+    Compresses bytes with zstd or zlib, optionally with a shared dictionary.
+
+    :param codec: 'zstd', 'zlib', 'none' or 'auto' (zstd when installed)
+    :param level: compression level, None for the codec's default
+    :param dictionaries: dictionaries from `train_dictionary`, oldest
+                         first. The last one is used to compress, all of
+                         them can be read.
+    """
+
+    def __init__(self, codec='auto', level=None, dictionaries=()):
+        if codec == 'auto':
+            codec = 'zstd' if zstandard is not None else 'zlib'
+        if codec == 'zstd' and zstandard is None:
+            raise RuntimeError('zstd compression needs the zstandard package')
+        self.codec = codec
+        self.level = level
+
+        self._dictionaries = {}
+        for dictionary in dictionaries:
+            self._dictionaries[dictionary_id(dictionary)] = dictionary
+        self.dictionary_id = dictionary_id(dictionaries[-1]) if dictionaries else 0
+        self._zstd_dicts = {}
+
+    def _zstd_dict(self, used_dictionary):
+        if not used_dictionary:
+            return None
+        zstd_dict = self._zstd_dicts.get(used_dictionary)
+        if zstd_dict is None:
+            zstd_dict = zstandard.ZstdCompressionDict(self._dictionary(used_dictionary))
+            self._zstd_dicts[used_dictionary] = zstd_dict
+        return zstd_dict
+
+    def _dictionary(self, used_dictionary):
+        try:
+            return self._dictionaries[used_dictionary]
+        except KeyError:
+            raise ValueError(f'Value was compressed with dictionary {used_dictionary:08x}, '
+                             f'which is not loaded')
+
+    def compress(self, data):
+        if self.codec == 'none' or len(data) < MIN_SIZE:
+            return HEADER.pack(RAW, 0) + data
+
+        if self.codec == 'zstd':
+            level = self.level if self.level is not None else 3
+            compressor = zstandard.ZstdCompressor(level=level, dict_data=self._zstd_dict(self.dictionary_id))
+            return HEADER.pack(ZSTD, self.dictionary_id) + compressor.compress(data)
+
+        level = self.level if self.level is not None else zlib.Z_DEFAULT_COMPRESSION
+        if self.dictionary_id:
+            compressor = zlib.compressobj(level, zdict=self._dictionary(self.dictionary_id)[-ZLIB_MAX_DICTIONARY:])
+        else:
+            compressor = zlib.compressobj(level)
+        return HEADER.pack(ZLIB, self.dictionary_id) + compressor.compress(data) + compressor.flush()
+
+    def decompress(self, blob):
+        blob = bytes(blob)
+        if not blob or blob[:1] not in (RAW, ZLIB, ZSTD):
+            return blob  # stored before compression was introduced
+        tag, used_dictionary = HEADER.unpack_from(blob)
+        data = blob[HEADER.size:]
+
+        if tag == RAW:
+            return data
+        if tag == ZLIB:
+            if used_dictionary:
+                decompressor = zlib.decompressobj(zdict=self._dictionary(used_dictionary)[-ZLIB_MAX_DICTIONARY:])
+            else:
+                decompressor = zlib.decompressobj()
+            return decompressor.decompress(data) + decompressor.flush()
+        if zstandard is None:
+            raise RuntimeError('Value is zstd compressed, install the zstandard package to read it')
+        return zstandard.ZstdDecompressor(dict_data=self._zstd_dict(used_dictionary)).decompress(data)
+
+
+def train_dictionary(samples, size=16 * 1024, codec='auto'):
+    """Dictionary for a corpus of sample values (bytes).
+
+    zstd trains one properly. For zlib the fragments (text between
+    punctuation, JSON keys with their delimiters) shared by most samples
+    are packed, the most common last as zlib favors the nearest matches.
+    """
+    samples = [sample for sample in samples if sample]
+    if codec == 'auto':
+        codec = 'zstd' if zstandard is not None else 'zlib'
+    if codec == 'zstd':
+        return zstandard.train_dictionary(size, samples).as_bytes()
+
+    size = min(size, ZLIB_MAX_DICTIONARY)
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(fragment for fragment in _fragment.findall(sample) if len(fragment) > 3))
+    chosen, total = [], 0
+    for fragment, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2 or total + len(fragment) > size:
+            continue
+        chosen.append(fragment)
+        total += len(fragment)
+    return b''.join(reversed(chosen))
+
+
+_compressor = Compressor(codec='zlib')
+
+
+def get_compressor():
+    return _compressor
+
+
+def set_compressor(compressor):
+    global _compressor
+    _compressor = compressor
+
+
+def load_dictionaries(directory):
+    """Dictionaries saved in `directory`, oldest first."""
+    if not directory or not os.path.isdir(directory):
+        return []
+    dictionaries = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.dict')), key=os.path.getmtime):
+        with open(path, 'rb') as f:
+            dictionaries.append(f.read())
+    return dictionaries
+
+
+def save_dictionary(directory, dictionary):
+    """Adds a dictionary, which becomes the one used for new values.
+
+    Older ones are kept since existing values still need them.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{dictionary_id(dictionary):08x}.dict')
+    with open(path, 'wb') as f:
+        f.write(dictionary)
+    return path
+
+
+def init_compression(app):
+    """Sets up the process wide compressor from the app config."""
+    config = app.config
+    set_compressor(Compressor(codec=config['COMPRESSION_CODEC'],
+                              level=config['COMPRESSION_LEVEL'],
+                              dictionaries=load_dictionaries(config['COMPRESSION_DICTIONARY_DIR'])))
+
+
+def compress_text(text):
+    return get_compressor().compress(text.encode('utf-8'))
+
+
+def decompress_text(blob):
+    return get_compressor().decompress(blob).decode('utf-8')
+
+
+class CompressedText(types.TypeDecorator):
+    """
+    Stores a string compressed in a binary column.
+
+    Values written as plain text before the column was compressed are
+    still read.
+    """
+
+    impl = types.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = compress_text(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress_text(value)
+
+
+class CompressedJSON(CompressedText):
+    """Stores any JSON serializable value, compact and compressed."""
+
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+        return super(CompressedJSON, self).process_bind_param(value, dialect)
+
+    def process_result_value(self, value, dialect):
+        value = super(CompressedJSON, self).process_result_value(value, dialect)
+        if value is None:
+            return None
+        return json.loads(value)
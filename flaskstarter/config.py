@@ -29,15 +29,42 @@ class DefaultConfig(BaseConfig):
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    # SQLITE for production
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + INSTANCE_FOLDER_PATH + '/db.sqlite'
-    #like a link to where store the datafile
-    # POSTGRESQL for production
-    # SQLALCHEMY_DATABASE_URI = 'postgresql+psycopg2://postgres:pass@ip/dbname'
-
-    # Flask-cache
-    CACHE_TYPE = 'simple'
+    # SQLite in the instance folder unless DATABASE_URL is set, e.g.
+    # DATABASE_URL=postgresql+psycopg2://postgres:pass@ip/dbname
+    # Engine options are filled in by database.configure_database.
+    SQLALCHEMY_DATABASE_URI = (os.environ.get('DATABASE_URL')
+                               or 'sqlite:///' + os.path.join(INSTANCE_FOLDER_PATH, 'db.sqlite'))
+
+    # SQLite connections
+    SQLITE_JOURNAL_MODE = 'WAL'  # readers don't block the writer
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # safe with WAL, fsync on checkpoints only
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))  # seconds to wait for the lock
+
+    # Connection pool of other databases, per process
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = 1800  # seconds, below server and proxy idle timeouts
+    DB_POOL_PRE_PING = True
+
+    # Flask-cache. The filesystem cache is shared by all worker processes on
+    # the host, which per user listings and invalidation rely on.
+    CACHE_TYPE = 'FileSystemCache'
+    CACHE_DIR = os.path.join(INSTANCE_FOLDER_PATH, 'cache')
+    CACHE_THRESHOLD = 10000  # files kept before the oldest are pruned
     CACHE_DEFAULT_TIMEOUT = 60
+    CACHE_LISTING_TIMEOUT = 300  # seconds, see caching.cached_for_user
+    CACHE_STATS_LOG_EVERY = 1000  # log hit rates every N lookups, 0 to never
+
+    # Seconds the logged in user is served from the cache, 0 to disable
+    USER_CACHE_TIMEOUT = 60
+
+    # Password hashing, see user/passwords.py. Any Werkzeug method string;
+    # existing hashes are upgraded when their owner next logs in.
+    PASSWORD_HASH_METHOD = 'scrypt:16384:8:1'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = 4  # hashes computed at once, 0 for no pool
+    PASSWORD_HASH_TIMEOUT = 10  # seconds, a login fails with "try again" after
 
     # Flask-mail
     MAIL_DEBUG = False
@@ -50,6 +77,107 @@ class DefaultConfig(BaseConfig):
     MAIL_PASSWORD = ""
     MAIL_DEFAULT_SENDER = MAIL_USERNAME
 
+    # Outbox, see emails/outbox.py. Mail is sent by the job workers.
+    MAIL_BATCH_SIZE = 50  # messages sent over one SMTP connection
+    MAIL_RATE_LIMIT = 5  # messages per second, 0 for no limit
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30  # seconds, doubled on every attempt
+    MAIL_RETRY_BACKOFF_MAX = 3600
+
+    # AI model client, see ai/client.py. Use 'fake' to run without the API.
+    AI_BACKEND = 'gemini'
+    AI_MODEL_NAME = 'gemini-2.5-flash'
+    AI_GENERATION_CONFIG = {'response_mime_type': 'application/json'}
+    AI_REQUEST_TIMEOUT = 120  # seconds per attempt
+    AI_FAKE_LATENCY = 0.0  # seconds slept per call by the fake backend
+
+    # Retries and circuit breaker, see ai/resilience.py
+    AI_CALL_DEADLINE = 180  # seconds for a call, retries and waits included
+    AI_MAX_ATTEMPTS = 3
+    AI_RETRY_BACKOFF = 1  # seconds, doubled on every attempt, jittered
+    AI_RETRY_BACKOFF_MAX = 20
+    AI_BREAKER_THRESHOLD = 5  # failures in a row that open the breaker, 0 to disable
+    AI_BREAKER_RESET = 30  # seconds before a trial call
+
+    # Limits on calls to the model shared by the processes of a host, see
+    # ai/governor.py
+    AI_GOVERNOR_ENABLED = True
+    AI_GOVERNOR_PATH = os.path.join(INSTANCE_FOLDER_PATH, 'ai_governor.sqlite')
+    AI_RATE_LIMIT = 5  # calls per second, 0 for no limit
+    AI_RATE_BURST = 10
+    AI_MAX_CONCURRENCY = 8  # calls in flight, 0 for no limit
+    AI_MAX_CONCURRENCY_PER_USER = 2
+    AI_QUEUE_TIMEOUT = 120  # seconds a call waits for its turn, at least AI_REQUEST_TIMEOUT
+    AI_SLOT_LEASE = 300  # seconds, slots of dead processes are freed after
+    AI_THROTTLE_BACKOFF = 2  # seconds paused on a 429/503, doubled on each
+    AI_THROTTLE_BACKOFF_MAX = 60
+    AI_RATE_RECOVERY = 0.1  # share of the rate won back per successful call
+
+    # Prompt templates, see ai/prompts.py. PROMPT_VERSIONS pins a prompt to a
+    # version, {'test_questions': 1}, or splits users between versions,
+    # {'test_questions': {1: 0.5, 2: 0.5}}; the latest is used otherwise.
+    PROMPT_VERSIONS = {}
+    PROMPT_MAX_TOKENS = 200000  # estimated, material is truncated to fit
+
+    # Persistent cache of AI responses, see ai/cache.py
+    AI_CACHE_ENABLED = True
+    AI_CACHE_PATH = os.path.join(INSTANCE_FOLDER_PATH, 'ai_cache.sqlite')
+    AI_CACHE_TTL = 7 * 24 * 3600  # seconds
+    AI_CACHE_MAX_ENTRIES = 10000
+    AI_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+    # Fetching learning material URLs, see content/fetcher.py
+    FETCH_CONNECT_TIMEOUT = 5  # seconds
+    FETCH_TIMEOUT = 10  # seconds
+    FETCH_POOL_SIZE = 32  # kept-alive connections per host
+    FETCH_MAX_WORKERS = 16
+    FETCH_PER_HOST_LIMIT = 4  # concurrent requests to one site
+    READING_LIST_MAX_URLS = 50
+
+    # Cache of text extracted from URLs, see content/cache.py
+    CONTENT_CACHE_ENABLED = True
+    CONTENT_CACHE_PATH = os.path.join(INSTANCE_FOLDER_PATH, 'content_cache.sqlite')
+    CONTENT_CACHE_FRESH_FOR = 6 * 3600  # seconds served without revalidating
+    CONTENT_CACHE_TTL = 30 * 24 * 3600  # seconds
+    CONTENT_CACHE_MAX_ENTRIES = 5000
+    CONTENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+    # Article text extraction, see content/extract.py
+    CONTENT_EXTRACTOR = 'density'  # or 'selector'
+    CONTENT_HTML_PARSER = 'auto'  # lxml when installed, else html.parser
+
+    # Read txt/md/docx/pptx (and pdf with pypdf) locally and send the text
+    # to the model instead of uploading the file, see content/documents.py
+    LOCAL_TEXT_EXTRACTION = True
+
+    # Roadmaps of long text are built from chunks analyzed in parallel,
+    # see learning_marterial_uploader/roadmap.py
+    ROADMAP_CHUNK_TOKENS = 8000
+    ROADMAP_MAX_WORKERS = 4  # at most AI_MAX_CONCURRENCY_PER_USER
+
+    # Compression of stored text and AI output, see compression.py
+    COMPRESSION_CODEC = 'auto'  # zstd when installed, else zlib; or 'none'
+    COMPRESSION_LEVEL = None  # codec default
+    COMPRESSION_DICTIONARY_DIR = os.path.join(INSTANCE_FOLDER_PATH, 'compression_dictionaries')
+
+    # Chunked uploads of large files
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+    UPLOAD_SESSION_TTL = 24 * 3600  # seconds before an unfinished upload is dropped
+
+    # Test banks, see test_learning_function/tasks.py
+    TEST_BANK_MAX_TESTS = 20  # tests per request
+    TEST_BANK_MAX_WORKERS = 4  # prompts in flight per bank, at most AI_MAX_CONCURRENCY_PER_USER
+    TEST_BANK_POLL_INTERVAL = 1.0  # seconds between progress events
+
+    # Background jobs (see jobs/queue.py), run workers with `flask run-workers`
+    JOB_WORKERS = 4
+    JOB_POLL_INTERVAL = 1.0  # seconds between polls when the queue is empty
+    JOB_MAX_ATTEMPTS = 3
+    JOB_TIMEOUT = 300  # seconds
+    JOB_RETRY_BACKOFF = 10  # seconds, doubled on every attempt
+    JOB_RETRY_BACKOFF_MAX = 600
+
 # Folder for user uploads, relative to the instance path is good
 USER_UPLOADS_FOLDER = 'user_uploads' 
 # Supported file formats for your AI pipeline
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from .documents import DocumentExtractionError, extract_document_text
+from .extract import DensityExtractor, SelectorExtractor, get_extractor
+from .fetcher import Fetcher, FetchResult, get_fetcher
+from .sources import FetchFailure, extract_article_text, get_content, get_contents
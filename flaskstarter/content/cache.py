@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+    Cache of text extracted from URLs.
+
+    Keyed by the normalized URL (or `youtube:<video id>`), so the many
+    spellings of a popular link share one entry. Entries younger than
+    `fresh_for` are served without any network I/O; older article entries
+    are revalidated with a conditional request before being re-parsed.
+"""
+
+import json
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from flask import current_app, has_app_context
+
+from ..compression import compress_text, decompress_text
+from ..sqlite_cache import SQLiteCache
+
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+                 'youtube-nocookie.com', 'www.youtube-nocookie.com')
+YOUTU_BE_HOSTS = ('youtu.be', 'www.youtu.be')
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = ('fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'si')
+
+
+def youtube_video_id(url):
+    """Video ID of any common YouTube link form, or None."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().split(':')[0]
+    path = [segment for segment in parts.path.split('/') if segment]
+
+    if host in YOUTU_BE_HOSTS:
+        return path[0] if path else None
+    if host in YOUTUBE_HOSTS:
+        if path[:1] == ['watch']:
+            return dict(parse_qsl(parts.query)).get('v') or None
+        if len(path) >= 2 and path[0] in ('shorts', 'embed', 'live', 'v'):
+            return path[1]
+    return None
+
+
+def normalize_url(url):
+    """Cache key for a URL.
+
+    YouTube links become `youtube:<video id>`. Other URLs get a lower-case
+    scheme and host, no default port, no fragment, no tracking parameters
+    and sorted query parameters.
+    """
+    video_id = youtube_video_id(url)
+    if video_id:
+        return f'youtube:{video_id}'
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parts.port}'
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.startswith('utm_') and key not in TRACKING_PARAMS)
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+CachedContent = namedtuple('CachedContent', 'text etag last_modified fetched_at')
+
+
+class ExtractionCache(SQLiteCache):
+    """Extracted text plus the validators needed to revalidate it."""
+
+    def __init__(self, path, fresh_for, **kwargs):
+        self.fresh_for = fresh_for
+        super(ExtractionCache, self).__init__(path, **kwargs)
+
+    def get_content(self, key):
+        value = self.get(key)
+        if value is None:
+            return None
+        return CachedContent(**json.loads(decompress_text(value)))
+
+    def set_content(self, key, text, etag=None, last_modified=None):
+        entry = CachedContent(text, etag, last_modified, time.time())
+        self.set(key, compress_text(json.dumps(entry._asdict(), separators=(',', ':'))))
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched_at < self.fresh_for
+
+
+def get_extraction_cache():
+    """The app's extraction cache, or None when it is disabled."""
+
+    if not has_app_context() or not current_app.config.get('CONTENT_CACHE_ENABLED'):
+        return None
+
+    cache = current_app.extensions.get('content_extraction_cache')
+    if cache is None:
+        config = current_app.config
+        cache = ExtractionCache(config['CONTENT_CACHE_PATH'],
+                                fresh_for=config['CONTENT_CACHE_FRESH_FOR'],
+                                ttl=config['CONTENT_CACHE_TTL'],
+                                max_entries=config['CONTENT_CACHE_MAX_ENTRIES'],
+                                max_bytes=config['CONTENT_CACHE_MAX_BYTES'])
+        current_app.extensions['content_extraction_cache'] = cache
+    return cache
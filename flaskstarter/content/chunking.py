@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Splits long text into pieces that fit a model's token budget.
+
+    Cuts are made on the strongest structural boundary available near the
+    end of each piece: a heading or page/slide marker, then a blank line,
+    a line break, a sentence end and finally any whitespace. Every chunk
+    keeps its character offsets into the original text.
+"""
+
+import re
+from collections import namedtuple
+
+
+# Rough average for English prose, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+Chunk = namedtuple('Chunk', 'index start end text')
+
+# Strongest first. Each pattern matches at the position to cut.
+BOUNDARIES = [
+    re.compile(r'\n(?=#{1,6} |--- (?:Page|Slide) \d+ ---|(?:\d+\.)+\d*\s+\S|[A-Z][A-Z0-9 ,:&-]{3,}\n)'),
+    re.compile(r'\n[ \t]*\n'),
+    re.compile(r'\n'),
+    re.compile(r'(?<=[.!?])\s'),
+    re.compile(r'\s'),
+]
+
+# Don't cut before this fraction of the budget, so chunks stay reasonably full
+MIN_FILL = 0.5
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _cut(text, start, limit):
+    """Position to end the chunk starting at `start`, at most `limit`."""
+    floor = start + int((limit - start) * MIN_FILL)
+    for pattern in BOUNDARIES:
+        last = None
+        for match in pattern.finditer(text, floor, limit):
+            last = match
+        if last is not None and last.start() > start:
+            return last.start()
+    return limit
+
+
+def split_text(text, max_tokens):
+    """Splits `text` into chunks of at most `max_tokens` (estimated)."""
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    start = 0
+    while start < len(text):
+        # Don't start a chunk on the whitespace left by the previous cut
+        while start < len(text) and text[start].isspace():
+            start += 1
+        if start >= len(text):
+            break
+        end = len(text) if len(text) - start <= max_chars else _cut(text, start, start + max_chars)
+        chunks.append(Chunk(len(chunks), start, end, text[start:end]))
+        start = end
+    return chunks
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+    Plain text from uploaded documents, without calling the model.
+
+    docx and pptx are zip files of XML and are read with the standard
+    library. PDFs need pypdf (in requirements.txt); when it is missing, or
+    a PDF has no text layer (e.g. a scan), `extract_document_text` returns
+    None and the file is sent to the model as before.
+
+    PDF pages and PPTX slides are separated by `--- Page N ---` /
+    `--- Slide N ---` markers so the model can still refer to them.
+"""
+
+import re
+import zipfile
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+except ImportError:  # optional, PDFs are then analyzed by the model
+    PdfReader = PyPdfError = None
+
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+
+# A PDF with less text than this per page is most likely scanned
+MIN_PDF_CHARS_PER_PAGE = 40
+
+_slide_name = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+_blank_lines = re.compile(r'\n{3,}')
+
+# What the readers raise on a damaged file
+READ_ERRORS = tuple(error for error in (zipfile.BadZipFile, KeyError, ElementTree.ParseError, PyPdfError)
+                    if error is not None)
+
+
+class DocumentExtractionError(Exception):
+    """The file is damaged or not the format its extension claims."""
+
+
+def page_marker(kind, number):
+    return f'--- {kind} {number} ---'
+
+
+def decode_text(data):
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors='replace')
+
+
+def _paragraphs(xml_file, paragraph_tag, text_tag, tab_tag=None, break_tag=None):
+    """Yields the text of each paragraph of an OOXML part, streaming it."""
+    parts = []
+    for _, element in ElementTree.iterparse(xml_file, events=('end',)):
+        tag = element.tag
+        if tag == text_tag:
+            parts.append(element.text or '')
+        elif tag == tab_tag:
+            parts.append('\t')
+        elif tag == break_tag:
+            parts.append('\n')
+        elif tag == paragraph_tag:
+            text = ''.join(parts).strip()
+            if text:
+                yield text
+            parts = []
+            element.clear()
+
+
+def extract_txt(path):
+    with open(path, 'rb') as f:
+        return decode_text(f.read())
+
+
+def extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('word/document.xml') as xml_file:
+            return '\n'.join(_paragraphs(xml_file, WORD_NS + 'p', WORD_NS + 't',
+                                         WORD_NS + 'tab', WORD_NS + 'br'))
+
+
+def extract_pptx(path):
+    with zipfile.ZipFile(path) as archive:
+        slides = sorted((int(match.group(1)), name) for name in archive.namelist()
+                        for match in [_slide_name.match(name)] if match)
+        pages = []
+        for number, name in slides:
+            with archive.open(name) as xml_file:
+                text = '\n'.join(_paragraphs(xml_file, DRAWING_NS + 'p', DRAWING_NS + 't',
+                                             break_tag=DRAWING_NS + 'br'))
+            pages.append(f'{page_marker("Slide", number)}\n{text}')
+    return '\n\n'.join(pages)
+
+
+def extract_pdf(path):
+    if PdfReader is None:
+        return None
+    try:
+        return _pdf_text(path)
+    except DocumentExtractionError:
+        raise
+    except Exception as e:
+        # pypdf raises all sorts of errors on malformed files, not only PyPdfError
+        raise DocumentExtractionError(f'Could not read pdf file: {type(e).__name__}: {e}') from e
+
+
+def _pdf_text(path):
+    reader = PdfReader(path)
+    pages = []
+    chars = 0
+    for number, page in enumerate(reader.pages, 1):
+        text = (page.extract_text() or '').strip()
+        chars += len(text)
+        pages.append(f'{page_marker("Page", number)}\n{text}')
+    if not pages or chars < MIN_PDF_CHARS_PER_PAGE * len(pages):
+        return None
+    return '\n\n'.join(pages)
+
+
+EXTRACTORS = {
+    'txt': extract_txt,
+    'md': extract_txt,
+    'docx': extract_docx,
+    'pptx': extract_pptx,
+    'pdf': extract_pdf,
+}
+
+
+def extract_document_text(path, extension):
+    """Text of the document at `path`, or None if it can't be read locally.
+
+    Raises `DocumentExtractionError` if the file is damaged.
+    """
+    extractor = EXTRACTORS.get((extension or '').lower())
+    if extractor is None:
+        return None
+    try:
+        text = extractor(path)
+    except READ_ERRORS as e:
+        raise DocumentExtractionError(f'Could not read {extension} file: {e}')
+    if text is None:
+        return None
+    text = _blank_lines.sub('\n\n', text).strip()
+    return text or None
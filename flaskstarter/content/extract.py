@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+    Main-content extraction from article HTML.
+
+    Two engines share one interface, `extract(html) -> text`:
+
+    - `SelectorExtractor` builds a full BeautifulSoup tree and takes the first
+      match of a list of well known CSS selectors (the original behaviour).
+    - `DensityExtractor` streams the page once, drops script/style/nav and
+      other boilerplate as it goes, and picks the element whose paragraphs
+      carry the most non-link text.
+
+    lxml is used as the parser when it is installed, the standard library
+    parser otherwise.
+"""
+
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+from flask import current_app, has_app_context
+
+try:
+    from lxml import etree
+except ImportError:  # optional, only faster
+    etree = None
+
+
+HAS_LXML = etree is not None
+
+# Subtrees skipped entirely
+PRUNED_TAGS = frozenset(('script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside',
+                         'form', 'svg', 'iframe', 'button', 'select', 'template', 'head'))
+
+# Tags that start a new line/paragraph of text
+BLOCK_TAGS = frozenset(('p', 'div', 'article', 'main', 'section', 'li', 'ul', 'ol', 'td', 'th',
+                        'tr', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote',
+                        'dd', 'dt', 'dl', 'figcaption', 'br', 'hr', 'body'))
+
+VOID_TAGS = frozenset(('br', 'hr', 'img', 'input', 'meta', 'link', 'area', 'base', 'col',
+                       'embed', 'source', 'track', 'wbr'))
+
+# Opening one of these closes an unclosed sibling of the same kind
+SELF_CLOSING_SIBLINGS = frozenset(('p', 'li', 'td', 'th', 'tr', 'dd', 'dt', 'option'))
+
+# Containers that are likely the main content get a head start
+CONTAINER_BONUS = {'article': 1.5, 'main': 1.3, 'section': 1.1}
+
+# Paragraphs shorter than this don't count towards a container's score
+MIN_BLOCK_CHARS = 25
+
+_whitespace = re.compile(r'\s+')
+
+
+def decode_html(html):
+    if isinstance(html, str):
+        return html
+    try:
+        return html.decode('utf-8')
+    except UnicodeDecodeError:
+        return html.decode('cp1252', errors='replace')
+
+
+class SelectorExtractor(object):
+    """First match of a list of CSS selectors, else the whole body."""
+
+    selectors = ['article', 'main', 'div[role="main"]', 'div#main', 'div#content', 'div.post-content', 'div.article-body']
+
+    def __init__(self, parser='html.parser'):
+        self.parser = parser
+
+    def extract(self, html):
+        soup = BeautifulSoup(html, self.parser)
+
+        content_area = None
+        for selector in self.selectors:
+            content_area = soup.select_one(selector)
+            if content_area:
+                break
+
+        if content_area:
+            return content_area.get_text(separator='\n', strip=True)
+        if soup.body is None:
+            return soup.get_text(separator='\n', strip=True)
+        return soup.body.get_text(separator='\n', strip=True)
+
+
+class _DensityTarget(object):
+    """Parser target collecting text blocks and the elements containing them.
+
+    Works with lxml's `target` parser interface and, through
+    `_StdlibParser`, with `html.parser`.
+    """
+
+    def __init__(self):
+        self.stack = []          # open elements as (tag, node id)
+        self.tags = {}           # node id -> tag
+        self.blocks = []         # (text, link chars, ancestor node ids)
+        self.pruned = 0          # depth inside a pruned subtree
+        self.links = 0           # depth inside <a>
+        self.buffer = []
+        self.link_chars = 0
+        self.next_id = 0
+
+    def flush(self):
+        text = _whitespace.sub(' ', ''.join(self.buffer)).strip()
+        if text:
+            ancestors = tuple(node for _, node in self.stack)
+            self.blocks.append((text, min(self.link_chars, len(text)), ancestors))
+        self.buffer = []
+        self.link_chars = 0
+
+    def start(self, tag, attrib=None):
+        tag = tag.lower() if isinstance(tag, str) else ''
+        if self.pruned:
+            if tag in PRUNED_TAGS and tag not in VOID_TAGS:
+                self.pruned += 1
+            return
+        if tag in PRUNED_TAGS:
+            self.flush()
+            self.pruned = 1
+            return
+        if tag in BLOCK_TAGS:
+            self.flush()
+        if tag == 'a':
+            self.links += 1
+        if tag in VOID_TAGS:
+            return
+        if tag in SELF_CLOSING_SIBLINGS and self.stack and self.stack[-1][0] == tag:
+            self.stack.pop()
+        self.tags[self.next_id] = tag
+        self.stack.append((tag, self.next_id))
+        self.next_id += 1
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ''
+        if self.pruned:
+            if tag in PRUNED_TAGS:
+                self.pruned -= 1
+            return
+        if tag in BLOCK_TAGS:
+            self.flush()
+        if tag == 'a' and self.links:
+            self.links -= 1
+        # Close up to the matching element, stray end tags are ignored
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+
+    def data(self, text):
+        if self.pruned:
+            return
+        self.buffer.append(text)
+        if self.links:
+            self.link_chars += len(text.strip())
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        self.flush()
+        return self.select()
+
+    def select(self):
+        """Text of the best scoring container, in document order."""
+        if not self.blocks:
+            return ''
+
+        scores = {}
+        for text, link_chars, ancestors in self.blocks:
+            if len(text) < MIN_BLOCK_CHARS or not ancestors:
+                continue
+            score = len(text) * (1.0 - link_chars / len(text))
+            # The paragraph's container gets the full score, its parent half
+            scores[ancestors[-1]] = scores.get(ancestors[-1], 0) + score
+            if len(ancestors) > 1:
+                scores[ancestors[-2]] = scores.get(ancestors[-2], 0) + score / 2
+
+        if not scores:
+            return '\n'.join(text for text, _, _ in self.blocks)
+
+        best = max(scores, key=lambda node: scores[node] * CONTAINER_BONUS.get(self.tags[node], 1.0))
+        return '\n'.join(text for text, _, ancestors in self.blocks if best in ancestors)
+
+
+class _StdlibParser(HTMLParser):
+    """Feeds `html.parser` events into a `_DensityTarget`."""
+
+    def __init__(self, target):
+        super(_StdlibParser, self).__init__(convert_charrefs=True)
+        self.target = target
+
+    def handle_starttag(self, tag, attrs):
+        self.target.start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.target.start(tag)
+        if tag not in VOID_TAGS:
+            self.target.end(tag)
+
+    def handle_endtag(self, tag):
+        self.target.end(tag)
+
+    def handle_data(self, data):
+        self.target.data(data)
+
+
+class DensityExtractor(object):
+    """Single pass extractor choosing the block with the densest text."""
+
+    def __init__(self, parser='auto'):
+        self.use_lxml = HAS_LXML and parser in ('auto', 'lxml')
+
+    def extract(self, html):
+        target = _DensityTarget()
+        if self.use_lxml:
+            parser = etree.HTMLParser(target=target, remove_comments=True, no_network=True)
+            parser.feed(html if isinstance(html, bytes) else html.encode('utf-8'))
+            return parser.close()
+
+        parser = _StdlibParser(target)
+        parser.feed(decode_html(html))
+        parser.close()
+        return target.close()
+
+
+def make_extractor(engine='density', parser='auto'):
+    if engine == 'selector':
+        if parser == 'auto':
+            parser = 'lxml' if HAS_LXML else 'html.parser'
+        return SelectorExtractor(parser)
+    if engine == 'density':
+        return DensityExtractor(parser)
+    raise ValueError(f'Unknown content extractor "{engine}"')
+
+
+_default_extractor = None
+
+
+def get_extractor():
+    """Extractor configured by CONTENT_EXTRACTOR / CONTENT_HTML_PARSER."""
+    global _default_extractor
+
+    if has_app_context():
+        extractor = current_app.extensions.get('content_extractor')
+        if extractor is None:
+            extractor = make_extractor(current_app.config['CONTENT_EXTRACTOR'],
+                                       current_app.config['CONTENT_HTML_PARSER'])
+            current_app.extensions['content_extractor'] = extractor
+        return extractor
+
+    if _default_extractor is None:
+        _default_extractor = make_extractor()
+    return _default_extractor
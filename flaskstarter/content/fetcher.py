@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+    HTTP fetcher shared by the app.
+
+    One pooled `requests.Session` keeps connections alive between fetches,
+    a semaphore per host keeps us polite with any single site, and
+    `fetch_many` fetches a batch of URLs in parallel and yields each result
+    as soon as it completes.
+"""
+
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+FetchResult = namedtuple('FetchResult', 'url ok status content etag last_modified not_modified error')
+
+
+class Fetcher(object):
+    """
+    Thread safe HTTP GET client.
+
+    :param timeout: (connect, read) timeout in seconds
+    :param pool_size: connections kept alive per host
+    :param max_workers: threads used by `fetch_many`
+    :param per_host_limit: concurrent requests allowed to a single host
+    :param validators_size: responses remembered for conditional requests
+    """
+
+    def __init__(self, timeout=(5, 10), pool_size=32, max_workers=16, per_host_limit=4,
+                 validators_size=256):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+
+        retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                      allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_limits = {}
+        self._validators = OrderedDict()
+        self._validators_size = validators_size
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            semaphore = self._host_limits.get(host)
+            if semaphore is None:
+                semaphore = self._host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+        return semaphore
+
+    def _remembered(self, url):
+        with self._lock:
+            entry = self._validators.get(url)
+            if entry is not None:
+                self._validators.move_to_end(url)
+            return entry
+
+    def _remember(self, url, etag, last_modified, content):
+        if not (etag or last_modified):
+            return
+        with self._lock:
+            self._validators[url] = (etag, last_modified, content)
+            self._validators.move_to_end(url)
+            while len(self._validators) > self._validators_size:
+                self._validators.popitem(last=False)
+
+    def fetch(self, url, etag=None, last_modified=None):
+        """GET `url`, revalidating with ETag/Last-Modified when we have them.
+
+        On a 304 the previously fetched content is returned with
+        `not_modified=True`.
+        """
+        remembered = self._remembered(url)
+        if remembered and not (etag or last_modified):
+            etag, last_modified = remembered[0], remembered[1]
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            with self._host_limit(url):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                content = response.content
+        except requests.RequestException as e:
+            return FetchResult(url, False, None, None, None, None, False, str(e))
+
+        if response.status_code == 304:
+            cached = remembered[2] if remembered else None
+            return FetchResult(url, True, 304, cached, etag, last_modified, True, None)
+
+        try:
+            response.raise_for_status()
+        except requests.RequestException as e:
+            return FetchResult(url, False, response.status_code, None, None, None, False, str(e))
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        self._remember(url, etag, last_modified, content)
+        return FetchResult(url, True, response.status_code, content, etag, last_modified, False, None)
+
+    def map_as_completed(self, func, items):
+        """Runs `func(item)` on the worker threads, yields `(item, result)`
+        in completion order."""
+        items = list(items)
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def fetch_many(self, urls):
+        """Fetches all `urls` concurrently, yields `FetchResult`s as they complete."""
+        for _, result in self.map_as_completed(self.fetch, urls):
+            yield result
+
+
+def get_fetcher():
+    """The app's shared fetcher, built on first use."""
+
+    fetcher = current_app.extensions.get('content_fetcher')
+    if fetcher is None:
+        config = current_app.config
+        fetcher = Fetcher(timeout=(config['FETCH_CONNECT_TIMEOUT'], config['FETCH_TIMEOUT']),
+                          pool_size=config['FETCH_POOL_SIZE'],
+                          max_workers=config['FETCH_MAX_WORKERS'],
+                          per_host_limit=config['FETCH_PER_HOST_LIMIT'])
+        current_app.extensions['content_fetcher'] = fetcher
+    return fetcher
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    Turns a learning material URL (article or YouTube video) into text.
+"""
+
+from youtube_transcript_api import (YouTubeTranscriptApi, InvalidVideoId, NoTranscriptFound,
+                                    TranscriptsDisabled, VideoUnavailable)
+
+from .cache import get_extraction_cache, normalize_url, youtube_video_id
+from .extract import get_extractor
+from .fetcher import get_fetcher
+
+
+# HTTP statuses asking again won't change: the page is gone
+PERMANENT_STATUSES = (404, 410)
+
+
+class FetchFailure(str):
+    """Error message of a URL that could not be read. `permanent` when
+    trying again can't help, e.g. the page is gone or the video has no
+    transcript."""
+
+    def __new__(cls, message, permanent=False):
+        failure = super(FetchFailure, cls).__new__(cls, message)
+        failure.permanent = permanent
+        return failure
+
+
+def is_youtube_url(url):
+    return youtube_video_id(url) is not None or "youtube.com/watch" in url or "youtu.be" in url
+
+
+def get_youtube_transcript(url):
+    try:
+        video_id = youtube_video_id(url)
+        if not video_id:
+            return False, FetchFailure("Could not find a valid YouTube video ID in the URL.", permanent=True)
+
+        transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['en', 'de'])
+        full_transcript = " ".join([item['text'] for item in transcript_list])
+        return True, full_transcript
+    except (InvalidVideoId, NoTranscriptFound, TranscriptsDisabled, VideoUnavailable) as e:
+        return False, FetchFailure(f"Could not retrieve transcript: {e}", permanent=True)
+    except Exception as e:
+        return False, FetchFailure(f"Could not retrieve transcript: {e}")
+
+
+def extract_article_text(html, extractor=None):
+    """Main text of an article page, using the configured extractor."""
+    return (extractor or get_extractor()).extract(html)
+
+
+def _get_content(fetcher, cache, extractor, url):
+    key = normalize_url(url)
+    cached = cache.get_content(key) if cache else None
+    if cached and cache.is_fresh(cached):
+        return True, cached.text
+
+    # --- YouTube Logic ---
+    if key.startswith('youtube:') or is_youtube_url(url):
+        was_successful, text = get_youtube_transcript(url)
+        if was_successful and cache:
+            cache.set_content(key, text)
+        return was_successful, text
+
+    # --- Classic Article Logic ---
+    result = fetcher.fetch(url,
+                           etag=cached.etag if cached else None,
+                           last_modified=cached.last_modified if cached else None)
+    if not result.ok:
+        return False, FetchFailure(f"Could not retrieve article: {result.error}",
+                                   permanent=result.status in PERMANENT_STATUSES)
+
+    if result.not_modified and cached:
+        text = cached.text  # unchanged upstream, skip parsing
+    else:
+        text = extract_article_text(result.content, extractor)
+    if cache:
+        cache.set_content(key, text, result.etag, result.last_modified)
+    return True, text
+
+
+def get_content(url):
+    """Returns `(was_successful, text or error message)` for one URL, the
+    message being a `FetchFailure`."""
+    return _get_content(get_fetcher(), get_extraction_cache(), get_extractor(), url)
+
+
+def get_contents(urls):
+    """Fetches many URLs concurrently through the shared connection pool.
+
+    Links that normalize to the same key are fetched once. Yields
+    `(url, (was_successful, text or error message))` as each one completes.
+    """
+    # Resolved here, the worker threads have no app context to find them in
+    fetcher = get_fetcher()
+    cache = get_extraction_cache()
+    extractor = get_extractor()
+
+    by_key = {}
+    for url in urls:
+        by_key.setdefault(normalize_url(url), []).append(url)
+
+    def fetch(key):
+        return _get_content(fetcher, cache, extractor, by_key[key][0])
+
+    for key, outcome in fetcher.map_as_completed(fetch, by_key):
+        for url in by_key[key]:
+            yield url, outcome
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    Database engine setup.
+
+    The database comes from DATABASE_URL (see config.py), SQLite in the
+    instance folder by default. SQLite connections switch to WAL, so readers
+    don't block the writer, wait up to SQLITE_BUSY_TIMEOUT for the write
+    lock instead of failing and sync less often. Other databases get a
+    connection pool sized by the DB_POOL_* settings.
+"""
+
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def normalize_database_url(url):
+    # Some hosts still hand out the 'postgres://' scheme SQLAlchemy dropped
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(url, config):
+    """Engine options for `url` from the DB_POOL_* and SQLITE_* settings."""
+    if is_sqlite(url):
+        # pysqlite's own wait for the lock, also covers BEGIN
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT']}}
+
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def sqlite_pragmas(config, in_memory=False):
+    pragmas = [f"busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'] * 1000)}",
+               f"synchronous={config['SQLITE_SYNCHRONOUS']}"]
+    if not in_memory:
+        pragmas.insert(0, f"journal_mode={config['SQLITE_JOURNAL_MODE']}")
+    return pragmas
+
+
+def tune_sqlite_engine(engine, config):
+    """Sets the SQLITE_* pragmas on every new connection of `engine`."""
+    database = engine.url.database
+    pragmas = sqlite_pragmas(config, in_memory=not database or database == ':memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(f'PRAGMA {pragma}')
+        cursor.close()
+
+
+def configure_database(app):
+    """Fills in engine options, call before `db.init_app(app)`."""
+    config = app.config
+    url = normalize_database_url(config['SQLALCHEMY_DATABASE_URI'])
+    config['SQLALCHEMY_DATABASE_URI'] = url
+    database = make_url(url).database
+    if is_sqlite(url) and database and database != ':memory:':
+        # Flask-SQLAlchemy resolves relative paths against the instance folder
+        os.makedirs(os.path.dirname(os.path.join(app.instance_path, database)), exist_ok=True)
+    # Options set explicitly in the config win
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options(url, config),
+                                               **config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+
+def init_database_engines(app, db):
+    """Tunes the engines `db.init_app(app)` created."""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                tune_sqlite_engine(engine, app.config)
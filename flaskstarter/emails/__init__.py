@@ -1,12 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from flask_mail import Message
-
-from ..extensions import mail
-
-
-async def send_async_email(subject, html, send_to):
-    """ send mail in async mode"""
-
-    message = Message(subject=subject, html=html, recipients=[send_to])
-    await mail.send(message)
+from .models import OutgoingMail
+from .constants import QUEUED, SENDING, SENT, FAILED, MAIL_STATUS
+from .outbox import queue_mail, send_async_email, flush_mail_outbox, schedule_flush
+from .sink import SMTPSink, SinkMessage
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+# Outbox message status
+QUEUED = 'QUEUED'
+SENDING = 'SENDING'
+SENT = 'SENT'
+FAILED = 'FAILED'
+MAIL_STATUS = (QUEUED, SENDING, SENT, FAILED)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import Column
+
+from ..compression import CompressedText
+from ..extensions import db
+from ..utils import get_current_time
+from .constants import QUEUED
+
+
+class OutgoingMail(db.Model):
+    """A message waiting in the outbox, see `outbox.flush_mail_outbox`."""
+
+    __tablename__ = 'mail_outbox'
+
+    id = Column(db.Integer, primary_key=True)
+
+    subject = Column(db.String(255), nullable=False)
+    # Comma separated addresses
+    recipients = Column(db.Text, nullable=False)
+    sender = Column(db.String(255), nullable=True)  # MAIL_DEFAULT_SENDER when empty
+    html = Column(CompressedText, nullable=False)
+
+    status = Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    # Earliest time of the next attempt, pushed forward on every failure
+    send_after = Column(db.DateTime, nullable=False, default=get_current_time, index=True)
+    # Lease of the sender; an expired one means it died mid-batch
+    locked_until = Column(db.DateTime, nullable=True)
+    last_error = Column(db.Text, nullable=True)
+
+    created_time = Column(db.DateTime, default=get_current_time)
+    sent_time = Column(db.DateTime, nullable=True)
+
+    @property
+    def recipient_list(self):
+        return [address for address in self.recipients.split(',') if address]
+
+    def __repr__(self):
+        return f'<OutgoingMail {self.id} "{self.subject}" ({self.status}, attempt {self.attempts})>'
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+    Outbound mail queue.
+
+    Views only add a row to the `mail_outbox` table. A background job takes
+    a batch of due messages and sends them over one SMTP connection, at
+    most MAIL_RATE_LIMIT messages per second. A failed message is retried
+    with exponential backoff until MAIL_MAX_ATTEMPTS.
+"""
+
+import smtplib
+import time
+from datetime import timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import and_, func, or_, update
+
+from ..extensions import db, mail
+from ..jobs import Job, enqueue, job_handler
+from ..jobs.constants import QUEUED as JOB_QUEUED
+from ..jobs.queue import retry_delay
+from ..utils import get_current_time
+from .constants import QUEUED, SENDING, SENT, FAILED
+from .models import OutgoingMail
+
+
+FLUSH_JOB = 'flush_mail_outbox'
+
+# How long a sender may hold a batch before another one can take it over
+LEASE_SECONDS = 600
+
+
+def queue_mail(subject, html, recipients, sender=None, commit=True):
+    """Adds a message to the outbox, it is sent by a background worker."""
+
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    outgoing = OutgoingMail(subject=subject,
+                            html=html,
+                            recipients=','.join(recipients),
+                            sender=sender,
+                            status=QUEUED,
+                            send_after=get_current_time())
+    db.session.add(outgoing)
+    schedule_flush(commit=False)
+    if commit:
+        db.session.commit()
+    return outgoing
+
+
+def send_async_email(subject, html, send_to):
+    """ send mail in async mode"""
+
+    return queue_mail(subject, html, send_to)
+
+
+def schedule_flush(run_at=None, commit=True):
+    """Queues a flush job for `run_at` unless one is already due by then."""
+
+    run_at = run_at or get_current_time()
+    pending = (db.session.query(Job.id)
+               .filter(Job.name == FLUSH_JOB, Job.status == JOB_QUEUED, Job.run_at <= run_at)
+               .first())
+    if pending is None:
+        enqueue(FLUSH_JOB, run_at=run_at, commit=commit)
+
+
+def _claimable(now):
+    return or_(
+        and_(OutgoingMail.status == QUEUED, OutgoingMail.send_after <= now),
+        and_(OutgoingMail.status == SENDING, OutgoingMail.locked_until < now),
+    )
+
+
+def claim_batch(size):
+    """Atomically takes up to `size` due messages."""
+
+    now = get_current_time()
+    candidates = (db.session.query(OutgoingMail.id)
+                  .filter(_claimable(now))
+                  .order_by(OutgoingMail.send_after, OutgoingMail.id)
+                  .limit(size)
+                  .all())
+    claimed = []
+    for mail_id, in candidates:
+        result = db.session.execute(
+            update(OutgoingMail)
+            .where(OutgoingMail.id == mail_id, _claimable(now))
+            .values(status=SENDING,
+                    locked_until=now + timedelta(seconds=LEASE_SECONDS),
+                    attempts=OutgoingMail.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(mail_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutgoingMail.query.filter(OutgoingMail.id.in_(claimed)).order_by(OutgoingMail.id).all()
+
+
+class RateLimiter(object):
+    """Spaces calls to at most `rate` per second, no limit if falsy."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+            now = self.next_time
+        self.next_time = now + self.interval
+
+
+def _message(outgoing):
+    return Message(subject=outgoing.subject,
+                   html=outgoing.html,
+                   recipients=outgoing.recipient_list,
+                   sender=outgoing.sender or current_app.config['MAIL_DEFAULT_SENDER'])
+
+
+def _mark_sent(outgoing):
+    outgoing.status = SENT
+    outgoing.sent_time = get_current_time()
+    outgoing.locked_until = None
+    outgoing.last_error = None
+    db.session.commit()
+
+
+def _mark_failed(outgoing, error):
+    config = current_app.config
+    outgoing.last_error = f'{type(error).__name__}: {error}'
+    outgoing.locked_until = None
+    if outgoing.attempts < config['MAIL_MAX_ATTEMPTS']:
+        delay = retry_delay(outgoing.attempts, config['MAIL_RETRY_BACKOFF'], config['MAIL_RETRY_BACKOFF_MAX'])
+        outgoing.status = QUEUED
+        outgoing.send_after = get_current_time() + timedelta(seconds=delay)
+        current_app.logger.warning(f'{outgoing!r} failed, retrying in {delay:.0f}s: {outgoing.last_error}')
+    else:
+        outgoing.status = FAILED
+        current_app.logger.error(f'{outgoing!r} failed permanently: {outgoing.last_error}')
+    db.session.commit()
+
+
+def deliver(batch, rate_limit=None):
+    """Sends `batch` over a single SMTP connection, returns `(sent, failed)`."""
+
+    limiter = RateLimiter(rate_limit)
+    sent = failed = 0
+    remaining = list(batch)
+    try:
+        with mail.connect() as connection:
+            while remaining:
+                outgoing = remaining[0]
+                limiter.wait()
+                try:
+                    try:
+                        connection.send(_message(outgoing))
+                    except smtplib.SMTPServerDisconnected:
+                        # The server dropped an idle or overused connection
+                        connection.host = connection.configure_host()
+                        connection.send(_message(outgoing))
+                except (smtplib.SMTPException, OSError, AssertionError) as e:
+                    _mark_failed(outgoing, e)
+                    failed += 1
+                else:
+                    _mark_sent(outgoing)
+                    sent += 1
+                remaining.pop(0)
+    except (smtplib.SMTPException, OSError) as e:
+        # Could not connect (or the final QUIT failed, then nothing is left)
+        for outgoing in remaining:
+            _mark_failed(outgoing, e)
+            failed += 1
+    return sent, failed
+
+
+def _schedule_next_flush(earliest):
+    """Schedules a flush for the next message due, not before `earliest`.
+
+    Messages left SENDING by a sender that died are due again when their
+    lease runs out.
+    """
+    queued = (db.session.query(func.min(OutgoingMail.send_after))
+              .filter(OutgoingMail.status == QUEUED)
+              .scalar())
+    leased = (db.session.query(func.min(OutgoingMail.locked_until))
+              .filter(OutgoingMail.status == SENDING)
+              .scalar())
+    due = [when for when in (queued, leased) if when is not None]
+    if due:
+        schedule_flush(run_at=max(min(due), earliest))
+
+
+def _flush_failed(payload, error):
+    # Nothing else would send what's still in the outbox
+    backoff = current_app.config['MAIL_RETRY_BACKOFF']
+    _schedule_next_flush(get_current_time() + timedelta(seconds=backoff))
+
+
+@job_handler(FLUSH_JOB, max_attempts=1, timeout=LEASE_SECONDS, on_failure=_flush_failed)
+def flush_mail_outbox():
+    """Sends one batch of due messages and schedules the next flush."""
+
+    config = current_app.config
+    batch = claim_batch(config['MAIL_BATCH_SIZE'])
+    sent, failed = deliver(batch, config['MAIL_RATE_LIMIT']) if batch else (0, 0)
+
+    _schedule_next_flush(get_current_time())
+    return {'sent': sent, 'failed': failed}
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    A local SMTP server that keeps every message in memory instead of
+    delivering it, for development and tests.
+
+        sink = SMTPSink(('localhost', 1025)).serve_in_background()
+        ...
+        sink.messages[0].recipients
+        sink.shutdown()
+
+    Point the app at it with MAIL_SERVER='localhost', MAIL_PORT=1025,
+    MAIL_USE_TLS=False, MAIL_USE_SSL=False and MAIL_SUPPRESS_SEND=False.
+"""
+
+import socketserver
+import threading
+from collections import namedtuple
+from email import message_from_bytes
+
+
+SinkMessage = namedtuple('SinkMessage', 'mail_from recipients data')
+
+
+def _address(argument):
+    # 'FROM:<a@b.c> SIZE=10' -> 'a@b.c'
+    value = argument.split(':', 1)[-1].strip()
+    if value.startswith('<'):
+        value = value[1:value.find('>')]
+    return value.split()[0] if value else value
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def reset(self):
+        self.mail_from = None
+        self.recipients = []
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line.rstrip(b'\r\n') == b'.':
+                break
+            if line.startswith(b'..'):
+                line = line[1:]
+            lines.append(line)
+        return b''.join(lines)
+
+    def handle(self):
+        self.reset()
+        self.reply('220 localhost flaskstarter SMTP sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.decode('ascii', 'replace').strip().partition(' ')
+            command = command.upper()
+
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'HELO':
+                self.reply('250 localhost')
+            elif command == 'MAIL':
+                self.reset()
+                self.mail_from = _address(argument)
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                self.recipients.append(_address(argument))
+                self.reply('250 OK')
+            elif command == 'DATA':
+                if not self.recipients:
+                    self.reply('503 RCPT first')
+                    continue
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.server.add(SinkMessage(self.mail_from, self.recipients, self.read_data()))
+                self.reset()
+                self.reply('250 OK')
+            elif command == 'RSET':
+                self.reset()
+                self.reply('250 OK')
+            elif command == 'NOOP':
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """SMTP server collecting the received messages in `messages`."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('localhost', 1025), on_message=None):
+        socketserver.ThreadingTCPServer.__init__(self, address, _SMTPHandler)
+        self.messages = []
+        self.on_message = on_message
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        with self._lock:
+            self.messages.append(message)
+        if self.on_message is not None:
+            self.on_message(message)
+
+    def parsed(self):
+        """Received messages as `email.message.Message` objects."""
+        return [message_from_bytes(message.data) for message in self.messages]
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        thread.start()
+        return self
@@ -8,6 +8,8 @@ from flask_admin import Admin, AdminIndexView
 from flask_admin.menu import MenuLink
 from flask_migrate import Migrate
 
+from .ai.client import AIClient
+
 db = SQLAlchemy()
 
 mail = Mail()
@@ -20,6 +22,8 @@ login_manager.login_message = "Please login or signup to add a new trip"
 
 migrate = Migrate()
 
+ai_client = AIClient()
+
 class HomeView(AdminIndexView):
     def is_visible(self):
         return False
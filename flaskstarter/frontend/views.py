@@ -5,13 +5,15 @@ from uuid import uuid4
 from itsdangerous import URLSafeSerializer
 
 from flask import (Blueprint, render_template, current_app, request,
-                   flash, url_for, redirect)
+                   flash, url_for, redirect, jsonify)
 from flask_login import (login_required, login_user, current_user,
                          logout_user, login_fresh)
 
 
 from ..tasks import MyTaskForm
-from ..user import Users, ACTIVE
+from ..user import Users, ACTIVE, PasswordHashBusy
+from ..caching import cache_stats, invalidate_user
+from ..decorators import admin_required
 from ..extensions import db, login_manager
 from .forms import (SignupForm, LoginForm, RecoverPasswordForm,
                     ChangePasswordForm, ContactUsForm)
@@ -68,7 +70,11 @@ def login():
                      next=request.args.get('next', None))
 
     if form.validate_on_submit():
-        user, authenticated = Users.authenticate(form.login.data, form.password.data)
+        try:
+            user, authenticated = Users.authenticate(form.login.data, form.password.data)
+        except PasswordHashBusy:
+            flash('Too many people are logging in right now, please try again in a moment', 'warning')
+            return render_template('frontend/login.html', form=form, _active_login=True)
 
         if user and authenticated:
 
@@ -106,7 +112,11 @@ def signup():
         user = Users()
         user.status_code = 2
         user.account_type = 0
-        form.populate_obj(user)
+        try:
+            form.populate_obj(user)  # hashes the password
+        except PasswordHashBusy:
+            flash('Too many people are signing up right now, please try again in a moment', 'warning')
+            return render_template('frontend/signup.html', form=form, _active_signup=True)
         db.session.add(user)
         db.session.commit()
 
@@ -140,6 +150,7 @@ def confirm_account(secretstring):
     user.status_code = ACTIVE
     db.session.add(user)
     db.session.commit()
+    invalidate_user(user.id)
     flash(u'Your account was confirmed succsessfully!!!', 'success')
     return redirect(url_for('frontend.login'))
 
@@ -155,7 +166,12 @@ def change_password():
                               email=request.values["email"])
 
     if form.validate_on_submit():
-        update_password(form.email.data, form.email_activation_key.data, form.password.data)
+        try:
+            update_password(form.email.data, form.email_activation_key.data, form.password.data)
+        except PasswordHashBusy:
+            db.session.rollback()
+            flash('Too many password changes in progress, please try again in a moment', 'warning')
+            return render_template("frontend/change_password.html", form=form)
         flash(u"Your password has been changed, log in again", "success")
         return redirect(url_for("frontend.login"))
 
@@ -163,11 +179,12 @@ def change_password():
 
 
 def update_password(email, email_activation_key, password):
-    user = Users.query.filter(Users.email.ilike(email), email_activation_key=email_activation_key).first()
+    user = Users.query.filter(Users.email.ilike(email), Users.email_activation_key == email_activation_key).first()
     user.password = password
     user.email_activation_key = None
     db.session.add(user)
     db.session.commit()
+    invalidate_user(user.id)
 
 
 @frontend.route('/reset_password', methods=['GET', 'POST'])
@@ -199,6 +216,14 @@ def reset_password():
     return render_template('frontend/reset_password.html', form=form)
 
 
+@frontend.route('/cache-stats')
+@login_required
+@admin_required
+def cache_stats_view():
+    # Counters are kept per process, these are the ones of this worker
+    return jsonify(cache_stats())
+
+
 @frontend.route('/terms')
 def terms():
     return "To be updated soon.."
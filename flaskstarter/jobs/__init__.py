@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+from .models import Job
+from .constants import QUEUED, RUNNING, SUCCEEDED, FAILED, JOB_STATUS
+from .queue import (enqueue, job_handler, run_job, claim_next, run_workers,
+                    report_progress, Worker, JobTimeout, JobAbandoned, job_cancelled,
+                    check_cancelled, current_job_id)
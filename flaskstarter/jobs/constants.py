@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+# Job status
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+JOB_STATUS = (QUEUED, RUNNING, SUCCEEDED, FAILED)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from sqlalchemy import Column
+
+from ..extensions import db
+from ..utils import get_current_time
+from .constants import QUEUED
+
+
+class Job(db.Model):
+
+    __tablename__ = 'jobs'
+
+    id = Column(db.Integer, primary_key=True)
+
+    # Name of the registered handler, see `queue.job_handler`
+    name = Column(db.String(64), nullable=False, index=True)
+    # JSON encoded keyword arguments for the handler
+    payload = Column(db.Text, nullable=False, default='{}')
+
+    status = Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    max_attempts = Column(db.Integer, nullable=False, default=3)
+    timeout = Column(db.Integer, nullable=False, default=300)  # seconds
+
+    # Earliest time the job may run, pushed forward on every retry
+    run_at = Column(db.DateTime, nullable=False, default=get_current_time, index=True)
+
+    # Lease held by the worker running the job. An expired lease means the
+    # worker died and the job can be claimed again.
+    locked_by = Column(db.String(64), nullable=True)
+    locked_until = Column(db.DateTime, nullable=True)
+
+    last_error = Column(db.Text, nullable=True)
+    result = Column(db.Text, nullable=True)
+
+    created_time = Column(db.DateTime, default=get_current_time)
+    finished_time = Column(db.DateTime, nullable=True)
+
+    @property
+    def kwargs(self):
+        return json.loads(self.payload or '{}')
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} ({self.status}, attempt {self.attempts}/{self.max_attempts})>'
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+    Small DB backed job queue.
+
+    Jobs are rows in the `jobs` table. Workers claim a job by flipping its
+    status with a conditional UPDATE, so several worker processes can share
+    the same database without a broker. Failed jobs are retried with
+    exponential backoff until `max_attempts` is reached. A job that overruns
+    its timeout is cancelled (handlers check `check_cancelled`) and only
+    retried once its handler has stopped.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from flask import current_app, g
+from sqlalchemy import and_, or_, update
+
+from ..extensions import db
+from ..utils import get_current_time
+from .constants import QUEUED, RUNNING, SUCCEEDED, FAILED
+from .models import Job
+
+
+# Extra time on top of a job timeout before its lease is considered stale
+LEASE_GRACE_SECONDS = 30
+
+# Time an overrunning handler gets to stop once cancelled. Shorter than the
+# lease grace, so nobody else claims the job while it may still be running.
+CANCEL_GRACE_SECONDS = 20
+
+
+JobHandler = namedtuple('JobHandler', 'func max_attempts timeout on_failure')
+
+_handlers = {}
+
+
+class JobTimeout(Exception):
+    """Raised when a job runs longer than its timeout."""
+
+
+class JobAbandoned(JobTimeout):
+    """The job overran and did not stop when cancelled. It may still be
+    running, so it is failed instead of retried."""
+
+
+def current_job_id():
+    """Id of the job being run, also set while its `on_failure` hook runs."""
+    return g.get('job_id')
+
+
+def job_cancelled():
+    """Whether the running job has overrun its timeout. Long handlers check
+    this (or call `check_cancelled`) between steps."""
+    cancel = g.get('job_cancel')
+    return cancel is not None and cancel.is_set()
+
+
+def check_cancelled():
+    """Raises `JobTimeout` if the running job has overrun its timeout."""
+    if job_cancelled():
+        raise JobTimeout('Job cancelled after exceeding its timeout')
+
+
+def job_handler(name, max_attempts=None, timeout=None, on_failure=None):
+    """Register a function as the handler for jobs called `name`.
+
+    :param max_attempts: overrides `JOB_MAX_ATTEMPTS` for this job type
+    :param timeout: overrides `JOB_TIMEOUT` (seconds) for this job type
+    :param on_failure: called as `on_failure(payload, error)` once the job
+                       has failed for the last time
+    """
+
+    def decorator(func):
+        _handlers[name] = JobHandler(func, max_attempts, timeout, on_failure)
+        return func
+    return decorator
+
+
+def get_handler(name):
+    return _handlers.get(name)
+
+
+def enqueue(name, run_at=None, commit=True, **payload):
+    """Add a job to the queue and return it."""
+
+    handler = get_handler(name)
+    if handler is None:
+        raise KeyError(f'No job handler registered for "{name}"')
+
+    config = current_app.config
+    job = Job(name=name,
+              payload=json.dumps(payload),
+              status=QUEUED,
+              max_attempts=handler.max_attempts or config['JOB_MAX_ATTEMPTS'],
+              timeout=handler.timeout or config['JOB_TIMEOUT'],
+              run_at=run_at or get_current_time())
+    db.session.add(job)
+    if commit:
+        db.session.commit()
+    return job
+
+
+def retry_delay(attempts, base, cap):
+    # Exponential backoff with jitter so failed jobs don't retry in lockstep
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _claimable(now):
+    return or_(
+        and_(Job.status == QUEUED, Job.run_at <= now),
+        and_(Job.status == RUNNING, Job.locked_until < now),
+    )
+
+
+def claim_next(worker_id, batch=5):
+    """Atomically take the next runnable job, or return None."""
+
+    now = get_current_time()
+    candidates = (db.session.query(Job.id, Job.timeout)
+                  .filter(_claimable(now))
+                  .order_by(Job.run_at, Job.id)
+                  .limit(batch)
+                  .all())
+
+    for job_id, timeout in candidates:
+        lease = now + timedelta(seconds=timeout + LEASE_GRACE_SECONDS)
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, _claimable(now))
+            .values(status=RUNNING,
+                    locked_by=worker_id,
+                    locked_until=lease,
+                    attempts=Job.attempts + 1)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return db.session.get(Job, job_id)
+
+    return None
+
+
+def report_progress(**progress):
+    """Store `progress` as the running job's result, for clients to poll.
+
+    Written on its own connection, so the handler's session is left alone.
+    Does nothing outside of a job.
+    """
+
+    job_id = g.get('job_id')
+    if job_id is None:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(update(Job).where(Job.id == job_id).values(result=json.dumps(progress)))
+
+
+def _run_with_timeout(app, func, kwargs, timeout, job_id=None):
+    # The handler runs in its own thread with its own app context (and so its
+    # own DB session). If it overruns it is cancelled, and the job is only
+    # released for a retry once the thread has stopped: two runs of a job
+    # never overlap. A handler that doesn't stop within CANCEL_GRACE_SECONDS
+    # fails the job for good, its thread is left to finish on its own.
+    outcome = {}
+    cancel = threading.Event()
+
+    def target():
+        with app.app_context():
+            g.job_id = job_id
+            g.job_cancel = cancel
+            try:
+                outcome['result'] = func(**kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+                outcome['traceback'] = traceback.format_exc()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+
+    if thread.is_alive():
+        cancel.set()
+        thread.join(CANCEL_GRACE_SECONDS)
+        if thread.is_alive():
+            raise JobAbandoned(f'Job exceeded its timeout of {timeout}s and did not stop')
+        if 'error' in outcome or 'result' not in outcome:
+            raise JobTimeout(f'Job exceeded its timeout of {timeout}s')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome."""
+
+    app = current_app._get_current_object()
+    handler = get_handler(job.name)
+    kwargs = job.kwargs
+
+    try:
+        if handler is None:
+            raise KeyError(f'No job handler registered for "{job.name}"')
+        result = _run_with_timeout(app, handler.func, kwargs, job.timeout, job_id=job.id)
+    except Exception as e:
+        db.session.rollback()
+        _record_failure(job, handler, kwargs, e)
+        return False
+
+    job.status = SUCCEEDED
+    job.result = json.dumps(result) if result is not None else None
+    job.finished_time = get_current_time()
+    job.locked_by = job.locked_until = None
+    db.session.commit()
+    return True
+
+
+def _record_failure(job, handler, kwargs, error):
+    config = current_app.config
+    job.last_error = f'{type(error).__name__}: {error}'
+    job.locked_by = job.locked_until = None
+
+    if job.attempts < job.max_attempts and not isinstance(error, JobAbandoned):
+        delay = retry_delay(job.attempts,
+                            config['JOB_RETRY_BACKOFF'],
+                            config['JOB_RETRY_BACKOFF_MAX'])
+        job.status = QUEUED
+        job.run_at = get_current_time() + timedelta(seconds=delay)
+        current_app.logger.warning(f'{job!r} failed, retrying in {delay:.0f}s: {job.last_error}')
+        db.session.commit()
+        return
+
+    job.status = FAILED
+    job.finished_time = get_current_time()
+    current_app.logger.error(f'{job!r} failed permanently: {job.last_error}')
+    db.session.commit()
+
+    if handler and handler.on_failure:
+        g.job_id = job.id
+        try:
+            handler.on_failure(kwargs, error)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f'on_failure hook for {job!r} raised: {e}')
+        finally:
+            g.pop('job_id', None)
+
+
+class Worker(threading.Thread):
+    """Polls the queue and runs jobs one at a time."""
+
+    def __init__(self, app, stop_event, poll_interval=None, name=None):
+        self.app = app
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+        self.worker_id = name or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        super(Worker, self).__init__(name=self.worker_id, daemon=True)
+
+    def run_once(self):
+        with self.app.app_context():
+            job = claim_next(self.worker_id)
+            if job is None:
+                return False
+            run_job(job)
+            return True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                self.app.logger.error(f'Worker {self.worker_id} error: {e}')
+                worked = False
+            if not worked:
+                self.stop_event.wait(self.poll_interval)
+
+
+def run_workers(app, concurrency=None, stop_event=None):
+    """Start a pool of workers and block until interrupted."""
+
+    concurrency = concurrency or app.config['JOB_WORKERS']
+    stop_event = stop_event or threading.Event()
+    workers = [Worker(app, stop_event) for _ in range(concurrency)]
+
+    for worker in workers:
+        worker.start()
+
+    try:
+        while not stop_event.is_set():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    for worker in workers:
+        worker.join()
@@ -1,4 +1,5 @@
 
 from .views import learning_material_uploader_bp
-from .models import LearningMaterial
-from .forms import FileUploadForm, LinkSubmitForm
\ No newline at end of file
+from .models import LearningMaterial, MaterialSection
+from .forms import FileUploadForm, LinkSubmitForm, ReadingListForm
+from . import tasks
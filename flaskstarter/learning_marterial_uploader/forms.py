@@ -2,7 +2,7 @@
 
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, SubmitField, URLField
+from wtforms import StringField, SubmitField, URLField, TextAreaField, ValidationError
 from wtforms.validators import DataRequired, URL, Length
 
 ALLOWED_EXTENSIONS = ['pdf', 'docx', 'txt', 'pptx', 'md']
@@ -33,4 +33,35 @@ class LinkSubmitForm(FlaskForm):
         render_kw={"placeholder": "https://example.com/your-resource"}
     )
 
-    submit = SubmitField('Submit Link')
\ No newline at end of file
+    submit = SubmitField('Submit Link')
+
+
+class ReadingListForm(FlaskForm):
+    material_urls = TextAreaField(
+        'Reading List (one URL per line):',
+        validators=[DataRequired(message='Please enter at least one URL.')],
+        render_kw={"placeholder": "https://example.com/first-article\nhttps://youtu.be/your-video", "rows": 5}
+    )
+
+    submit = SubmitField('Submit Reading List')
+
+    def get_urls(self):
+        """Non-empty lines of the text area, duplicates removed, order kept."""
+        lines = (line.strip() for line in (self.material_urls.data or '').splitlines())
+        return list(dict.fromkeys(line for line in lines if line))
+
+    def validate_material_urls(self, field):
+        url_validator = URL(message='Invalid URL.')
+        for url in self.get_urls():
+            try:
+                url_validator(self, _UrlValue(url))
+            except ValidationError:
+                raise ValidationError(f'"{url}" is not a valid URL.')
+
+
+class _UrlValue(object):
+    """Minimal field stand-in so the URL validator can check single lines."""
+
+    def __init__(self, data):
+        self.data = data
+
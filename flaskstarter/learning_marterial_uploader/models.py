@@ -1,6 +1,15 @@
 
+from ..caching import cached_for_user, invalidate_user_cache_on_change
+from ..compression import CompressedJSON
 from ..extensions import db 
+from collections import namedtuple
 from datetime import datetime
+from sqlalchemy.orm import deferred
+
+from .storage import read_text, save_text
+
+# What listings show of a material, cached per user
+MaterialListing = namedtuple('MaterialListing', 'id title source_type processing_status upload_timestamp')
 
 class LearningMaterial(db.Model):
     __tablename__ = 'learning_materials' 
@@ -32,19 +41,153 @@ class LearningMaterial(db.Model):
     
     # Path to where the extracted plain text content from the file/URL is stored.
     # This is what you'll typically feed to AI models that consume text.
-    analysis_roadmap = db.Column(db.Text, nullable=True) 
+    # Deferred: only loaded when accessed, listings never need it.
+    analysis_roadmap = deferred(db.Column(CompressedJSON, nullable=True))
+    # name@version of the prompt that built the roadmap, see ai/prompts.py
+    roadmap_prompt_version = db.Column(db.String(64), nullable=True)
     
     # Optional: A hash of the original file content to detect/prevent duplicate uploads if desired.
     content_hash = db.Column(db.String(64), nullable=True, index=True)
 
+    # Plain text extracted locally from the uploaded file, relative to the upload root
+    extracted_text_path = db.Column(db.String(512), nullable=True)
+
     # link for the uploaded file
     gemini_file_uri = db.Column(db.String(100), nullable=True) # Store identified topics (e.g., as a JSON string or comma-separated list)
-    
 
+    # The roadmap as rows, chapters and subsections in document order
+    sections = db.relationship('MaterialSection', back_populates='material',
+                               order_by='MaterialSection.position',
+                               cascade='all, delete-orphan')
+
+    @classmethod
+    def list_for_user(cls, user_id):
+        """The user's materials as `MaterialListing`s, served from the cache."""
+        def load():
+            rows = (db.session.query(*(getattr(cls, field) for field in MaterialListing._fields))
+                    .filter_by(user_id=user_id)
+                    .order_by(cls.id))
+            return [MaterialListing(*row) for row in rows]
+        return cached_for_user('materials', user_id, load)
+
+    @classmethod
+    def find_by_hash(cls, content_hash, user_id=None, completed=False, exclude_id=None):
+        """Returns an existing file with the same content, preferring ones
+        that were already analyzed and then the user's own uploads."""
+        query = cls.query.filter(cls.content_hash == content_hash, cls.source_type == 'FILE')
+        if completed:
+            query = query.filter(cls.processing_status == 'COMPLETED')
+        if exclude_id is not None:
+            query = query.filter(cls.id != exclude_id)
+        return query.order_by((cls.processing_status == 'COMPLETED').desc(),
+                              (cls.user_id == user_id).desc(),
+                              cls.id).first()
+
+    def set_roadmap(self, roadmap, prompt_version=None):
+        """Stores a `document_title`/`structure` roadmap and its section rows."""
+        self.analysis_roadmap = roadmap
+        self.roadmap_prompt_version = prompt_version
+        self.sections = MaterialSection.from_roadmap(roadmap)
+
+    @property
+    def chapters(self):
+        return [section for section in self.sections if section.parent is None]
+
+    def reuse_analysis_from(self, other):
+        """Copies the roadmap and extracted text of an identical, already
+        analyzed file. Not the file given to the model, which may be in
+        another user's account and expires (see `tasks.model_file`)."""
+        text = read_text(other)
+        if text is not None:
+            save_text(self, text)
+        if other.analysis_roadmap:
+            self.set_roadmap(other.analysis_roadmap, other.roadmap_prompt_version)
+        self.processing_status = 'COMPLETED'
 
     def __repr__(self):
         """Provides a developer-friendly string representation of the object."""
         name = self.title or self.original_filename or self.original_url or f"ID: {self.id}"
         return f'<LearningMaterial "{name}">'
 
-    
\ No newline at end of file
+
+class MaterialSection(db.Model):
+    """A chapter or subsection of a material's roadmap.
+
+    `start_offset`/`end_offset` are character offsets into the material's
+    extracted text, empty when the file was analyzed by the model directly.
+    """
+    __tablename__ = 'material_sections'
+
+    id = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('learning_materials.id'), nullable=False, index=True)
+    parent_id = db.Column(db.Integer, db.ForeignKey('material_sections.id'), nullable=True)
+    position = db.Column(db.Integer, nullable=False)  # order within the whole roadmap
+
+    level = db.Column(db.Integer, nullable=False, default=1)
+    title = db.Column(db.String(512), nullable=False, default='')
+    summary = db.Column(db.Text, nullable=True)
+
+    start_offset = db.Column(db.Integer, nullable=True)
+    end_offset = db.Column(db.Integer, nullable=True)
+    page_start = db.Column(db.Integer, nullable=True)
+
+    material = db.relationship('LearningMaterial', back_populates='sections')
+    parent = db.relationship('MaterialSection', remote_side=[id], backref='subsections')
+
+    @classmethod
+    def from_roadmap(cls, roadmap):
+        """Flat list of sections for a roadmap, subsections linked to their chapter."""
+        sections = []
+
+        def add(entry, parent=None):
+            section = cls(position=len(sections),
+                          level=entry.get('level') or (2 if parent else 1),
+                          title=str(entry.get('title') or '')[:512],
+                          summary=entry.get('summary'),
+                          start_offset=entry.get('start'),
+                          end_offset=entry.get('end'),
+                          page_start=entry.get('page_start') if isinstance(entry.get('page_start'), int) else None,
+                          parent=parent)
+            sections.append(section)
+            for subsection in entry.get('subsections') or []:
+                add(subsection, section)
+
+        for chapter in (roadmap or {}).get('structure') or []:
+            add(chapter)
+        return sections
+
+    def __repr__(self):
+        return f'<MaterialSection {self.material_id}#{self.position} "{self.title}">'
+
+
+class UploadSession(db.Model):
+    """A resumable upload that is sent in chunks.
+
+    Bytes are appended to `<upload id>.part` in the user's folder until
+    `received_bytes` reaches `total_size`, then the upload is turned into a
+    LearningMaterial.
+    """
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, also names the .part file
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+    original_filename = db.Column(db.String(255), nullable=False)
+    extension = db.Column(db.String(10), nullable=False)
+    mimetype = db.Column(db.String(100), nullable=True)
+
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+    created_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def is_complete(self):
+        return self.received_bytes >= self.total_size
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.received_bytes}/{self.total_size}>'
+
+
+invalidate_user_cache_on_change(LearningMaterial, 'materials')
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    Roadmap of a long text, built chunk by chunk.
+
+    The text is split under ROADMAP_CHUNK_TOKENS, the sections of every
+    chunk are asked for in parallel and the answers are merged into a single
+    `document_title`/`structure` roadmap. Instead of a copy of its text each
+    section holds `start`/`end` character offsets into the stored text.
+"""
+
+import bisect
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from ..ai import (AIError, ChunkSections, ai_user_key, get_prompt, register_prompt, render_prompt,
+                  select_version, set_ai_user, user_workers)
+from ..content.chunking import split_text
+from flaskstarter.utils import request_ai
+
+
+_page_marker = re.compile(r'^--- (?:Page|Slide) (\d+) ---$', re.MULTILINE)
+
+
+class RoadmapError(Exception):
+    """The model failed to analyze part of the text."""
+
+
+register_prompt('roadmap_chunk', 1, """
+    **Role:**
+    You are an expert academic analyst and document indexer. Your task is to find the chapters and sections of a learning document.
+
+    **Context:**
+    The document is long, so you are given part {part} of {count}. It may start or end in the middle of a section.
+    ---
+    {chunk}
+    ---
+
+    **Task:**
+    List every chapter and primary subsection that **begins** in this part, in order. For each one give:
+    1.  **level**: The heading level (1 for a main chapter, 2 for a subsection).
+    2.  **title**: The full title of the chapter or section.
+    3.  **summary**: A concise, one-sentence summary describing the content of that specific section.
+    4.  **start_text**: The first 5 to 10 words of the section, copied **exactly** from the text above.
+
+    Text at the start of this part that continues a section from the previous part must not be listed.
+
+    Also give your best guess of the document's title as `document_title`, or null.""", truncate={'chunk': 'head'})
+
+
+def create_chunk_sections_prompt(chunk_text, index, count, version=None):
+    """The prompt for one chunk, a `RenderedPrompt`."""
+    return render_prompt('roadmap_chunk', version=version, chunk=chunk_text, part=index + 1, count=count)
+
+
+def section_text(text, section):
+    """The part of the stored text a roadmap section refers to."""
+    return text[section['start']:section['end']]
+
+
+def _analyze_chunk(app, user_key, prompt_version, chunk, count):
+    with app.app_context():
+        set_ai_user(user_key)
+        prompt = create_chunk_sections_prompt(chunk.text, chunk.index, count, version=prompt_version)
+        try:
+            return request_ai(prompt.text, schema=ChunkSections)
+        except AIError as e:
+            return e
+
+
+def _locate(text, start_text, lower, upper):
+    """Offset of a section's opening words in text[lower:upper], or None."""
+    words = (start_text or '').split()
+    if not words:
+        return None
+    # The model tends to normalize whitespace when quoting
+    match = re.compile(r'\s+'.join(map(re.escape, words))).search(text, lower, upper)
+    return match.start() if match else None
+
+
+def _page_numbers(text):
+    positions, numbers = [], []
+    for match in _page_marker.finditer(text):
+        positions.append(match.start())
+        numbers.append(int(match.group(1)))
+    return positions, numbers
+
+
+def merge_sections(text, chunks, answers):
+    """Turns the per-chunk `ChunkSections` into one roadmap with offsets into `text`."""
+    document_title = None
+    sections = []
+    for chunk, answer in zip(chunks, answers):
+        document_title = document_title or answer.document_title
+        for position, section in enumerate(answer.sections):
+            lower = sections[-1]['start'] + 1 if sections else 0
+            start = _locate(text, section.start_text, max(lower, chunk.start), chunk.end)
+            if start is None:
+                if position:
+                    current_app.logger.debug(f'Section "{section.title}" not found in its chunk')
+                    continue
+                start = max(lower, chunk.start)
+            sections.append({
+                'level': 1 if section.level <= 1 else 2,
+                'title': section.title,
+                'summary': section.summary,
+                'start': start,
+            })
+
+    if sections:
+        sections[0]['start'] = 0  # an untitled introduction belongs to the first section
+    for section, following in zip(sections, sections[1:] + [None]):
+        section['end'] = following['start'] if following else len(text)
+
+    positions, numbers = _page_numbers(text)
+    structure = []
+    for section in sections:
+        if positions:
+            index = bisect.bisect_right(positions, section['start']) - 1
+            section['page_start'] = numbers[max(index, 0)]
+        if section['level'] == 2 and structure:
+            structure[-1].setdefault('subsections', []).append(section)
+        else:
+            section['level'] = 1
+            structure.append(section)
+
+    # A chapter runs until the end of its last subsection
+    for chapter in structure:
+        if chapter.get('subsections'):
+            chapter['end'] = chapter['subsections'][-1]['end']
+
+    return {'document_title': document_title, 'structure': structure}
+
+
+def build_roadmap(text):
+    """
+    Roadmap of `text` and the version of the prompt that built it, raises
+    `RoadmapError` if a chunk fails.
+    """
+    config = current_app.config
+    user_key = ai_user_key()
+    # One version for all chunks, their answers are merged
+    prompt_version = select_version('roadmap_chunk', user_key)
+    label = get_prompt('roadmap_chunk', prompt_version).label
+    chunks = split_text(text, config['ROADMAP_CHUNK_TOKENS'])
+    if not chunks:
+        return {'document_title': None, 'structure': []}, label
+
+    app = current_app._get_current_object()
+    # More threads than the user's slots in the governor would only queue
+    workers = min(user_workers(config['ROADMAP_MAX_WORKERS']), len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        answers = list(executor.map(
+            lambda chunk: _analyze_chunk(app, user_key, prompt_version, chunk, len(chunks)), chunks))
+
+    failed = [chunk.index for chunk, answer in zip(chunks, answers) if not isinstance(answer, ChunkSections)]
+    if failed:
+        errors = [answer for answer in answers if isinstance(answer, AIError)]
+        raise RoadmapError(f'The AI failed to analyze part(s) {failed} of {len(chunks)}'
+                           + (f': {errors[0]!r}' if errors else '.')) from (errors[0] if errors else None)
+    return merge_sections(text, chunks, answers), label
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import threading
+
+from flask import current_app
+from werkzeug.exceptions import ClientDisconnected
+
+from ..compression import compress_text, decompress_text
+
+
+# Read size used when copying uploads to disk
+CHUNK_SIZE = 64 * 1024
+
+
+def get_upload_folder():
+    """Root folder for user uploads, shared by the views and the workers."""
+    return current_app.config.get('USER_UPLOADS_FOLDER', 'instance/user_uploads')
+
+
+def get_user_upload_folder(user_id):
+    return os.path.join(get_upload_folder(), str(user_id))
+
+
+def get_material_path(material):
+    """Absolute location on disk of an uploaded material."""
+    return os.path.join(get_upload_folder(), material.file_path)
+
+
+def get_text_path(material):
+    """Absolute location of the text extracted from a material."""
+    return os.path.join(get_upload_folder(), material.extracted_text_path)
+
+
+def save_text(material, text):
+    """Stores extracted text next to the uploaded file, or in the user's
+    folder for a link."""
+    if material.file_path:
+        relative_path = f'{material.file_path}.txt'
+    else:
+        relative_path = os.path.join(str(material.user_id), f'link-{material.id}.txt')
+    path = os.path.join(get_upload_folder(), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as out:
+        out.write(compress_text(text))
+    os.replace(temp_path, path)
+    material.extracted_text_path = relative_path
+
+
+def read_text(material):
+    """Extracted text of a material, None if there is none on disk."""
+    if not material.extracted_text_path:
+        return None
+    try:
+        with open(get_text_path(material), 'rb') as f:
+            return decompress_text(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def save_stream(stream, path, chunk_size=CHUNK_SIZE):
+    """Copies `stream` to `path` and hashes it on the way.
+
+    Returns `(size_bytes, sha256_hexdigest)` so callers don't need to read
+    the file a second time.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def hash_file(path, length=None, chunk_size=CHUNK_SIZE):
+    """sha256 object fed with the first `length` bytes of `path` (all if None)."""
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+def get_partial_path(upload):
+    """Where the bytes of an unfinished chunked upload are appended."""
+    return os.path.join(get_user_upload_folder(upload.user_id), f"{upload.id}.part")
+
+
+def append_chunk(path, offset, stream, limit, chunk_size=CHUNK_SIZE):
+    """Writes `stream` at `offset` of a partial upload.
+
+    Anything past `offset` left over from an interrupted request is dropped
+    first. At most `limit` bytes are accepted. Returns the number of bytes
+    written; if the client disconnects mid-chunk the bytes received so far
+    are kept so the upload can resume from there.
+
+    The content is hashed once complete (see `hash_file`): the chunks can
+    be handled by different processes, which share nothing but the file.
+    """
+    written = 0
+    try:
+        with open(path, 'r+b') as out:
+            out.truncate(offset)
+            out.seek(offset)
+            while written < limit:
+                chunk = stream.read(min(chunk_size, limit - written))
+                if not chunk:
+                    break
+                out.write(chunk)
+                written += len(chunk)
+    except ClientDisconnected:
+        pass
+    return written
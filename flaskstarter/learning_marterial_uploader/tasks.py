@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+    Background jobs driving the processing status of a LearningMaterial.
+
+    FILE:  UPLOADED -> TEXT_EXTRACTION_PENDING -> AI_ANALYSIS_PENDING -> COMPLETED | ANALYSIS_FAILED
+    URL:   PENDING_FETCH -> AI_ANALYSIS_PENDING -> COMPLETED | ERROR_EXTRACTION | ANALYSIS_FAILED
+
+    Also the cleanup of chunked uploads that were never finished.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import func
+
+from ..ai import AIRequestError, FileRoadmap, classify, register_prompt, render_prompt, set_ai_user
+from ..extensions import db, ai_client
+from ..jobs import Job, QUEUED, check_cancelled, job_handler, enqueue
+from ..content import get_content, get_contents, extract_document_text, DocumentExtractionError
+from flaskstarter.utils import request_ai
+from .models import LearningMaterial, UploadSession
+from .roadmap import build_roadmap
+from .storage import get_material_path, get_partial_path, read_text, save_text
+
+
+class MaterialProcessingError(Exception):
+    """Raised by a job step so the queue retries it."""
+
+
+register_prompt('file_roadmap', 1, """
+    **Role:**
+    You are an expert technical writer and document indexer. Your task is to analyze a learning document and create a structured, hierarchical table of contents in JSON format.
+
+    **Context:**
+    The user has provided a complete learning document (file ). Your entire analysis must be based on the content and structure of this document, particularly its table of contents and chapter headings.
+
+
+    **Task:**
+    Analyze the entire document and create a hierarchical roadmap of its structure. For each major chapter and its primary subsections (e.g., 1.1, 1.2), you must extract the following information:
+    1.  **level**: The heading level (1 for a main chapter, 2 for a subsection).
+    2.  **title**: The full title of the chapter or section.
+    3.  **page_start**: The page number where it begins.
+    4.  **summary**: A concise, one-sentence summary describing the content of that specific section.
+
+    Give the document's title as `document_title` and the chapters as `structure`, each with its subsections in `subsections`.""")
+
+
+def create_file_roadmap_prompt(user_id=None):
+    """The prompt sent with an uploaded file, a `RenderedPrompt`."""
+    return render_prompt('file_roadmap', key=user_id)
+
+
+def _mark_failed(payload, error):
+    material = LearningMaterial.query.get(payload['material_id'])
+    if material is None:
+        return
+    if material.processing_status == 'PENDING_FETCH':
+        material.processing_status = 'ERROR_EXTRACTION'
+    else:
+        material.processing_status = 'ANALYSIS_FAILED'
+
+
+# The provider deletes uploaded files after 48 hours. One that expires
+# within this margin is uploaded again, it may be needed for a while.
+MODEL_FILE_MARGIN = timedelta(hours=1)
+
+
+def model_file(material):
+    """The material's file as uploaded to the model, uploaded (again) when
+    the provider doesn't have it anymore."""
+    if material.gemini_file_uri:
+        try:
+            uploaded = ai_client.get_file(material.gemini_file_uri)
+        except Exception as e:
+            error = classify(e)
+            if not isinstance(error, AIRequestError):
+                raise error
+            uploaded = None  # deleted by the provider
+        expires = getattr(uploaded, 'expiration_time', None)
+        if uploaded is not None and (expires is None or
+                                     expires - MODEL_FILE_MARGIN > datetime.now(timezone.utc)):
+            return uploaded
+
+    # The 'name' attribute contains the unique ID (e.g., 'files/abc123def456')
+    uploaded = ai_client.upload_file(get_material_path(material), display_name=material.title)
+    material.gemini_file_uri = uploaded.name
+    db.session.commit()
+    return uploaded
+
+
+def material_input(material):
+    """What prompts about `material` are sent with: `(uploaded file, None)`
+    for a file only the model can read, else `(None, extracted text)`."""
+    text = None if material.gemini_file_uri else read_text(material)
+    if text is None and material.source_type == 'FILE':
+        return model_file(material), None
+    return None, text
+
+
+def material_text(material):
+    """Text of an uploaded file, extracted locally the first time.
+
+    Returns None when the format can't be read here, the file then has to
+    be sent to the model as is.
+    """
+    text = read_text(material)
+    if text is not None or not current_app.config['LOCAL_TEXT_EXTRACTION']:
+        return text
+
+    try:
+        text = extract_document_text(get_material_path(material), material.extension)
+    except DocumentExtractionError as e:
+        current_app.logger.warning(f'{material!r}: {e}')
+        return None
+    if text:
+        save_text(material, text)
+        db.session.commit()
+    return text
+
+
+def _save_roadmap(material, roadmap, prompt_version):
+    material.set_roadmap(roadmap, prompt_version)
+    material.processing_status = 'COMPLETED'
+    db.session.commit()
+
+
+def _analyze_text(material, text):
+    """Roadmap from text we have ourselves, analyzed in chunks."""
+    if not material.extracted_text_path:
+        save_text(material, text)
+    material.processing_status = 'AI_ANALYSIS_PENDING'
+    db.session.commit()
+    check_cancelled()
+
+    _save_roadmap(material, *build_roadmap(text))
+    current_app.logger.info(f'{material!r} analyzed')
+
+
+@job_handler('analyze_file_material', timeout=600, on_failure=_mark_failed)
+def analyze_file_material(material_id):
+    material = LearningMaterial.query.get(material_id)
+    if material is None or material.processing_status == 'COMPLETED':
+        return
+    set_ai_user(material.user_id)
+
+    # An identical file may have been analyzed since this one was queued
+    if material.content_hash:
+        duplicate = LearningMaterial.find_by_hash(material.content_hash, material.user_id,
+                                                  completed=True, exclude_id=material.id)
+        if duplicate:
+            material.reuse_analysis_from(duplicate)
+            db.session.commit()
+            return
+
+    material.processing_status = 'TEXT_EXTRACTION_PENDING'
+    db.session.commit()
+    extracted_text = material_text(material)
+    check_cancelled()
+
+    if extracted_text:
+        _analyze_text(material, extracted_text)
+        return
+
+    material.processing_status = 'AI_ANALYSIS_PENDING'
+    db.session.commit()
+
+    # Upload file to google server once, retries reuse the same file
+    uploaded_file_object = model_file(material)
+    check_cancelled()
+
+    prompt = create_file_roadmap_prompt(material.user_id)
+    material_roadmap = request_ai(prompt.text, uploaded_file_object, schema=FileRoadmap)
+    _save_roadmap(material, material_roadmap.model_dump(), prompt.version)
+    current_app.logger.info(f'{material!r} analyzed')
+
+
+@job_handler('analyze_link_material', timeout=600, on_failure=_mark_failed)
+def analyze_link_material(material_id, extracted_text=None):
+    # `extracted_text` only comes with jobs queued by older versions
+    material = LearningMaterial.query.get(material_id)
+    if material is None or material.processing_status == 'COMPLETED':
+        return
+    set_ai_user(material.user_id)
+
+    # Text may already have been fetched and stored as part of a reading list
+    if extracted_text is None:
+        extracted_text = read_text(material)
+    if extracted_text is None:
+        was_successful, extracted_text = get_content(material.original_url)
+        if not was_successful:
+            if extracted_text.permanent:
+                # Retrying won't bring the page back
+                _unavailable(material, extracted_text)
+                db.session.commit()
+                return
+            raise MaterialProcessingError(extracted_text)
+    check_cancelled()
+
+    _analyze_text(material, extracted_text)
+
+
+def _unavailable(material, failure):
+    current_app.logger.warning(f'{material!r} is not available: {failure}')
+    material.processing_status = 'ERROR_EXTRACTION'
+
+
+def _reading_list_failed(payload, error):
+    # The links the batch didn't get to have no analysis job to fetch them
+    materials = LearningMaterial.query.filter(LearningMaterial.id.in_(payload['material_ids']),
+                                              LearningMaterial.processing_status == 'PENDING_FETCH')
+    for material in materials:
+        handed_over = (db.session.query(Job.id)
+                       .filter(Job.name == 'analyze_link_material',
+                               Job.payload == json.dumps({'material_id': material.id}))
+                       .first())
+        if handed_over is None:
+            material.processing_status = 'ERROR_EXTRACTION'
+
+
+@job_handler('fetch_reading_list', max_attempts=1, timeout=900, on_failure=_reading_list_failed)
+def fetch_reading_list(material_ids):
+    """Fetches a batch of links concurrently, then queues one analysis per link.
+
+    A link that fails here for a reason that may pass gets a regular
+    analysis job, which fetches it again on its own with retries.
+    """
+    materials = LearningMaterial.query.filter(LearningMaterial.id.in_(material_ids)).all()
+    by_url = {}
+    for material in materials:
+        by_url.setdefault(material.original_url, []).append(material)
+
+    for url, (was_successful, extracted_text) in get_contents(by_url):
+        for material in by_url[url]:
+            if was_successful:
+                # Stored with the material, not copied into the job's payload
+                save_text(material, extracted_text)
+            elif extracted_text.permanent:
+                _unavailable(material, extracted_text)
+                continue
+            else:
+                current_app.logger.warning(f'{material!r} could not be fetched: {extracted_text}')
+            enqueue('analyze_link_material', material_id=material.id, commit=False)
+        db.session.commit()
+        check_cancelled()
+
+
+CLEANUP_JOB = 'expire_upload_sessions'
+
+
+def discard_upload(upload):
+    """Deletes an unfinished chunked upload and its partial file."""
+    partial_path = get_partial_path(upload)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    db.session.delete(upload)
+
+
+def schedule_upload_cleanup(run_at, commit=True):
+    """Queues the cleanup of abandoned uploads for `run_at` unless one is
+    already due by then."""
+    pending = (db.session.query(Job.id)
+               .filter(Job.name == CLEANUP_JOB, Job.status == QUEUED, Job.run_at <= run_at)
+               .first())
+    if pending is None:
+        enqueue(CLEANUP_JOB, run_at=run_at, commit=commit)
+
+
+@job_handler(CLEANUP_JOB)
+def expire_upload_sessions():
+    """Drops the chunked uploads left unfinished for UPLOAD_SESSION_TTL
+    seconds, then schedules itself for when the next one could expire."""
+    ttl = timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    expired = UploadSession.query.filter(UploadSession.updated_timestamp < datetime.utcnow() - ttl).all()
+    for upload in expired:
+        discard_upload(upload)
+    db.session.commit()
+
+    oldest = db.session.query(func.min(UploadSession.updated_timestamp)).scalar()
+    if oldest is not None:
+        schedule_upload_cleanup(oldest + ttl)
+    return {'expired': len(expired)}
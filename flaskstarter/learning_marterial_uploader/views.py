@@ -1,15 +1,20 @@
 import os
 import json
 import uuid  # For generating unique filenames
+from datetime import datetime, timedelta
 from flask import (render_template, redirect, url_for, request, flash,
-                   current_app,Blueprint)
+                   current_app,Blueprint, jsonify, abort)
 from flask_login import login_required, current_user
+from flask_wtf.csrf import validate_csrf
 from werkzeug.utils import secure_filename
-from .forms import FileUploadForm, LinkSubmitForm
-from .models import LearningMaterial #importing tabel/database for this feature
+from wtforms.validators import ValidationError
+from .forms import FileUploadForm, LinkSubmitForm, ReadingListForm, ALLOWED_EXTENSIONS
+from .models import LearningMaterial, UploadSession #importing tabel/database for this feature
+from .storage import (get_user_upload_folder, get_material_path, get_partial_path, save_stream,
+                      append_chunk, hash_file)
+from .tasks import discard_upload, schedule_upload_cleanup
 from ..extensions import db  
-import google.generativeai as genai
-from flaskstarter.utils import request_ai,get_content
+from ..jobs import enqueue
 
 learning_material_uploader_bp = Blueprint(
     'learning_material_uploader_bp',
@@ -28,154 +33,108 @@ def get_file_extension(filename):
     return None
 
 
+def _wants_json():
+    """The upload page posts with fetch() and asks for a JSON reply."""
+    return request.accept_mimetypes.best == 'application/json'
 
 
-@learning_material_uploader_bp.route('/upload_page', methods=['GET'])
-@login_required
-def upload_material_page():
-    file_form = FileUploadForm()
-    link_form = LinkSubmitForm()
-    
+def _render_upload_page(file_form=None, link_form=None, reading_list_form=None):
+    # The form that failed validation is passed in so its errors are displayed
     return render_template(
         'learning_material_uploader/upload_material_page.html',
         page_title='Upload Learning Material',
-        file_upload_form=file_form,
-        link_submission_form=link_form
+        file_upload_form=file_form or FileUploadForm(),
+        link_submission_form=link_form or LinkSubmitForm(),
+        reading_list_form=reading_list_form or ReadingListForm()
     )
 
+
+
+
+def _register_uploaded_file(temp_path, original_filename, extension, mimetype, size, content_hash):
+    """Moves a fully written upload into place and adds its LearningMaterial
+    to the session, with its analysis job when it needs one.
+
+    If the same content was analyzed before (by this user or anybody else)
+    the analysis is copied, so the file isn't sent to the AI again. The
+    stored file is only shared between uploads of the same user.
+    """
+    duplicate = LearningMaterial.find_by_hash(content_hash, current_user.id)
+    shared = (duplicate is not None and duplicate.user_id == current_user.id
+              and os.path.exists(get_material_path(duplicate)))
+    if shared:
+        os.remove(temp_path)
+        storage_filename = None  # the stored file belongs to the original upload
+        file_path = duplicate.file_path
+    else:
+        storage_filename = f"{uuid.uuid4().hex}.{extension}"
+        file_path = os.path.join(str(current_user.id), storage_filename) # Store a relative path
+        os.replace(temp_path, os.path.join(os.path.dirname(temp_path), storage_filename))
+
+    new_material = LearningMaterial(
+        user_id=current_user.id,
+        title=original_filename,
+        source_type='FILE',
+        original_filename=original_filename,
+        storage_filename=storage_filename,
+        file_path=file_path,
+        mimetype=mimetype,
+        extension=extension,
+        size_bytes=size,
+        content_hash=content_hash,
+        extracted_text_path=duplicate.extracted_text_path if shared else None,
+        processing_status='UPLOADED'
+    )
+    if duplicate and duplicate.processing_status == 'COMPLETED':
+        new_material.reuse_analysis_from(duplicate)
+
+    db.session.add(new_material)
+    if new_material.processing_status != 'COMPLETED':
+        # Text extraction and AI analysis run in a background worker
+        db.session.flush()
+        enqueue('analyze_file_material', material_id=new_material.id, commit=False)
+    return new_material
+
+
+def _uploaded_message(material):
+    if material.processing_status == 'COMPLETED':
+        return f'File "{material.original_filename}" was already analyzed, it is ready to use!'
+    return f'File "{material.original_filename}" uploaded successfully! Processing will begin shortly.'
+
+
+@learning_material_uploader_bp.route('/upload_page', methods=['GET'])
+@login_required
+def upload_material_page():
+    return _render_upload_page()
+
 # --- Feature 2: Handle the File Upload Submission ---
 @learning_material_uploader_bp.route('/upload-file', methods=['POST'])
 @login_required
 def handle_file_upload():
     file_form = FileUploadForm()
-    link_form = LinkSubmitForm()
 
     if file_form.validate_on_submit():
         file = file_form.learning_material_file.data
         original_filename = secure_filename(file.filename)
         extension = get_file_extension(original_filename)
 
-        unique_id = uuid.uuid4().hex
-        storage_filename = f"{unique_id}.{extension}"
-        
         # Determine storage path from app config
-        base_upload_folder = current_app.config.get('USER_UPLOADS_FOLDER', 'instance/user_uploads')
-        user_specific_folder = os.path.join(base_upload_folder, str(current_user.id))
-        
+        user_specific_folder = get_user_upload_folder(current_user.id)
+        temp_path = os.path.join(user_specific_folder, f"{uuid.uuid4().hex}.part")
+
         try:
             os.makedirs(user_specific_folder, exist_ok=True)
-            
-            file_save_path_on_disk = os.path.join(user_specific_folder, storage_filename)
-            
-            file.save(file_save_path_on_disk)
-            file_size = os.path.getsize(file_save_path_on_disk)
 
-            new_material = LearningMaterial(
-                user_id=current_user.id,
-                title=original_filename,
-                source_type='FILE',
-                original_filename=original_filename,
-                storage_filename=storage_filename,
-                file_path=os.path.join(str(current_user.id), storage_filename), # Store a relative path
-                mimetype=file.mimetype,
-                extension=extension,
-                size_bytes=file_size,
-                processing_status='UPLOADED'
-            )
-            
-            # Add to database session and commit
-            db.session.add(new_material)
+            # Hash while writing so duplicates are found without reading the file again
+            file_size, content_hash = save_stream(file.stream, temp_path)
+            new_material = _register_uploaded_file(temp_path, original_filename, extension,
+                                                   file.mimetype, file_size, content_hash)
             db.session.commit()
+            message = _uploaded_message(new_material)
 
-            flash(f'File "{original_filename}" uploaded successfully! Processing will begin shortly.', 'success')
-            
-            # TODO: Trigger background task for text extraction here
-            #AI USE : Gemini 2.5 Flash
-            # e.g., text_extraction_task.delay(new_material.id)\
-            
-            create_roadmap_prompt = f"""
-                    **Role:**
-                    You are an expert technical writer and document indexer. Your task is to analyze a learning document and create a structured, hierarchical table of contents in JSON format.
-
-                    **Context:**
-                    The user has provided a complete learning document (file ). Your entire analysis must be based on the content and structure of this document, particularly its table of contents and chapter headings.
-                    
-                    
-                    **Task:**
-                    Analyze the entire document and create a hierarchical roadmap of its structure. For each major chapter and its primary subsections (e.g., 1.1, 1.2), you must extract the following information:
-                    1.  **level**: The heading level (1 for a main chapter, 2 for a subsection).
-                    2.  **title**: The full title of the chapter or section.
-                    3.  **page_start**: The page number where it begins.
-                    4.  **summary**: A concise, one-sentence summary describing the content of that specific section.
-
-                    The final output should be a nested structure representing this hierarchy.
-
-                    **Format and Constraints:**
-                    - The entire output **MUST** be a single, valid JSON object.
-                    - **DO NOT** add any text, explanations, or introductory remarks outside the JSON structure.
-                    - The JSON object must have a `document_title` and a `structure` key. The `structure` key must contain a list of chapter objects, and each chapter object can contain a `subsections` list.
-
-                    **Example of your required output:**
-                    ```json
-                    {{
-                    "document_title": "A Brief History of Space Exploration",
-                    "structure": [
-                        {{
-                        "level": 1,
-                        "title": "1. The Early Days and the Space Race",
-                        "page_start": 1,
-                        "summary": "Covers the initial theories and the Cold War competition that fueled early space missions.",
-                        "subsections": [
-                            {{
-                            "level": 2,
-                            "title": "1.1 The V-2 Rocket and Post-War Development",
-                            "page_start": 3,
-                            "summary": "Details the role of German rocketry and its influence on early American and Soviet programs."
-                            }},
-                            {{
-                            "level": 2,
-                            "title": "1.2 Sputnik and the First Satellites",
-                            "page_start": 15,
-                            "summary": "Discusses the launch of Sputnik 1 and the beginning of the satellite era."
-                            }}
-                        ]
-                        }},
-                        {{
-                        "level": 1,
-                        "title": "2. The Apollo Program and the Moon Landing",
-                        "page_start": 35,
-                        "summary": "Focuses on the massive effort of the Apollo program, culminating in the first human landing on the Moon.",
-                        "subsections": [
-                            {{
-                            "level": 2,
-                            "title": "2.1 The Apollo 11 Mission",
-                            "page_start": 58,
-                            "summary": "Chronicles the historic mission of Neil Armstrong, Buzz Aldrin, and Michael Collins to the Moon."
-                            }}
-                        ]
-                        }}
-                    ]
-                    if after this part is empty you need to analyze the file and if after this it is a text you need to extracted text:
-                    }}"""
-
-            #upload file to google server
-            full_path_to_file = os.path.join(base_upload_folder, new_material.file_path)
-            uploaded_file_object = genai.upload_file(
-            path=full_path_to_file,
-            display_name=new_material.title
-            )
-            if uploaded_file_object:
-                 # The 'name' attribute contains the unique ID (e.g., 'files/abc123def456')
-                new_material.gemini_file_uri = uploaded_file_object.name
-                material_roadmap = request_ai(create_roadmap_prompt,uploaded_file_object)
-                if material_roadmap :
-                    new_material.analysis_roadmap = json.dumps(material_roadmap, indent= 2)
-                    new_material.processing_status = 'COMPLETED'
-                    flash(f'File "{original_filename}" processed successfully!', 'success')
-                else:
-                    new_material.processing_status = 'ANALYSIS_FAILED'
-                    flash('The AI failed to analyze the document.', 'danger')
-                db.session.commit()
+            if _wants_json():
+                return jsonify(success=True, material_id=new_material.id, message=message)
+            flash(message, 'success')
 
             # Redirect user to a clean page to prevent form re-submission on refresh
             return redirect(url_for('.upload_material_page'))
@@ -183,24 +142,159 @@ def handle_file_upload():
         except Exception as e:
             current_app.logger.error(f"Error processing file upload for user {current_user.id}: {e}")
             db.session.rollback()  # Rollback DB changes if any part of the 'try' block failed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if _wants_json():
+                return jsonify(success=False, message='An unexpected error occurred while processing your file. Please try again.'), 500
             flash('An unexpected error occurred while processing your file. Please try again.', 'danger')
             return redirect(url_for('.upload_material_page'))
 
+    if _wants_json():
+        errors = file_form.learning_material_file.errors or ['Upload failed. Maybe CSRF or missing file.']
+        return jsonify(success=False, message=' '.join(errors)), 400
+
     # If the form validation fails, re-render the upload page.
     # The 'file_form' object now contains the error messages, and your template
     # will automatically display them next to the correct field.
-    return render_template(
-        'learning_material_uploader/upload_material_page.html',
-        page_title='Upload Learning Material',
-        file_upload_form=file_form, 
-        link_submission_form=link_form 
-    )
+    return _render_upload_page(file_form=file_form)
+
+# --- Resumable chunked uploads for large files ---
+# POST   /uploads                   {"filename", "size", "mimetype"} -> upload_id
+# GET    /uploads/<id>              how many bytes the server has, to resume
+# PUT    /uploads/<id>?offset=N     raw chunk bytes, N must equal received_bytes
+# POST   /uploads/<id>/complete     turns the upload into a LearningMaterial
+# DELETE /uploads/<id>              cancels the upload
+
+def _check_csrf():
+    """JSON endpoints have no form, the token comes in a header."""
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError as e:
+            abort(400, str(e))
+
+
+def _upload_state(upload):
+    return {
+        'upload_id': upload.id,
+        'received_bytes': upload.received_bytes,
+        'total_size': upload.total_size,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+    }
+
+
+def _get_upload_or_404(upload_id):
+    return UploadSession.query.filter_by(id=upload_id, user_id=current_user.id).first_or_404()
+
+
+@learning_material_uploader_bp.route('/uploads', methods=['POST'])
+@login_required
+def start_chunked_upload():
+    _check_csrf()
+    data = request.get_json(silent=True) or {}
+
+    original_filename = secure_filename(data.get('filename') or '')
+    extension = get_file_extension(original_filename)
+    if extension not in ALLOWED_EXTENSIONS:
+        return jsonify(success=False, message=f'Invalid file type. Allowed types are: {", ".join(ALLOWED_EXTENSIONS)}'), 400
+
+    try:
+        total_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        total_size = 0
+    if total_size <= 0:
+        return jsonify(success=False, message='The file size is missing.'), 400
+    if total_size > current_app.config['MAX_UPLOAD_SIZE']:
+        return jsonify(success=False, message='The file is too large.'), 413
+
+    upload = UploadSession(id=uuid.uuid4().hex,
+                           user_id=current_user.id,
+                           original_filename=original_filename,
+                           extension=extension,
+                           mimetype=data.get('mimetype'),
+                           total_size=total_size,
+                           received_bytes=0)
+
+    os.makedirs(get_user_upload_folder(current_user.id), exist_ok=True)
+    open(get_partial_path(upload), 'wb').close()
+
+    db.session.add(upload)
+    # Dropped if it isn't finished within UPLOAD_SESSION_TTL
+    ttl = timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    schedule_upload_cleanup(datetime.utcnow() + ttl, commit=False)
+    db.session.commit()
+    return jsonify(_upload_state(upload)), 201
+
+
+@learning_material_uploader_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(upload_id):
+    return jsonify(_upload_state(_get_upload_or_404(upload_id)))
+
+
+@learning_material_uploader_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    _check_csrf()
+    upload = _get_upload_or_404(upload_id)
+
+    offset = request.args.get('offset', type=int)
+    if offset != upload.received_bytes:
+        # The client lost track (e.g. after a dropped connection), tell it where to resume
+        return jsonify(message='Offset mismatch, resume from received_bytes.', **_upload_state(upload)), 409
+
+    written = append_chunk(get_partial_path(upload), offset, request.stream,
+                           limit=upload.total_size - offset)
+    upload.received_bytes = offset + written
+    db.session.commit()
+    return jsonify(_upload_state(upload))
+
+
+@learning_material_uploader_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    _check_csrf()
+    upload = _get_upload_or_404(upload_id)
+    if not upload.is_complete:
+        return jsonify(message='The upload is not complete yet.', **_upload_state(upload)), 409
+
+    try:
+        partial_path = get_partial_path(upload)
+        content_hash = hash_file(partial_path, upload.total_size).hexdigest()
+        new_material = _register_uploaded_file(partial_path, upload.original_filename, upload.extension,
+                                               upload.mimetype, upload.total_size, content_hash)
+        # The material, its job and the end of the upload in one transaction
+        db.session.delete(upload)
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(f"Error finalizing chunked upload {upload_id} for user {current_user.id}: {e}")
+        db.session.rollback()
+        return jsonify(success=False, message='An unexpected error occurred while processing your file. Please try again.'), 500
+
+    return jsonify(success=True, material_id=new_material.id, message=_uploaded_message(new_material))
+
+
+@learning_material_uploader_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_chunked_upload(upload_id):
+    _check_csrf()
+    discard_upload(_get_upload_or_404(upload_id))
+    db.session.commit()
+    return jsonify(success=True)
+
+
+@learning_material_uploader_bp.route('/material/<int:material_id>/status', methods=['GET'])
+@login_required
+def material_status(material_id):
+    """Lets the upload page poll while a worker processes the material."""
+    material = LearningMaterial.query.filter_by(id=material_id, user_id=current_user.id).first_or_404()
+    return jsonify(id=material.id, title=material.title, status=material.processing_status)
+
 
 @learning_material_uploader_bp.route('/submit-link', methods=['POST'])
 @login_required
 def handle_link_submission():
     link_form = LinkSubmitForm()
-    file_form = FileUploadForm() 
 
     if link_form.validate_on_submit():
         url_submitted = link_form.material_url.data
@@ -219,68 +313,9 @@ def handle_link_submission():
 
             flash(f'Link submitted successfully! We will process its content shortly.', 'success')
 
-            # TODO: Trigger background task to fetch, parse, and extract text from the URL
-            # e.g., url_content_extraction_task.delay(new_material.id)
-            was_succesful,extracted_text = get_content(new_material.original_url)
-
-            create_roadmap_prompt = f"""
-                    **Role:**
-                    You are an expert academic analyst and document indexer. Your task is to analyze a learning document and create a detailed, structured, and self-contained roadmap in JSON format.
-
-                    **Context:**
-                    The user has provided the following learning material as a single block of text. Your entire analysis must be based on this text.
-                    ---
-                    {extracted_text}
-                    ---
-
-                    **Task:**
-                    Analyze the provided text and create a hierarchical roadmap of its structure. For each major chapter and primary subsection you identify, you MUST extract the following information:
-                    1.  **level**: The heading level (1 for a main chapter, 2 for a subsection).
-                    2.  **title**: The full title of the chapter or section.
-                    3.  **summary**: A concise, one-sentence summary describing the content of that specific section.
-                    4.  **content**: The **full and complete text** of that entire section, from its heading to the beginning of the next section.
-
-                    The final output should be a nested JSON structure representing this hierarchy.
-
-                    **Format and Constraints:**
-                    - The entire output **MUST** be a single, valid JSON object.
-                    - **DO NOT** add any text, explanations, or introductory remarks outside the JSON structure.
-                    - The JSON object must have a `document_title` and a `structure` key. The `structure` key must contain a list of chapter objects, and each chapter object can contain a `subsections` list.
-                    - Each object within the `structure` and `subsections` lists must contain the four keys: `level`, `title`, `summary`, and `content`.
-
-                    **Example of your required output:**
-                    ```json
-                    {{
-                    "document_title": "A Brief History of Space Exploration",
-                    "structure": [
-                        {{
-                        "level": 1,
-                        "title": "1. The Early Days and the Space Race",
-                        "summary": "Covers the initial theories and the Cold War competition that fueled early space missions.",
-                        "content": "The dream of space travel is as old as humanity itself, but it was not until the 20th century that it became a scientific possibility. The theoretical groundwork was laid by pioneers like Konstantin Tsiolkovsky... (and so on, with the full text of the entire chapter here)."
-                        }},
-                        {{
-                        "level": 1,
-                        "title": "2. The Apollo Program",
-                        "summary": "Focuses on the massive effort of the Apollo program, culminating in the first human landing on the Moon.",
-                        "content": "In response to the Soviet Union's early lead in the space race, President John F. Kennedy announced the ambitious goal of landing a man on the Moon... (and so on, with the full text of this chapter here)."
-                        }}
-                    ]
-                    }}"""
-
-
-            material_roadmap = request_ai(create_roadmap_prompt )
-            if material_roadmap :
-                new_material.analysis_roadmap = json.dumps(material_roadmap, indent= 2)
-                new_material.processing_status = 'COMPLETED'
-                flash(f'File "{new_material.original_filename}" processed successfully!', 'success')
-            else:
-                new_material.processing_status = 'ANALYSIS_FAILED'
-                flash('The AI failed to analyze the document.', 'danger')
-            db.session.commit()
-
+            # Fetching and AI analysis run in a background worker
+            enqueue('analyze_link_material', material_id=new_material.id)
 
-            
             return redirect(url_for('.upload_material_page'))
 
         except Exception as e:
@@ -289,12 +324,48 @@ def handle_link_submission():
             flash('An unexpected error occurred while submitting your link. Please try again.', 'danger')
             return redirect(url_for('.upload_material_page'))
 
-    return render_template(
-        'learning_material_uploader/upload_material_page.html',
-        page_title='Upload Learning Material',
-        file_upload_form=file_form, 
-        link_submission_form=link_form 
-    )   
+    return _render_upload_page(link_form=link_form)
+
+
+@learning_material_uploader_bp.route('/submit-reading-list', methods=['POST'])
+@login_required
+def handle_reading_list_submission():
+    reading_list_form = ReadingListForm()
+
+    if reading_list_form.validate_on_submit():
+        urls = reading_list_form.get_urls()
+        max_urls = current_app.config['READING_LIST_MAX_URLS']
+        if len(urls) > max_urls:
+            flash(f'Please submit at most {max_urls} links at once.', 'danger')
+            return _render_upload_page(reading_list_form=reading_list_form)
+
+        try:
+            materials = [
+                LearningMaterial(
+                    user_id=current_user.id,
+                    title=url,
+                    source_type='URL',
+                    original_url=url,
+                    processing_status='PENDING_FETCH'
+                )
+                for url in urls
+            ]
+            db.session.add_all(materials)
+            db.session.commit()
+
+            # One job fetches the whole list concurrently, then fans out the analysis
+            enqueue('fetch_reading_list', material_ids=[m.id for m in materials])
+
+            flash(f'{len(materials)} links submitted successfully! We will process their content shortly.', 'success')
+            return redirect(url_for('.upload_material_page'))
+
+        except Exception as e:
+            current_app.logger.error(f"Error processing reading list for user {current_user.id}: {e}")
+            db.session.rollback()
+            flash('An unexpected error occurred while submitting your links. Please try again.', 'danger')
+            return redirect(url_for('.upload_material_page'))
+
+    return _render_upload_page(reading_list_form=reading_list_form)
 
 from flask import Blueprint, render_template, request, jsonify
 from flaskstarter.learning_marterial_uploader.forms import FileUploadForm
@@ -3,8 +3,9 @@
 from flask import Blueprint, render_template, request, flash
 from flask_login import login_required, current_user
 
+from ..caching import invalidate_user
 from ..extensions import db
-from ..user import Users
+from ..user import Users, PasswordHashBusy
 from .forms import ProfileForm, PasswordForm
 
 
@@ -26,6 +27,7 @@ def profile():
 
         db.session.add(user)
         db.session.commit()
+        invalidate_user(user.id)
 
         flash('Profile Changes Saved!', 'success')
 
@@ -39,14 +41,21 @@ def password():
     user = Users.query.filter_by(email=current_user.email).first_or_404()
     form = PasswordForm(next=request.args.get('next'))
 
-    if form.validate_on_submit():
-        form.populate_obj(user)
-        user.password = form.new_password.data
-
-        db.session.add(user)
-        db.session.commit()
-
-        flash('Password updated.', 'success')
+    try:
+        # Checking the current password and hashing the new one both wait
+        # for the hashing pool
+        if form.validate_on_submit():
+            form.populate_obj(user)
+            user.password = form.new_password.data
+
+            db.session.add(user)
+            db.session.commit()
+            invalidate_user(user.id)
+
+            flash('Password updated.', 'success')
+    except PasswordHashBusy:
+        db.session.rollback()
+        flash('Too many password changes in progress, please try again in a moment', 'warning')
 
     return render_template('settings/password.html',
                            user=user, active="password", form=form)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    Persistent key/value cache in a SQLite file.
+
+    Entries expire after a TTL and the least recently used ones are evicted
+    once the cache grows past `max_entries` or `max_bytes`. The file can be
+    shared by every worker process on a host.
+
+    A hit doesn't write: access times are only refreshed when older than
+    `touch_interval` (LRU order doesn't need to be exact), and hit/miss
+    counters are added up in memory and written every `flush_interval`
+    seconds or with the next `set`. Reads then don't queue on SQLite's
+    single write lock.
+
+    The number and total size of the entries are kept up to date by
+    triggers, so a `set` only scans the table when it has to evict.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache(object):
+    """
+    LRU cache of bytes values stored in SQLite.
+
+    :param path: location of the SQLite file, created if needed
+    :param ttl: seconds an entry stays valid, None for no expiry
+    :param max_entries: evict LRU entries above this many rows
+    :param max_bytes: evict LRU entries above this total value size
+    :param touch_interval: seconds before a hit refreshes an access time
+    :param flush_interval: seconds between writes of the hit/miss counters
+    """
+
+    def __init__(self, path, ttl=None, max_entries=10000, max_bytes=256 * 1024 * 1024,
+                 touch_interval=60, flush_interval=5):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._pending_lock = threading.Lock()
+        self._pending_counts = {}
+        self._pending_touches = {}
+        self._flushed_at = time.monotonic()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                     'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                     'created REAL NOT NULL, accessed REAL NOT NULL, expires REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 1), '
+                         'entries INTEGER NOT NULL, bytes INTEGER NOT NULL)')
+            # Files from before the totals existed are counted once
+            conn.execute('INSERT OR IGNORE INTO totals SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM entries')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS entries_inserted AFTER INSERT ON entries BEGIN '
+                         'UPDATE totals SET entries = entries + 1, bytes = bytes + new.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS entries_deleted AFTER DELETE ON entries BEGIN '
+                         'UPDATE totals SET entries = entries - 1, bytes = bytes - old.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS entries_resized AFTER UPDATE OF size ON entries BEGIN '
+                         'UPDATE totals SET bytes = bytes + new.size - old.size; END')
+
+    def _totals(self, conn):
+        return conn.execute('SELECT entries, bytes FROM totals').fetchone()
+
+    def _count(self, conn, name, amount=1):
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                     (name, amount))
+
+    def get(self, key):
+        """Returns the cached value or None, and records a hit or a miss."""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute('SELECT value, accessed FROM entries WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                           (key, now)).fetchone()
+        with self._pending_lock:
+            name = 'misses' if row is None else 'hits'
+            self._pending_counts[name] = self._pending_counts.get(name, 0) + 1
+            if row is not None and now - row[1] >= self.touch_interval:
+                self._pending_touches[key] = now
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+        return None if row is None else row[0]
+
+    def _take_pending(self):
+        with self._pending_lock:
+            counts, touches = self._pending_counts, self._pending_touches
+            self._pending_counts, self._pending_touches = {}, {}
+            self._flushed_at = time.monotonic()
+        return counts, touches
+
+    def _write_pending(self, conn, counts, touches):
+        for name, amount in counts.items():
+            self._count(conn, name, amount)
+        if touches:
+            conn.executemany('UPDATE entries SET accessed = MAX(accessed, ?) WHERE key = ?',
+                             [(accessed, key) for key, accessed in touches.items()])
+
+    def flush(self):
+        """Writes the counters and access times gathered since the last flush."""
+        counts, touches = self._take_pending()
+        if not counts and not touches:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._write_pending(conn, counts, touches)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires = now + ttl if ttl else None
+        counts, touches = self._take_pending()  # in the same write
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._write_pending(conn, counts, touches)
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete
+            # doesn't fire the triggers keeping the totals
+            conn.execute('INSERT INTO entries (key, value, size, created, accessed, expires) '
+                         'VALUES (?, ?, ?, ?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+                         'created = excluded.created, accessed = excluded.accessed, expires = excluded.expires',
+                         (key, value, len(value), now, now, expires))
+            self._count(conn, 'sets')
+            self._evict(conn, now)
+
+    def delete(self, key):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        self._take_pending()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM counters')
+
+    def _evict(self, conn, now):
+        count, size = self._totals(conn)
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+
+        # Expired entries go first, they were only left because they're never read
+        evicted = conn.execute('DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?',
+                               (now,)).rowcount
+        count, size = self._totals(conn)
+        while count > self.max_entries or size > self.max_bytes:
+            # Drop the least recently used tenth of the cache at a time
+            batch = max(1, count // 10, count - self.max_entries)
+            evicted += conn.execute('DELETE FROM entries WHERE key IN '
+                                    '(SELECT key FROM entries ORDER BY accessed LIMIT ?)',
+                                    (batch,)).rowcount
+            count, size = self._totals(conn)
+
+        if evicted:
+            self._count(conn, 'evictions', evicted)
+
+    def stats(self):
+        """Hit/miss counters plus current size, shared by all processes."""
+        self.flush()
+        conn = self._connect()
+        stats = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        count, size = self._totals(conn)
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'sets': stats.get('sets', 0),
+            'evictions': stats.get('evictions', 0),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': count,
+            'bytes': size,
+        }
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
+
 from sqlalchemy import Column
 
+from ..caching import cached_for_user, invalidate_user_cache_on_change
 from ..extensions import db
 from ..utils import get_current_time
 
@@ -9,6 +12,9 @@ from flask_login import current_user
 from flask_admin.contrib import sqla
 
 
+TaskListing = namedtuple('TaskListing', 'id task added_time')
+
+
 class MyTaskModel(db.Model):
 
     __tablename__ = 'mytask_model'
@@ -22,11 +28,24 @@ class MyTaskModel(db.Model):
     users_id = Column(db.Integer, db.ForeignKey("users.id"))
     user = db.relationship("Users", uselist=False, backref="mytask_model")
 
+    @classmethod
+    def list_for_user(cls, user_id):
+        """The user's tasks as `TaskListing`s, served from the cache."""
+        def load():
+            rows = (db.session.query(cls.id, cls.task, cls.added_time)
+                    .filter_by(users_id=user_id)
+                    .order_by(cls.id))
+            return [TaskListing(*row) for row in rows]
+        return cached_for_user('tasks', user_id, load)
+
     def __unicode__(self):
         _str = 'ID: %s, Post: %s' % (self.id, self.task)
         return str(_str)
 
 
+invalidate_user_cache_on_change(MyTaskModel, 'tasks', user_attr='users_id')
+
+
 # Customized MyTask model admin
 class MyTaskModelAdmin(sqla.ModelView):
     column_sortable_list = ('id', 'users_id', 'added_time')
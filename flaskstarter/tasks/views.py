@@ -16,7 +16,7 @@ tasks = Blueprint('tasks', __name__, url_prefix='/tasks')
 @login_required
 def my_tasks():
 
-    _all_tasks = MyTaskModel.query.filter_by(users_id=current_user.id).all()
+    _all_tasks = MyTaskModel.list_for_user(current_user.id)
 
     return render_template('tasks/my_tasks.html',
                            all_tasks=_all_tasks,
@@ -1,4 +1,5 @@
 from . import views,models,forms
+from . import tasks
 from .views import test_learning_function_bp
 from .models import Test,Question,TestAttempt,UserAnswer
 from .forms import TestSpecificationForm,AnswerForm
@@ -10,20 +10,21 @@ class TestSpecificationForm(FlaskForm):
         'Test Name',
         validators=[InputRequired(), Length(min=3, max=150)]
     )
-    # The 'choices' for these SelectFields will be populated in your view function
-    scope = SelectField(
-        'Scope of the Test',
+    # The 'choices' for this SelectField will be populated in your view function
+    material_id = SelectField(
+        'Source Material',
         choices=[],
+        coerce=int,
         validators=[InputRequired()]
     )
-    goal = SelectField(
+    # Free text, the page offers suggestions
+    scope = StringField(
+        'Scope of the Test',
+        validators=[InputRequired(), Length(max=255)]
+    )
+    goal = StringField(
         'Primary Goal for this Test',
-        choices=[
-            ('Check basic comprehension', 'Check basic comprehension'),
-            ('Identify my weak spots', 'Identify my weak spots'),
-            ('Prepare for an exam', 'Prepare for an exam')
-        ],
-        validators=[InputRequired()]
+        validators=[InputRequired(), Length(max=100)]
     )
     understanding = SelectField(
         'Your Current Understanding',
@@ -32,7 +33,8 @@ class TestSpecificationForm(FlaskForm):
             ('Reviewed it briefly', 'Reviewed it briefly'),
             ('I feel confident', 'I feel confident')
         ],
-        validators=[InputRequired()]
+        default='Just finished reading',
+        validators=[Optional()]
     )
     
     submit = SubmitField('Create Test')
@@ -1,8 +1,15 @@
 import enum
+from collections import namedtuple
 from datetime import datetime
 from flaskstarter.learning_marterial_uploader.models import LearningMaterial
+from sqlalchemy import func, insert
+from ..caching import cached_for_user, invalidate_for_user_on_commit, invalidate_user_cache_on_change
+from ..compression import CompressedText
 from ..extensions import db 
 
+# What the test library shows of a test, cached per user
+TestListing = namedtuple('TestListing', 'id name material_id spec_scope spec_goal spec_understanding created_at')
+
 # Using an Enum for the status makes the code cleaner and the database values consistent.
 class AttemptStatus(enum.Enum):
     IN_PROGRESS = "In Progress"
@@ -22,6 +29,9 @@ class Test(db.Model):
     spec_scope = db.Column(db.String(255))
     spec_goal = db.Column(db.String(100))
     spec_understanding = db.Column(db.String(100))
+
+    # name@version of the prompt that generated the questions, see ai/prompts.py
+    prompt_version = db.Column(db.String(64))
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -29,9 +39,46 @@ class Test(db.Model):
     questions = db.relationship('Question', back_populates='test', lazy='dynamic', cascade="all, delete-orphan")
     attempts = db.relationship('TestAttempt', back_populates='test', lazy='dynamic', cascade="all, delete-orphan")
 
+    @classmethod
+    def list_for_user(cls, user_id):
+        """The user's tests as `TestListing`s, newest first, served from the cache."""
+        def load():
+            rows = (db.session.query(*(getattr(cls, field) for field in TestListing._fields))
+                    .filter_by(user_id=user_id)
+                    .order_by(cls.created_at.desc(), cls.id.desc()))
+            return [TestListing(*row) for row in rows]
+        return cached_for_user('tests', user_id, load)
+
+    @classmethod
+    def create_with_questions(cls, user_id, material_id, name, questions, spec_scope=None,
+                              spec_goal=None, spec_understanding=None, prompt_version=None):
+        """
+        Writes a test, its questions in order and a first attempt in three
+        statements, the questions as one multi-row insert. Doesn't commit.
+
+        :return: `(test_id, attempt_id)`
+        """
+        session = db.session
+        test_id = session.execute(insert(cls).values(
+            user_id=user_id, material_id=material_id, name=name, spec_scope=spec_scope,
+            spec_goal=spec_goal, spec_understanding=spec_understanding, prompt_version=prompt_version,
+        )).inserted_primary_key[0]
+        if questions:
+            session.execute(insert(Question), [
+                {'test_id': test_id, 'question_text': text, 'order': order}
+                for order, text in enumerate(questions, 1)
+            ])
+        attempt_id = session.execute(insert(TestAttempt).values(
+            user_id=user_id, test_id=test_id,
+        )).inserted_primary_key[0]
+        invalidate_for_user_on_commit(session, 'tests', user_id)
+        return test_id, attempt_id
+
     def __repr__(self):
         return f"<Test {self.id}: {self.name}>"
 
+invalidate_user_cache_on_change(Test, 'tests')
+
 class Question(db.Model):
     __tablename__ = 'question'
 
@@ -62,6 +109,20 @@ class TestAttempt(db.Model):
     test = db.relationship('Test', back_populates='attempts')
     user_answers = db.relationship('UserAnswer', back_populates='attempt', lazy='dynamic', cascade="all, delete-orphan")
 
+    def question_at(self, order):
+        """Only the one question, not the whole `test.questions`."""
+        return Question.query.filter_by(test_id=self.test_id, order=order).first()
+
+    def question_count(self):
+        return db.session.query(func.count(Question.id)).filter(Question.test_id == self.test_id).scalar()
+
+    def answers_to(self, question_id):
+        """This attempt's answers to a question, oldest first."""
+        return (UserAnswer.query
+                .filter_by(attempt_id=self.id, question_id=question_id)
+                .order_by(UserAnswer.id)
+                .all())
+
     def __repr__(self):
         return f"<TestAttempt {self.id} by User {self.user_id} with status {self.status}>"
 
@@ -73,7 +134,9 @@ class UserAnswer(db.Model):
     question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
     
     answer_text = db.Column(db.Text, nullable=False)
-    feedback_text = db.Column(db.Text, nullable=True) # Null until feedback is generated
+    feedback_text = db.Column(CompressedText, nullable=True) # Null until feedback is generated
+    # The attempt_feedback job writing the feedback, so that no other run does
+    feedback_job_id = db.Column(db.Integer, nullable=True)
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     attempt = db.relationship('TestAttempt', back_populates='user_answers')
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+    Background jobs of the test function.
+
+    generate_test_bank: each requested test is one prompt. The prompts run
+    on a pool of TEST_BANK_MAX_WORKERS threads, no more than the user's
+    AI_MAX_CONCURRENCY_PER_USER, which is also the number of requests in
+    flight to the AI provider, and every test is saved as soon as its
+    answer arrives. Progress is reported through the job's result.
+
+    attempt_feedback: tutor feedback on the answers of a test attempt. One
+    job works through all answers still waiting for feedback, oldest first,
+    so feedback on a retry can build on the feedback before it. Each answer
+    is claimed by the job before its prompt is sent, and its feedback is
+    only written if nothing else was written meanwhile.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+from sqlalchemy import and_, or_, update
+
+from ..ai import AIError, Feedback, TestQuestions, register_prompt, render_prompt, set_ai_user, user_workers
+from ..extensions import db
+from ..jobs import (Job, QUEUED, RUNNING, check_cancelled, current_job_id, enqueue, job_cancelled,
+                    job_handler, report_progress)
+from ..learning_marterial_uploader.models import LearningMaterial
+from ..learning_marterial_uploader.tasks import material_input
+from flaskstarter.utils import request_ai
+from .models import Test, TestAttempt, UserAnswer
+
+
+register_prompt('test_questions', 1, """
+    **Role:**
+    You are an expert educator and instructional designer. Your task is to create a high-quality, open-ended test based on a student's learning goals and the provided material.
+
+    **Context:**
+    - **Roadmap (if available):** {roadmap}
+    - **Source Material / Text:** ---
+    {material}
+    ---
+    - **Student's Specifications:**
+    - **Scope of the test:** "{scope}"
+    - **Student's current understanding:** "{understanding}"
+    - **Student's primary goal for this test:** "{goal}"
+
+    **Task:**
+    You must perform the following two steps in order:
+
+    1.  **Determine Question Count:** First, you **MUST** analyze all the provided context (the material, the scope, and the user's goal) to calculate the single most appropriate number of questions for a test. A basic goal requires fewer questions than an exam preparation goal.
+
+    2.  **Generate Test Questions:** Generate the exact number of open-ended questions you determined in Step 1. The questions must be tailored to the student's goal and be based only on the provided material within the specified scope.
+
+    Give the count as `generated_question_count` and the questions as `questions`.
+    """, truncate={'material': 'head', 'roadmap': 'head'})
+
+
+register_prompt('test_feedback', 1, """
+    **Role:**
+    You are an expert, encouraging Socratic tutor. Your goal is to guide the student towards the correct answer without simply giving it away.
+
+    **Context:**
+    - **The original question is:** "{question}"
+    - **The student's current answer is:** "{answer}"
+    - **Previous answer of this user on this question (if any):**
+    ---
+    {history}
+    ---
+
+    **Task:**
+    Analyze the student's **current answer** in the context of the question and the **previous conversation history**.
+    1.  If the student has improved on a previous answer, acknowledge their progress.
+    2.  If the current answer is correct, praise them and confirm their understanding.
+    3.  If the current answer is still incorrect or incomplete, **do not give the direct answer**. Instead, ask a guiding question or provide a small hint that builds on your previous feedback to help them think about the topic in a new way.
+
+    Keep the feedback (`feedback_text`) concise, encouraging, and focused on guiding the student.
+    """, truncate={'history': 'tail'}, max_tokens=8000)
+
+
+def call_AI_for_test_generation(scope_of_test, goal_of_test, current_understanding, roadmap=None, material=None,
+                                user_id=None):
+    """The test generation prompt, a `RenderedPrompt`."""
+    return render_prompt('test_questions', key=user_id, roadmap=roadmap, material=material, scope=scope_of_test,
+                         understanding=current_understanding, goal=goal_of_test)
+
+
+def create_feedback_prompt(question_text, current_user_answer, conversation_history, user_id=None):
+    """The tutor feedback prompt, a `RenderedPrompt`."""
+    return render_prompt('test_feedback', key=user_id, question=question_text, answer=current_user_answer,
+                         history=conversation_history)
+
+
+def _generate(app, user_id, spec, roadmap, extracted_text, input_file):
+    with app.app_context():
+        set_ai_user(user_id)
+        prompt = call_AI_for_test_generation(spec['scope'], spec['goal'], spec.get('understanding'),
+                                             roadmap, extracted_text, user_id=user_id)
+        return request_ai(prompt.text, input_file, schema=TestQuestions), prompt.version
+
+
+@job_handler('generate_test_bank', max_attempts=1, timeout=3600)
+def generate_test_bank(user_id, material_id, specs):
+    """Generates a test per spec (name, scope, goal, understanding).
+
+    Not retried: tests saved before a failure would be created twice.
+    """
+    material = LearningMaterial.query.filter_by(id=material_id, user_id=user_id).first()
+    if material is None:
+        raise LookupError(f'Material {material_id} of user {user_id} not found')
+    set_ai_user(user_id)
+
+    roadmap = json.dumps(material.analysis_roadmap)
+    input_file, extracted_text = material_input(material)
+
+    progress = {'total': len(specs), 'done': 0, 'failed': 0, 'tests': [], 'errors': []}
+    report_progress(**progress)
+
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=user_workers(current_app.config['TEST_BANK_MAX_WORKERS'])) as executor:
+        futures = {executor.submit(_generate, app, user_id, spec, roadmap, extracted_text, input_file): spec
+                   for spec in specs}
+        for future in as_completed(futures):
+            if job_cancelled():
+                # Out of time: the tests not started yet are given up
+                for pending in futures:
+                    pending.cancel()
+            spec = futures[future]
+            error = 'No questions were generated'
+            if future.cancelled():
+                error = 'Not generated, the test bank ran out of time'
+            try:
+                answer, prompt_version = future.result()
+            except Exception as e:
+                answer = None
+                if isinstance(e, AIError):
+                    error = e.message
+                current_app.logger.error(f'Test "{spec["name"]}" for material {material_id} failed: {e!r}')
+            if answer is not None:
+                try:
+                    test_id, attempt_id = Test.create_with_questions(
+                        user_id, material_id, spec['name'], answer.questions, spec_scope=spec['scope'],
+                        spec_goal=spec['goal'], spec_understanding=spec.get('understanding'),
+                        prompt_version=prompt_version)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    answer = None
+                    error = 'The test could not be saved'
+                    current_app.logger.error(f'Saving test "{spec["name"]}" for material {material_id} '
+                                             f'failed: {e!r}')
+            if answer is None:
+                progress['failed'] += 1
+                progress['errors'].append({'name': spec['name'], 'error': error})
+            else:
+                progress['done'] += 1
+                progress['tests'].append({'name': spec['name'], 'test_id': test_id,
+                                          'attempt_id': attempt_id})
+            report_progress(**progress)
+
+    return progress
+
+
+FEEDBACK_UNAVAILABLE = 'Feedback could not be generated for this answer.'
+
+
+def queue_attempt_feedback(attempt_id, commit=True):
+    """Queues feedback for the attempt's new answers, unless a job for the
+    attempt is queued or running already."""
+    payload = json.dumps({'attempt_id': attempt_id})
+    pending = (db.session.query(Job.id)
+               .filter(Job.name == 'attempt_feedback', Job.status.in_((QUEUED, RUNNING)), Job.payload == payload)
+               .first())
+    if pending is None:
+        enqueue('attempt_feedback', commit=commit, attempt_id=attempt_id)
+
+
+def _conversation_history(answer):
+    earlier = (UserAnswer.query
+               .filter(UserAnswer.attempt_id == answer.attempt_id,
+                       UserAnswer.question_id == answer.question_id,
+                       UserAnswer.id < answer.id)
+               .order_by(UserAnswer.id))
+    return '\n'.join(f'Answer: {previous.answer_text}\nFeedback: {previous.feedback_text or "(none)"}'
+                     for previous in earlier)
+
+
+def _unclaimed(job_id):
+    # A retry of the same job takes back what it had claimed
+    return and_(UserAnswer.feedback_text.is_(None),
+                or_(UserAnswer.feedback_job_id.is_(None), UserAnswer.feedback_job_id == job_id))
+
+
+def _claim_next_answer(attempt_id, job_id):
+    """Oldest answer of the attempt waiting for feedback, claimed for `job_id`."""
+    while True:
+        answer_id = (db.session.query(UserAnswer.id)
+                     .filter(UserAnswer.attempt_id == attempt_id, _unclaimed(job_id))
+                     .order_by(UserAnswer.id)
+                     .limit(1)
+                     .scalar())
+        if answer_id is None:
+            return None
+        claimed = db.session.execute(
+            update(UserAnswer)
+            .where(UserAnswer.id == answer_id, _unclaimed(job_id))
+            .values(feedback_job_id=job_id)
+        )
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return db.session.get(UserAnswer, answer_id)
+
+
+def _feedback_failed(payload, error):
+    # Only the answers this job had claimed, others may be on their way
+    UserAnswer.query.filter(UserAnswer.attempt_id == payload['attempt_id'],
+                            UserAnswer.feedback_job_id == current_job_id(),
+                            UserAnswer.feedback_text.is_(None)).update(
+        {UserAnswer.feedback_text: FEEDBACK_UNAVAILABLE}, synchronize_session=False)
+
+
+@job_handler('attempt_feedback', timeout=600, on_failure=_feedback_failed)
+def attempt_feedback(attempt_id):
+    job_id = current_job_id()
+    user_id = db.session.query(TestAttempt.user_id).filter_by(id=attempt_id).scalar()
+    set_ai_user(user_id)
+    done = 0
+    # Answers submitted while the job runs are picked up too
+    while True:
+        check_cancelled()  # the rest is picked up by the retry
+        answer = _claim_next_answer(attempt_id, job_id)
+        if answer is None:
+            break
+        prompt = create_feedback_prompt(answer.question.question_text, answer.answer_text,
+                                        _conversation_history(answer), user_id=user_id)
+        feedback_text = request_ai(prompt.text, schema=Feedback).feedback_text
+        # Saved one by one, the page shows each as soon as it is ready
+        db.session.execute(
+            update(UserAnswer)
+            .where(UserAnswer.id == answer.id, UserAnswer.feedback_job_id == job_id,
+                   UserAnswer.feedback_text.is_(None))
+            .values(feedback_text=feedback_text)
+        )
+        db.session.commit()
+        done += 1
+    return {'answers': done}
@@ -1,12 +1,20 @@
 
-from flask import (render_template, redirect,url_for,request,flash,current_app,Blueprint)
+import time
+from datetime import datetime
+from flask import (render_template, redirect,url_for,request,flash,current_app,Blueprint,
+                   jsonify, abort, Response, stream_with_context)
 from flask_login import login_required, current_user
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
 from .forms import TestSpecificationForm, AnswerForm
-from .models import Test,Question,TestAttempt,UserAnswer,LearningMaterial
+from .models import Test,Question,TestAttempt,UserAnswer,LearningMaterial,AttemptStatus
+from .tasks import call_AI_for_test_generation, queue_attempt_feedback
 import json
-import google.generativeai as genai
+from ..ai import AIError, TestQuestions
 from ..extensions import db
-from flaskstarter.utils import request_ai
+from ..jobs import Job, enqueue, SUCCEEDED, FAILED
+from ..learning_marterial_uploader.tasks import material_input
+from flaskstarter.utils import request_ai, request_ai_stream
 
 
 test_learning_function_bp = Blueprint(
@@ -17,87 +25,6 @@ test_learning_function_bp = Blueprint(
 )
 
     
-def call_AI_for_test_generation(scope_of_test, goal_of_test, current_understanding, roadmap=None, material=None):
-    prompt = f"""
-            **Role:**
-            You are an expert educator and instructional designer. Your task is to create a high-quality, open-ended test based on a student's learning goals and the provided material.
-
-            **Context:**
-            - **Roadmap (if available):** {roadmap}
-            - **Source Material / Text:** ---
-            {material}
-            ---
-            - **Student's Specifications:**
-            - **Scope of the test:** "{scope_of_test}"
-            - **Student's current understanding:** "{current_understanding}"
-            - **Student's primary goal for this test:** "{goal_of_test}"
-
-            **Task:**
-            You must perform the following two steps in order:
-
-            1.  **Determine Question Count:** First, you **MUST** analyze all the provided context (the material, the scope, and the user's goal) to calculate the single most appropriate number of questions for a test. A basic goal requires fewer questions than an exam preparation goal.
-
-            2.  **Generate Test Questions:** Generate the exact number of open-ended questions you determined in Step 1. The questions must be tailored to the student's goal and be based only on the provided material within the specified scope.
-
-            **Format and Constraints:**
-            1.  The entire output **MUST** be a single, valid JSON object.
-            2.  The JSON object **MUST** contain two top-level keys:
-                - `"generated_question_count"`: The integer for the number of questions you decided to create.
-                - `"questions"`: A list of strings, where each string is a unique question.
-            3.  **DO NOT** add any text, explanations, or remarks outside the JSON structure.
-
-            **Example of your required output:**
-            ```json
-            {{
-            "generated_question_count": 8,
-            "questions": [
-                "First question...?",
-                "Second question...?",
-                "Third question...?",
-                "Fourth question...?",
-                "Fifth question...?",
-                "Sixth question...?",
-                "Seventh question...?",
-                "Eighth question...?"
-            ]
-            }}
-            """
-    return prompt
-
-def create_feedback_prompt(question_text, current_user_answer, conversation_history):
-    prompt = f"""
-        **Role:**
-        You are an expert, encouraging Socratic tutor. Your goal is to guide the student towards the correct answer without simply giving it away.
-
-        **Context:**
-        - **The original question is:** "{question_text}"
-        - **The student's current answer is:** "{current_user_answer}"
-        - **Previous answer of this user on this question (if any):**
-        ---
-        {conversation_history}
-        ---
-
-        **Task:**
-        Analyze the student's **current answer** in the context of the question and the **previous conversation history**.
-        1.  If the student has improved on a previous answer, acknowledge their progress.
-        2.  If the current answer is correct, praise them and confirm their understanding.
-        3.  If the current answer is still incorrect or incomplete, **do not give the direct answer**. Instead, ask a guiding question or provide a small hint that builds on your previous feedback to help them think about the topic in a new way.
-
-        **Format and Constraints:**
-        - The output MUST be a single, valid JSON object.
-        - The JSON object MUST contain one top-level key: "feedback_text".
-        - Keep the feedback concise, encouraging, and focused on guiding the student.
-
-        **Example of your required output:**
-        ```json
-        {{
-        "feedback_text": "That's a much better attempt! You're now correctly identifying that Aristotle saw procrastination as a problem of habit. To take it one step further, can you recall what he believed was the primary source of that bad habit?"
-        }}
-        """
-    return prompt
-
-
-
 #ROUTE 1 for creating a new test
 @test_learning_function_bp.route('/create_test', methods = ['GET','POST'])
 @login_required
@@ -105,7 +32,8 @@ def create_test():
     # choosing the material for the test
     # Query the database for all materials owned by the current user
     test_spec = TestSpecificationForm()
-    user_materials = LearningMaterial.query.filter_by(user_id=current_user.id).all()
+    user_materials = LearningMaterial.list_for_user(current_user.id)
+    previous_tests = Test.list_for_user(current_user.id)
     test_spec.material_id.choices = [(m.id, m.title) for m in user_materials]
     #displaying the form ,that needed to be filled in to create a test.
     #if the choosing method is from the old test automatically just fill out all the form.Other case the blank space will be displayed.
@@ -115,105 +43,309 @@ def create_test():
         'test_learning_function/creating_test.html',
         page_title='Creating Test',
         test_spec1=test_spec,
-        materials = user_materials 
+        materials = user_materials,
+        previous_tests = previous_tests
         )
     else:
-        if test_spec.validate_on_submit(): #bug here
-                selected_id =test_spec.material_id.data
-                material = LearningMaterial.query.get(selected_id)
-                input_file = None
-                prompt = ""
-                if material.gemini_file_uri : # to check if that is a file
-                    input_file = genai.get_file(name = material.gemini_file_uri)
-                    prompt = call_AI_for_test_generation(
-                        test_spec.scope.data,
-                        test_spec.understanding.data,
-                        test_spec.goal.data,
-                        material.analysis_roadmap
-                        )
-                    
-                    test_text= request_ai(prompt,input_file)
-                    flash(f"Success bro")
-                else:
-                    #link case where the exatracted text = material
-                    extracted_text = material.analysis_roadmap
-                    prompt = call_AI_for_test_generation(
-                        test_spec.scope.data,
-                        test_spec.understanding.data,
-                        test_spec.goal.data,
-                        None,
-                        extracted_text
-                        )
-                    test_text = request_ai(prompt)
-            #updating the database didnt if this right or wrong
-            #update fucking 4 table :))))
-                if test_text and 'questions' in test_text:
+        if test_spec.validate_on_submit():
+                material = LearningMaterial.query.get(test_spec.material_id.data)
+                prompt, input_file = _test_generation_request(material, test_spec)
+                try:
+                    test_text = request_ai(prompt.text, input_file, schema=TestQuestions)
+                except AIError as e:
+                    current_app.logger.warning(f'Test generation failed: {e!r}')
+                    test_text = None
+                    flash(e.message, "danger")
+                if test_text is not None:
                     try:
-                        new_test = Test(
-                            name = test_spec.name.data,
+                        # The test, all its questions and the first attempt, so the
+                        # user can start right away, in one transaction
+                        test_id, attempt_id = Test.create_with_questions(
                             user_id = current_user.id,
                             material_id = material.id,
+                            name = test_spec.name.data,
+                            questions = test_text.questions,
                             spec_scope = test_spec.scope.data,
                             spec_goal = test_spec.goal.data,
                             spec_understanding = test_spec.understanding.data,
+                            prompt_version = prompt.version,
                         )
-                        db.session.add(new_test)
-                        #2. Loop through the questions from the AI and create Question objects
-                        for i, q_text in enumerate(test_text['questions']):
-                            question = Question(
-                                question_text=q_text,
-                                order=i + 1,  # Set the question order (1, 2, 3...)
-                                test=new_test  # Link this question to the new test
-                            )
-                            db.session.add(question)
-                        # 3. Create the first 'TestAttempt' so the user can start the test right away
-                        new_attempt = TestAttempt(
-                            user_id=current_user.id, # Link the attempt to the user
-                            test=new_test      # Link the attempt to the new test
-                        )
-                        db.session.add(new_attempt)
-
-                        # 4. Commit all the new objects to the database in one transaction
                         db.session.commit()
 
-                        flash(f"Success! Your test '{new_test.name}' has been created.", 'success')
-                    
-                    # 5. Redirect the user to the test-taking page for their new attempt
-                    #Need to fix from here redirect to the test_storage function
-                        return redirect(url_for('test_learning_function_bp.take_test', test_attempt_id=new_attempt.id))
+                        flash(f"Success! Your test '{test_spec.name.data}' has been created.", 'success')
+                        return redirect(url_for('test_learning_function_bp.take_test', test_attempt_id=attempt_id))
 
                     except Exception as e:
                         db.session.rollback() # Undo changes if an error occurs
                         flash(f"A database error occurred: {e}", "danger")
-                        return render_template(
-                            'test_learning_function/creating_test.html',
-                            page_title='Creating Test',
-                            test_spec1=test_spec,
-                            materials = user_materials 
-                            )
+                return render_template(
+                    'test_learning_function/creating_test.html',
+                    page_title='Creating Test',
+                    test_spec1=test_spec,
+                    materials = user_materials,
+                    previous_tests = previous_tests
+                    )
         else:
-            flash (f"Fucking you the page still have bugs")
+            flash("Please check the test details.", "danger")
             return render_template(
                 'test_learning_function/creating_test.html',
                 page_title='Creating Test',
                 test_spec1=test_spec,
-                materials = user_materials 
+                materials = user_materials,
+                previous_tests = previous_tests
                 )
     #return redirect(url_for('test_learning_function_bp.take_test', test_attempt_id=new_attempt.id))
 
+
+def _test_generation_request(material, test_spec):
+    """The `RenderedPrompt` and the uploaded file (if any) for a test on `material`."""
+    roadmap = json.dumps(material.analysis_roadmap)
+    input_file, extracted_text = material_input(material)
+    if input_file is not None:  # the model reads the file itself
+        prompt = call_AI_for_test_generation(test_spec.scope.data, test_spec.goal.data,
+                                             test_spec.understanding.data, roadmap, user_id=material.user_id)
+        return prompt, input_file
+    # text case: the roadmap only points into the stored text
+    prompt = call_AI_for_test_generation(test_spec.scope.data, test_spec.goal.data, test_spec.understanding.data,
+                                         roadmap, extracted_text, user_id=material.user_id)
+    return prompt, None
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Same form as /create_test, but the questions are pushed to the page as
+# server-sent events while the model writes them:
+#   event: question  {"order": 1, "question_text": "..."}, one per question
+#   event: done      {"test_id", "attempt_id", "take_url"} once the test is saved
+#   event: error     {"message": "..."}
+@test_learning_function_bp.route('/create_test/stream', methods = ['POST'])
+@login_required
+def create_test_stream():
+    test_spec = TestSpecificationForm()
+    test_spec.material_id.choices = [(m.id, m.title) for m in LearningMaterial.list_for_user(current_user.id)]
+    if not test_spec.validate_on_submit():
+        return jsonify(success=False, errors=test_spec.errors), 400
+
+    user_id = current_user.id
+    material = LearningMaterial.query.get(test_spec.material_id.data)
+    prompt, input_file = _test_generation_request(material, test_spec)
+    spec = {
+        'name': test_spec.name.data,
+        'spec_scope': test_spec.scope.data,
+        'spec_goal': test_spec.goal.data,
+        'spec_understanding': test_spec.understanding.data,
+        'prompt_version': prompt.version,
+    }
+
+    def events():
+        stream = request_ai_stream(prompt.text, 'questions', input_file, schema=TestQuestions)
+        order = 0
+        try:
+            while True:
+                question = next(stream)
+                order += 1
+                yield _sse('question', {'order': order, 'question_text': question})
+        except StopIteration as stop:
+            answer = stop.value  # the whole answer, validated
+        except AIError as e:
+            current_app.logger.warning(f'Test generation failed: {e!r}')
+            yield _sse('error', {'message': e.message})
+            return
+
+        try:
+            test_id, attempt_id = Test.create_with_questions(user_id=user_id, material_id=material.id,
+                                                             questions=answer.questions, **spec)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            yield _sse('error', {'message': f'A database error occurred: {e}'})
+            return
+        yield _sse('done', {'test_id': test_id, 'attempt_id': attempt_id,
+                            'take_url': url_for('.take_test', test_attempt_id=attempt_id)})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
         
-@test_learning_function_bp.route('/take_test/<int:test_attempt_id>', methods = ['GET','POST'])
+# Test bank: many tests from one material, generated by a background job
+#
+# POST /test_bank                 {"material_id": 1, "tests": [{"name", "scope", "goal", "understanding"}]}
+# GET  /test_bank/<job_id>        progress as JSON
+# GET  /test_bank/<job_id>/events progress as server-sent events until the job ends
+
+def _check_csrf():
+    """For posts without a WTForm, the token comes in a header or a form field."""
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken') or request.form.get('csrf_token'))
+        except ValidationError as e:
+            abort(400, str(e))
+
+
+# Longest value of each spec field, the length of the column it is saved in
+_SPEC_MAX_LENGTHS = {'name': Test.name.type.length, 'scope': Test.spec_scope.type.length,
+                     'goal': Test.spec_goal.type.length, 'understanding': Test.spec_understanding.type.length}
+
+
+def _test_bank_specs(data):
+    specs = []
+    for item in data.get('tests') or []:
+        if not isinstance(item, dict):
+            return None
+        spec = {field: str(item.get(field) or '').strip() for field in _SPEC_MAX_LENGTHS}
+        if not (len(spec['name']) >= 3 and spec['scope'] and spec['goal']):
+            return None
+        if any(len(spec[field]) > max_length for field, max_length in _SPEC_MAX_LENGTHS.items()):
+            return None
+        specs.append(spec)
+    return specs
+
+
+def _get_test_bank_job_or_404(job_id):
+    job = Job.query.filter_by(id=job_id, name='generate_test_bank').first_or_404()
+    if job.kwargs.get('user_id') != current_user.id:
+        abort(404)
+    return job
+
+
+def _test_bank_state(status, result, last_error):
+    state = json.loads(result) if result else {}
+    state['status'] = status
+    if status == FAILED:
+        state['error'] = last_error
+    return state
+
+
+@test_learning_function_bp.route('/test_bank', methods=['POST'])
+@login_required
+def start_test_bank():
+    _check_csrf()
+    data = request.get_json(silent=True) or {}
+
+    material = LearningMaterial.query.filter_by(id=data.get('material_id'),
+                                                user_id=current_user.id).first()
+    if material is None:
+        return jsonify(success=False, message='Material not found.'), 404
+    if material.processing_status != 'COMPLETED':
+        return jsonify(success=False, message='The material is still being analyzed.'), 409
+
+    specs = _test_bank_specs(data)
+    if not specs:
+        return jsonify(success=False, message=('Every test needs a name (3 to 150 characters), a scope (up to 255) '
+                                               'and a goal (up to 100).')), 400
+    if len(specs) > current_app.config['TEST_BANK_MAX_TESTS']:
+        return jsonify(success=False, message=f'At most {current_app.config["TEST_BANK_MAX_TESTS"]} tests at once.'), 400
+
+    job = enqueue('generate_test_bank', user_id=current_user.id, material_id=material.id, specs=specs)
+    return jsonify(success=True, job_id=job.id,
+                   progress_url=url_for('.test_bank_status', job_id=job.id),
+                   events_url=url_for('.test_bank_events', job_id=job.id)), 202
+
+
+@test_learning_function_bp.route('/test_bank/<int:job_id>', methods=['GET'])
 @login_required
+def test_bank_status(job_id):
+    job = _get_test_bank_job_or_404(job_id)
+    return jsonify(_test_bank_state(job.status, job.result, job.last_error))
+
 
+@test_learning_function_bp.route('/test_bank/<int:job_id>/events', methods=['GET'])
+@login_required
+def test_bank_events(job_id):
+    _get_test_bank_job_or_404(job_id)
+    poll_interval = current_app.config['TEST_BANK_POLL_INTERVAL']
+
+    def events():
+        last = None
+        while True:
+            status, result, last_error = (db.session.query(Job.status, Job.result, Job.last_error)
+                                          .filter_by(id=job_id).one())
+            # End the read transaction so the next poll sees new progress
+            db.session.rollback()
+            finished = status in (SUCCEEDED, FAILED)
+            if (status, result) != last or finished:
+                last = (status, result)
+                state = _test_bank_state(status, result, last_error)
+                yield f"event: {'done' if finished else 'progress'}\ndata: {json.dumps(state)}\n\n"
+            if finished:
+                return
+            time.sleep(poll_interval)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# Taking a test: one question per page. Answers are saved right away and
+# feedback is generated in the background, the page fetches it when ready.
+#
+# GET  /take_test/<id>                     the current question and the answers to it
+# POST /take_test/<id>                     saves an answer to the current question
+# POST /take_test/<id>/move                previous / next question, or finish
+# GET  /take_test/<id>/feedback/<answer>   feedback on an answer, once there is some
+
+def _get_attempt_or_404(test_attempt_id):
+    return TestAttempt.query.filter_by(id=test_attempt_id, user_id=current_user.id).first_or_404()
+
+
+@test_learning_function_bp.route('/take_test/<int:test_attempt_id>', methods = ['GET','POST'])
+@login_required
 def take_test(test_attempt_id):
-    attempt
-            
-        
+    attempt = _get_attempt_or_404(test_attempt_id)
+    question = attempt.question_at(attempt.current_question_order)
+    if question is None:
+        flash("This test has no questions.", "danger")
+        return redirect(url_for('test_learning_function_bp.create_test'))
 
+    form = AnswerForm()
+    if attempt.status == AttemptStatus.IN_PROGRESS and form.validate_on_submit():
+        answer = UserAnswer(attempt_id=attempt.id, question_id=question.id,
+                            answer_text=form.answer_text.data)
+        db.session.add(answer)
+        queue_attempt_feedback(attempt.id, commit=False)
+        db.session.commit()
+        return redirect(url_for('test_learning_function_bp.take_test', test_attempt_id=attempt.id))
 
-            
+    return render_template(
+        'test_learning_function/test_taking.html',
+        page_title=attempt.test.name,
+        attempt=attempt,
+        question=question,
+        question_count=attempt.question_count(),
+        answers=attempt.answers_to(question.id),
+        completed=attempt.status == AttemptStatus.COMPLETED,
+        form=form
+        )
 
 
+@test_learning_function_bp.route('/take_test/<int:test_attempt_id>/move', methods = ['POST'])
+@login_required
+def move_in_test(test_attempt_id):
+    _check_csrf()
+    attempt = _get_attempt_or_404(test_attempt_id)
+    question_count = attempt.question_count()
+    direction = request.form.get('direction')
 
+    if direction == 'previous':
+        attempt.current_question_order = max(1, attempt.current_question_order - 1)
+    elif direction == 'next':
+        attempt.current_question_order = min(question_count, attempt.current_question_order + 1)
+    elif direction == 'finish' and attempt.status == AttemptStatus.IN_PROGRESS:
+        attempt.status = AttemptStatus.COMPLETED
+        attempt.completed_at = datetime.utcnow()
+        attempt.completed_time = int((attempt.completed_at - attempt.started_at).total_seconds())
+        flash("Test completed, well done!", "success")
+    db.session.commit()
+    return redirect(url_for('test_learning_function_bp.take_test', test_attempt_id=attempt.id))
 
 
+@test_learning_function_bp.route('/take_test/<int:test_attempt_id>/feedback/<int:answer_id>', methods = ['GET'])
+@login_required
+def answer_feedback(test_attempt_id, answer_id):
+    attempt = _get_attempt_or_404(test_attempt_id)
+    answer = UserAnswer.query.filter_by(id=answer_id, attempt_id=attempt.id).first_or_404()
+    if answer.feedback_text is None:
+        # In case the answer came in as the last job for the attempt was finishing
+        queue_attempt_feedback(attempt.id)
+    return jsonify(id=answer.id, ready=answer.feedback_text is not None, feedback_text=answer.feedback_text)
@@ -2,3 +2,4 @@
 
 from .models import Users, UsersAdmin
 from .constants import USER_ROLE, ADMIN, USER, USER_STATUS, NEW, ACTIVE
+from .passwords import PasswordHasher, PasswordHashBusy, get_password_hasher
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
+from flask import current_app
 from sqlalchemy import Column, types
 from sqlalchemy.ext.mutable import Mutable
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
+from ..caching import cache_get, cache_set, invalidate_user
 from ..extensions import db
 from ..utils import get_current_time, STRING_LEN
 from .constants import USER, USER_ROLE, ADMIN, INACTIVE, USER_STATUS
+from .passwords import get_password_hasher
 
 from flask_login import current_user
 from flask_admin.contrib import sqla
@@ -67,7 +69,7 @@ class Users(db.Model, UserMixin):
         return self._password
 
     def _set_password(self, password):
-        self._password = generate_password_hash(password)
+        self._password = get_password_hasher().hash(password)
 
     # Hide password encryption by exposing password field only.
     password = db.synonym('_password',
@@ -77,7 +79,16 @@ class Users(db.Model, UserMixin):
     def check_password(self, password):
         if self.password is None:
             return False
-        return check_password_hash(self.password, password)
+        return get_password_hasher().verify(self.password, password)
+
+    def upgrade_password_hash(self, password):
+        """Rehash a just verified password if the policy has changed."""
+        if get_password_hasher().needs_rehash(self.password):
+            self.password = password
+            db.session.commit()
+            invalidate_user(self.id)
+            return True
+        return False
 
     role_code = Column(db.SmallInteger, default=USER, nullable=False)
 
@@ -106,11 +117,35 @@ class Users(db.Model, UserMixin):
 
         if user:
             authenticated = user.check_password(password)
+            if authenticated:
+                user.upgrade_password_hash(password)
         else:
             authenticated = False
 
         return user, authenticated
 
+    @classmethod
+    def load_cached(cls, user_id):
+        """
+        User for the login manager. A `CachedUser` snapshot is kept in the
+        cache for USER_CACHE_TIMEOUT seconds, call `caching.invalidate_user`
+        after changing a user.
+        """
+        timeout = current_app.config['USER_CACHE_TIMEOUT']
+        user_id = int(user_id)
+        if not timeout:
+            return db.session.get(cls, user_id)
+
+        snapshot = cache_get('user', user_id)
+        if isinstance(snapshot, dict):
+            return CachedUser(snapshot)
+
+        user = db.session.get(cls, user_id)
+        if user is not None:
+            cache_set('user', user_id, {field: getattr(user, field) for field in CachedUser.FIELDS},
+                      timeout=timeout)
+        return user
+
     @classmethod
     def get_by_id(cls, user_id):
         return cls.query.filter_by(id=user_id).first_or_404()
@@ -123,6 +158,51 @@ class Users(db.Model, UserMixin):
         return str(_str)
 
 
+class CachedUser(UserMixin):
+    """
+    The logged in user as cached by `Users.load_cached`: the columns most
+    requests need, without the password hash or activation key. Any other
+    attribute loads the `Users` row.
+    """
+
+    FIELDS = ('id', 'name', 'role_code', 'status_code')
+
+    def __init__(self, snapshot):
+        for field in self.FIELDS:
+            setattr(self, field, snapshot[field])
+        self._user = None
+
+    @property
+    def role(self):
+        return USER_ROLE[self.role_code]
+
+    @property
+    def status(self):
+        return USER_STATUS[self.status_code]
+
+    def is_admin(self):
+        return self.role_code == ADMIN
+
+    def is_authenticated(self):
+        return True
+
+    @property
+    def user(self):
+        """The full row, loaded on first use."""
+        if self._user is None:
+            self._user = db.session.get(Users, self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for what the snapshot doesn't have
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f'<CachedUser {self.id}>'
+
+
 # Customized User model admin
 class UsersAdmin(sqla.ModelView):
     column_list = ('id', 'name', 'email', 'role_code', 'status_code',
@@ -162,6 +242,12 @@ class UsersAdmin(sqla.ModelView):
     def __init__(self, session):
         super(UsersAdmin, self).__init__(Users, session)
 
+    def after_model_change(self, form, model, is_created):
+        invalidate_user(model.id)
+
+    def after_model_delete(self, model):
+        invalidate_user(model.id)
+
     def is_accessible(self):
         if current_user.role == 'admin':
             return current_user.is_authenticated()
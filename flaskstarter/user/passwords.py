@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    Password hashing policy.
+
+    PASSWORD_HASH_METHOD is any Werkzeug method string, such as
+    'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'. Stored hashes carry their
+    own parameters, so hashes made under an older policy still verify and
+    are replaced on the next successful login.
+
+    Hashing is CPU bound (and scrypt memory bound). It runs on a pool of
+    PASSWORD_HASH_WORKERS threads, so a burst of logins can't occupy more
+    cores than that; the other requests keep being served.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+DEFAULT_METHOD = 'scrypt:16384:8:1'
+
+
+class PasswordHashBusy(Exception):
+    """The hashing pool could not take the request within its timeout."""
+
+
+def _method_of(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+class PasswordHasher(object):
+    """
+    Hashes and verifies passwords on a bounded thread pool.
+
+    :param method: Werkzeug method string, defaults filled in by Werkzeug
+    :param salt_length: salt length of new hashes
+    :param workers: size of the thread pool, 0 to hash in the caller's thread
+    :param timeout: seconds a call may take including the wait for the pool,
+                    None to wait forever
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=16, workers=4, timeout=None):
+        self.salt_length = salt_length
+        self.timeout = timeout
+        # 'scrypt' -> 'scrypt:32768:8:1', what stored hashes are compared to
+        self.method = _method_of(generate_password_hash('', method=method, salt_length=1))
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='password-hash')
+        future = self._executor.submit(func, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHashBusy('Too many password checks in progress')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if `pwhash` was made with another method or other parameters."""
+        return _method_of(pwhash) != self.method
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+_default_hasher = None
+
+
+def get_password_hasher():
+    """Hasher configured by the PASSWORD_HASH_* settings."""
+    global _default_hasher
+
+    if has_app_context():
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher is None:
+            config = current_app.config
+            hasher = PasswordHasher(config['PASSWORD_HASH_METHOD'],
+                                    salt_length=config['PASSWORD_SALT_LENGTH'],
+                                    workers=config['PASSWORD_HASH_WORKERS'],
+                                    timeout=config['PASSWORD_HASH_TIMEOUT'])
+            current_app.extensions['password_hasher'] = hasher
+        return hasher
+
+    if _default_hasher is None:
+        _default_hasher = PasswordHasher(workers=0)
+    return _default_hasher
@@ -6,14 +6,19 @@
 import os
 
 import datetime
-import json
-import google.generativeai as genai
-import requests
-from bs4 import BeautifulSoup
-from youtube_transcript_api import YouTubeTranscriptApi
+
+from .ai.cache import get_response_cache, make_key
+from .ai.errors import AIInvalidResponse, classify
+from .ai.repair import loads_lenient
+from .ai.resilience import call_with_retries
+from .ai.schemas import api_schema, validate_element, validate_response
+from .ai.streaming import JSONArrayStream
+from .extensions import ai_client
 
 # Instance folder path, to keep stuff aware from flask app.
-INSTANCE_FOLDER_PATH = 'C:/flaskstarter-instance-data'
+# FLASKSTARTER_INSTANCE_PATH overrides the default in the home directory.
+INSTANCE_FOLDER_PATH = os.path.abspath(os.path.expanduser(
+    os.environ.get('FLASKSTARTER_INSTANCE_PATH') or '~/flaskstarter-instance-data'))
 
 
 # Form validation
@@ -64,66 +69,111 @@ def pretty_date(dt, default=None):
 
     return default
 
-def request_ai(prompt_text, file_object = None ):
+def _schema_config(schema):
+    return {'response_schema': api_schema(schema)} if schema is not None else {}
+
+
+def request_ai(prompt_text, file_object = None, use_cache=True, schema=None):
+    """
+    The model's JSON answer to `prompt_text`. With a `schema` (see
+    ai/schemas.py) the model is held to it and the answer is returned as
+    an instance of it. Transient failures, answers not fitting the schema
+    included, are retried within AI_CALL_DEADLINE, then an `AIError`
+    subclass is raised (see ai/errors.py).
+    """
+    schema_config = _schema_config(schema)
+    generation_config = dict(ai_client.generation_config, **schema_config)
+
+    # Identical prompts (e.g. regenerating a test) are answered from the cache
+    cache = get_response_cache() if use_cache else None
+    cache_key = make_key(ai_client.model_name, prompt_text, generation_config, file_object)
+    if cache is not None:
+        cached = cache.get_response(cache_key)
+        if cached is not None:
+            return validate_response(schema, cached) if schema is not None else cached
+
+    content_to_send = [prompt_text]
+    if file_object:
+        content_to_send.append(file_object)
+
+    def attempt(timeout):
+        result = loads_lenient(ai_client.generate(content_to_send, schema_config, timeout=timeout))
+        return result, validate_response(schema, result) if schema is not None else result
+
+    result, answer = call_with_retries(attempt)
+    if cache is not None:
+        cache.set_response(cache_key, result)
+    return answer
+
+
+def request_ai_stream(prompt_text, key, file_object=None, use_cache=True, schema=None):
+    """
+    Streaming `request_ai`: yields the elements of the answer's `key` list
+    as the model writes them. The whole answer is the generator's return
+    value (`answer = yield from request_ai_stream(...)`), validated against
+    `schema` once complete. With a `schema` every element is validated
+    before it is yielded, and one that doesn't fit is left out. Failures
+    before the first element are retried like in `request_ai`, later ones
+    raise an `AIError` right away.
+    """
+    schema_config = _schema_config(schema)
+    generation_config = dict(ai_client.generation_config, **schema_config)
+
+    cache = get_response_cache() if use_cache else None
+    cache_key = make_key(ai_client.model_name, prompt_text, generation_config, file_object)
+    if cache is not None:
+        cached = cache.get_response(cache_key)
+        if cached is not None:
+            if schema is None:
+                yield from cached.get(key) or []
+                return cached
+            answer = validate_response(schema, cached)
+            yield from getattr(answer, key)
+            return answer
+
+    def checked(elements):
+        if schema is None:
+            return elements
+        valid = []
+        for element in elements:
+            try:
+                valid.append(validate_element(schema, key, element))
+            except AIInvalidResponse:
+                pass  # the whole answer is judged once complete
+        return valid
+
+    content_to_send = [prompt_text]
+    if file_object:
+        content_to_send.append(file_object)
+
+    def attempt(timeout):
+        # Reads up to the first complete element
+        chunks = ai_client.generate_stream(content_to_send, schema_config, timeout=timeout)
+        stream = JSONArrayStream(key)
+        try:
+            for chunk in chunks:
+                elements = checked(stream.feed(chunk))
+                if elements:
+                    return chunks, stream, elements
+        except BaseException:
+            chunks.close()
+            raise
+        return chunks, stream, []
+
+    chunks, stream, elements = call_with_retries(attempt)
     try:
-        genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        content_to_send = [prompt_text]
-        if file_object:
-            content_to_send.append(file_object)
-        generation_config = genai.types.GenerationConfig(
-            response_mime_type="application/json"
-        )
-        response = model.generate_content(content_to_send, generation_config=generation_config)
-        return json.loads(response.text)
+        yield from elements
+        for chunk in chunks:
+            yield from checked(stream.feed(chunk))
+        result = stream.result()
+        answer = validate_response(schema, result) if schema is not None else result
+    except GeneratorExit:
+        raise
     except Exception as e:
-        print(f"An error occurred with the Gemini API: {e}")
-        return None
-
+        raise classify(e)
+    finally:
+        chunks.close()
 
-def get_content(url):
-    # --- YouTube Logic ---
-    if "youtube.com/watch" in url or "youtu.be" in url:
-        try:
-            video_id = None
-            if "v=" in url:
-                video_id = url.split('v=')[1].split('&')[0]
-            elif "youtu.be" in url:
-                video_id = url.split('/')[-1]
-
-            if not video_id:
-                return False, "Could not find a valid YouTube video ID in the URL."
-
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['en', 'de'])
-            full_transcript = " ".join([item['text'] for item in transcript_list])
-            return True, full_transcript
-        except Exception as e:
-            return False, f"Could not retrieve transcript: {e}"
-
-    # --- Classic Article Logic ---
-    else:
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            selectors = ['article', 'main', 'div[role="main"]', 'div#main', 'div#content', 'div.post-content', 'div.article-body']
-            content_area = None
-            for selector in selectors:
-                content_area = soup.select_one(selector)
-                if content_area:
-                    break
-            
-            if content_area:
-                article_text = content_area.get_text(separator='\n', strip=True)
-            else:
-                article_text = soup.body.get_text(separator='\n', strip=True)
-                
-            return True, article_text
-        except requests.RequestException as e:
-            return False, f"Could not retrieve article: {e}"
-        
\ No newline at end of file
+    if cache is not None:
+        cache.set_response(cache_key, result)
+    return answer
@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
 
+import json
+
+import click
+from dotenv import load_dotenv
+# Before the app is imported, config.py reads DATABASE_URL and friends
+load_dotenv()
+
 from sqlalchemy.orm.mapper import configure_mappers
 
 from flaskstarter import create_app
 from flaskstarter.extensions import db
 from flaskstarter.user import Users, ADMIN, USER, ACTIVE
 from flaskstarter.tasks import MyTaskModel
-from dotenv import load_dotenv
-load_dotenv()
+from flaskstarter.jobs import run_workers
+from flaskstarter.emails import SMTPSink, flush_mail_outbox
+from flaskstarter.ai import get_response_cache, get_governor
+from flaskstarter.compression import get_compressor, train_dictionary, save_dictionary
+from flaskstarter.learning_marterial_uploader import LearningMaterial
+from flaskstarter.test_learning_function.models import UserAnswer
 
 application = create_app()
 
@@ -44,3 +55,95 @@ def initdb():
     db.session.commit()
 
     print("Database initialized with 2 users (admin, demo)")
+
+
+@application.cli.command("run-workers")
+@click.option('--concurrency', '-c', type=int, default=None,
+              help='Number of worker threads (defaults to JOB_WORKERS).')
+def run_workers_command(concurrency):
+    """Run background job workers until interrupted."""
+
+    concurrency = concurrency or application.config['JOB_WORKERS']
+    print(f"Starting {concurrency} job workers, press CTRL+C to stop")
+    run_workers(application, concurrency=concurrency)
+
+
+@application.cli.command("mail-sink")
+@click.option('--host', default='localhost')
+@click.option('--port', type=int, default=1025)
+def mail_sink(host, port):
+    """Run a local SMTP server that prints mail instead of sending it.
+
+    Use it with MAIL_SERVER=localhost, MAIL_PORT=1025, MAIL_USE_TLS=False.
+    """
+
+    def show(message):
+        print(f"--- {message.mail_from} -> {', '.join(message.recipients)}")
+        print(message.data.decode('utf-8', 'replace'))
+
+    sink = SMTPSink((host, port), on_message=show)
+    print(f"SMTP sink listening on {host}:{port}, press CTRL+C to stop")
+    try:
+        sink.serve_forever()
+    except KeyboardInterrupt:
+        sink.server_close()
+
+
+@application.cli.command("flush-mail")
+def flush_mail():
+    """Send one batch of queued mail now, without the job workers."""
+
+    result = flush_mail_outbox()
+    print(f"Sent {result['sent']}, failed {result['failed']}")
+
+
+@application.cli.command("ai-cache-stats")
+def ai_cache_stats():
+    """Show hit/miss counters of the AI response cache."""
+
+    cache = get_response_cache()
+    if cache is None:
+        print("AI response cache is disabled")
+        return
+
+    for name, value in cache.stats().items():
+        print(f"{name}: {value}")
+
+
+@application.cli.command("ai-governor-stats")
+def ai_governor_stats():
+    """Show queue depth, calls in flight and wait times of model calls."""
+
+    governor = get_governor()
+    if governor is None:
+        print("AI governor is disabled")
+        return
+
+    for name, value in governor.stats().items():
+        print(f"{name}: {value}")
+
+
+@application.cli.command("train-compression-dictionary")
+@click.option('--size', type=int, default=16 * 1024, help='Dictionary size in bytes.')
+def train_compression_dictionary(size):
+    """Train a compression dictionary on stored roadmaps and feedback."""
+
+    codec = get_compressor().codec
+    if codec == 'none':
+        print("Compression is disabled")
+        return
+
+    roadmaps = db.session.query(LearningMaterial.analysis_roadmap).filter(
+        LearningMaterial.analysis_roadmap.isnot(None))
+    feedback = db.session.query(UserAnswer.feedback_text).filter(UserAnswer.feedback_text.isnot(None))
+    samples = [json.dumps(roadmap, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+               for roadmap, in roadmaps.limit(5000)]
+    samples += [text.encode('utf-8') for text, in feedback.limit(5000)]
+    if len(samples) < 20:
+        print(f"Only {len(samples)} samples stored, not enough to train a useful dictionary")
+        return
+
+    dictionary = train_dictionary(samples, size=size, codec=codec)
+    path = save_dictionary(application.config['COMPRESSION_DICTIONARY_DIR'], dictionary)
+    print(f"Trained a {len(dictionary)} byte {codec} dictionary on {len(samples)} samples: {path}")
+    print("Restart the app and workers to compress new values with it")
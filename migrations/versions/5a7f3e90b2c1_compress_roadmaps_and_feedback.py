@@ -0,0 +1,77 @@
+"""compress analysis_roadmap and feedback_text
+
+Revision ID: 5a7f3e90b2c1
+Revises: e19b5c7a3d20
+Create Date: 2026-10-18 15:48:27.390512
+
+Both columns become binary. Existing values are rewritten compressed,
+roadmaps as compact JSON.
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+from flaskstarter.compression import get_compressor
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7f3e90b2c1'
+down_revision = 'e19b5c7a3d20'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [
+    ('learning_materials', 'analysis_roadmap', True),
+    ('user_answer', 'feedback_text', False),
+]
+
+
+def _as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    return get_compressor().decompress(value).decode('utf-8')
+
+
+def _compact(value):
+    try:
+        return json.dumps(json.loads(value), separators=(',', ':'), ensure_ascii=False)
+    except ValueError:
+        return value
+
+
+def _rewrite(table_name, column_name, convert):
+    conn = op.get_bind()
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column(column_name))
+    rows = conn.execute(sa.select(table.c.id, table.c[column_name])
+                        .where(table.c[column_name].isnot(None))).fetchall()
+    for row_id, value in rows:
+        conn.execute(table.update().where(table.c.id == row_id)
+                     .values({column_name: convert(value)}))
+
+
+def upgrade():
+    compressor = get_compressor()
+    for table_name, column_name, is_json in COLUMNS:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column(column_name, existing_type=sa.Text(), type_=sa.LargeBinary(),
+                                  existing_nullable=True,
+                                  postgresql_using=f"convert_to({column_name}, 'UTF8')")
+
+        def convert(value, is_json=is_json):
+            text = _as_text(value)
+            if is_json:
+                text = _compact(text)
+            return compressor.compress(text.encode('utf-8'))
+
+        _rewrite(table_name, column_name, convert)
+
+
+def downgrade():
+    for table_name, column_name, is_json in COLUMNS:
+        _rewrite(table_name, column_name, lambda value: _as_text(value).encode('utf-8'))
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.alter_column(column_name, existing_type=sa.LargeBinary(), type_=sa.Text(),
+                                  existing_nullable=True,
+                                  postgresql_using=f"convert_from({column_name}, 'UTF8')")
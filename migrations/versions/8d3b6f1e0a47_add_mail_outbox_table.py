@@ -0,0 +1,45 @@
+"""add mail_outbox table for queued outbound mail
+
+Revision ID: 8d3b6f1e0a47
+Revises: 5a7f3e90b2c1
+Create Date: 2026-10-18 16:34:09.518270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3b6f1e0a47'
+down_revision = '5a7f3e90b2c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('recipients', sa.Text(), nullable=False),
+    sa.Column('sender', sa.String(length=255), nullable=True),
+    sa.Column('html', sa.LargeBinary(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('send_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_time', sa.DateTime(), nullable=True),
+    sa.Column('sent_time', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('mail_outbox', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_mail_outbox_status'), ['status'], unique=False)
+        batch_op.create_index(batch_op.f('ix_mail_outbox_send_after'), ['send_after'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mail_outbox', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_mail_outbox_send_after'))
+        batch_op.drop_index(batch_op.f('ix_mail_outbox_status'))
+
+    op.drop_table('mail_outbox')
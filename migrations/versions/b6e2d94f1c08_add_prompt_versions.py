@@ -0,0 +1,32 @@
+"""add prompt_version to test and roadmap_prompt_version to learning_materials
+
+Revision ID: b6e2d94f1c08
+Revises: 8d3b6f1e0a47
+Create Date: 2026-10-18 17:42:09.518236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d94f1c08'
+down_revision = '8d3b6f1e0a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('prompt_version', sa.String(length=64), nullable=True))
+
+    with op.batch_alter_table('learning_materials', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('roadmap_prompt_version', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('learning_materials', schema=None) as batch_op:
+        batch_op.drop_column('roadmap_prompt_version')
+
+    with op.batch_alter_table('test', schema=None) as batch_op:
+        batch_op.drop_column('prompt_version')
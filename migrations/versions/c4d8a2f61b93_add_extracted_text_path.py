@@ -0,0 +1,26 @@
+"""add extracted_text_path to learning_materials
+
+Revision ID: c4d8a2f61b93
+Revises: 7b2e9d41c5a0
+Create Date: 2026-10-18 13:05:41.207733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8a2f61b93'
+down_revision = '7b2e9d41c5a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('learning_materials', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('extracted_text_path', sa.String(length=512), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('learning_materials', schema=None) as batch_op:
+        batch_op.drop_column('extracted_text_path')
@@ -0,0 +1,151 @@
+"""add material_sections table, move roadmap content out of row
+
+Revision ID: e19b5c7a3d20
+Revises: c4d8a2f61b93
+Create Date: 2026-10-18 14:22:09.614120
+
+Existing roadmaps are copied into material_sections. Link roadmaps made
+before offsets were introduced carry the full text of every section; that
+text is written to the material's text file and replaced by start/end
+offsets. The downgrade drops the sections but does not put the text back
+into the roadmaps.
+"""
+import json
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'e19b5c7a3d20'
+down_revision = 'c4d8a2f61b93'
+branch_labels = None
+depends_on = None
+
+
+materials = sa.table(
+    'learning_materials',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('analysis_roadmap', sa.Text),
+    sa.column('extracted_text_path', sa.String),
+)
+
+sections_table = sa.table(
+    'material_sections',
+    sa.column('id', sa.Integer),
+    sa.column('material_id', sa.Integer),
+    sa.column('parent_id', sa.Integer),
+    sa.column('position', sa.Integer),
+    sa.column('level', sa.Integer),
+    sa.column('title', sa.String),
+    sa.column('summary', sa.Text),
+    sa.column('start_offset', sa.Integer),
+    sa.column('end_offset', sa.Integer),
+    sa.column('page_start', sa.Integer),
+)
+
+
+def _walk(structure):
+    for chapter in structure:
+        yield chapter
+        for subsection in chapter.get('subsections') or []:
+            yield subsection
+
+
+def _move_content_out(material_id, user_id, roadmap):
+    """Writes the sections' content to a text file, returns its relative path."""
+    parts = []
+    offset = 0
+    for entry in _walk(roadmap.get('structure') or []):
+        content = entry.pop('content', None) or ''
+        block = f"{entry.get('title') or ''}\n{content}".strip() + '\n\n'
+        entry['start'] = offset
+        parts.append(block)
+        offset += len(block)
+        entry['end'] = offset
+    # A chapter runs until the end of its last subsection
+    for chapter in roadmap.get('structure') or []:
+        if chapter.get('subsections'):
+            chapter['end'] = chapter['subsections'][-1]['end']
+
+    relative_path = os.path.join(str(user_id), f'link-{material_id}.txt')
+    path = os.path.join(current_app.config.get('USER_UPLOADS_FOLDER', 'instance/user_uploads'), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(''.join(parts))
+    return relative_path
+
+
+def upgrade():
+    op.create_table('material_sections',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('material_id', sa.Integer(), nullable=False),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('level', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=512), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=True),
+    sa.Column('start_offset', sa.Integer(), nullable=True),
+    sa.Column('end_offset', sa.Integer(), nullable=True),
+    sa.Column('page_start', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['material_id'], ['learning_materials.id'], ),
+    sa.ForeignKeyConstraint(['parent_id'], ['material_sections.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('material_sections', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_material_sections_material_id'), ['material_id'], unique=False)
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(materials.c.id, materials.c.user_id, materials.c.analysis_roadmap,
+                                  materials.c.extracted_text_path)
+                        .where(materials.c.analysis_roadmap.isnot(None))).fetchall()
+    next_id = 1
+    for material_id, user_id, raw_roadmap, text_path in rows:
+        try:
+            roadmap = json.loads(raw_roadmap)
+        except ValueError:
+            continue
+        if not isinstance(roadmap, dict):
+            continue
+
+        if any('content' in entry for entry in _walk(roadmap.get('structure') or [])):
+            if text_path is None:
+                text_path = _move_content_out(material_id, user_id, roadmap)
+            else:
+                for entry in _walk(roadmap.get('structure') or []):
+                    entry.pop('content', None)
+            conn.execute(materials.update().where(materials.c.id == material_id)
+                         .values(analysis_roadmap=json.dumps(roadmap, indent=2),
+                                 extracted_text_path=text_path))
+
+        position = 0
+        for chapter in roadmap.get('structure') or []:
+            chapter_id = None
+            for entry in [chapter] + list(chapter.get('subsections') or []):
+                page_start = entry.get('page_start')
+                conn.execute(sections_table.insert().values(
+                    id=next_id,
+                    material_id=material_id,
+                    parent_id=chapter_id,
+                    position=position,
+                    level=entry.get('level') or (2 if chapter_id else 1),
+                    title=str(entry.get('title') or '')[:512],
+                    summary=entry.get('summary'),
+                    start_offset=entry.get('start'),
+                    end_offset=entry.get('end'),
+                    page_start=page_start if isinstance(page_start, int) else None,
+                ))
+                if chapter_id is None:
+                    chapter_id = next_id
+                next_id += 1
+                position += 1
+
+
+def downgrade():
+    with op.batch_alter_table('material_sections', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_material_sections_material_id'))
+
+    op.drop_table('material_sections')
@@ -0,0 +1,26 @@
+"""add feedback_job_id to user_answer
+
+Revision ID: f3a71c9e25d4
+Revises: b6e2d94f1c08
+Create Date: 2026-10-18 21:05:37.104821
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a71c9e25d4'
+down_revision = 'b6e2d94f1c08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_answer', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('feedback_job_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user_answer', schema=None) as batch_op:
+        batch_op.drop_column('feedback_job_id')
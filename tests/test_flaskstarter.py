@@ -21,3 +21,773 @@ def client():
 def test_home_page(client):
     response = client.get("/")
     assert b"Let\'s start with Python & Flask" in response.data
+
+
+def _test_config(tmp_path, **overrides):
+    class TestConfig(object):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'db.sqlite')
+        CACHE_TYPE = 'NullCache'
+        USER_UPLOADS_FOLDER = str(tmp_path / 'uploads')
+        AI_BACKEND = 'fake'
+        AI_CACHE_ENABLED = False
+        AI_GOVERNOR_PATH = str(tmp_path / 'ai_governor.sqlite')
+        AI_RETRY_BACKOFF = 0.01
+        CONTENT_CACHE_ENABLED = False
+        JOB_RETRY_BACKOFF = 60
+
+    for name, value in overrides.items():
+        setattr(TestConfig, name, value)
+    return TestConfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(_test_config(tmp_path))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def test_job_claim_retry_and_lease(app):
+    from datetime import timedelta
+    from flaskstarter.jobs import QUEUED, RUNNING, SUCCEEDED, claim_next, enqueue, job_handler, run_job
+    from flaskstarter.utils import get_current_time
+
+    calls = []
+
+    @job_handler('test_flaky', max_attempts=3)
+    def flaky(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError('first run fails')
+        return {'value': value}
+
+    job = enqueue('test_flaky', value=7)
+    assert claim_next('w1').id == job.id
+    assert claim_next('w2') is None  # leased to w1
+
+    assert not run_job(job)
+    assert job.status == QUEUED and job.attempts == 1
+    assert job.run_at > get_current_time()  # backing off
+    assert claim_next('w1') is None
+
+    job.run_at = get_current_time()
+    db.session.commit()
+    job = claim_next('w1')
+    assert run_job(job)
+    assert job.status == SUCCEEDED and job.result == '{"value": 7}'
+    assert calls == [7, 7]
+
+    # A lease that ran out (the worker died) lets another worker take the job
+    stale = enqueue('test_flaky', value=8)
+    stale.status = RUNNING
+    stale.locked_until = get_current_time() - timedelta(seconds=1)
+    db.session.commit()
+    assert claim_next('w2').id == stale.id
+
+
+def test_job_timeout_waits_for_the_handler(app, monkeypatch):
+    import threading
+    import time
+    from flaskstarter.jobs import FAILED, QUEUED, check_cancelled, claim_next, enqueue, job_handler, queue, run_job
+
+    monkeypatch.setattr(queue, 'CANCEL_GRACE_SECONDS', 1)
+    running = threading.Event()
+
+    @job_handler('test_polite', timeout=1, max_attempts=2)
+    def polite():
+        running.set()
+        try:
+            while True:
+                check_cancelled()
+                time.sleep(0.02)
+        finally:
+            running.clear()
+
+    @job_handler('test_stubborn', timeout=1, max_attempts=2)
+    def stubborn():
+        time.sleep(3)
+
+    job = enqueue('test_polite')
+    run_job(claim_next('w1'))
+    assert job.status == QUEUED and 'JobTimeout' in job.last_error
+    assert not running.is_set()  # stopped before the job was released
+
+    job = enqueue('test_stubborn')
+    run_job(claim_next('w1'))
+    assert job.status == FAILED and 'JobAbandoned' in job.last_error  # may still run, not retried
+
+
+def test_governor_slot_exhaustion(app, tmp_path):
+    from flaskstarter.ai import AIBusy, Governor, user_workers
+
+    governor = Governor(str(tmp_path / 'governor.sqlite'), rate=0, max_concurrent=3, per_user=2,
+                        queue_timeout=0.2)
+    first, second = governor.acquire('u1'), governor.acquire('u1')
+    with pytest.raises(AIBusy):
+        governor.acquire('u1')  # per user limit
+    other = governor.acquire('u2')
+    with pytest.raises(AIBusy):
+        governor.acquire('u3')  # host limit
+    assert AIBusy.transient
+
+    governor.release(first)
+    governor.release(governor.acquire('u1'))
+    for slot_id in (second, other):
+        governor.release(slot_id)
+    assert governor.stats()['in_flight'] == 0
+
+    assert user_workers(4) == app.config['AI_MAX_CONCURRENCY_PER_USER']
+
+
+def test_retries_and_circuit_breaker(app):
+    from flaskstarter.ai import AICircuitOpen, AIRequestError, AIUnavailable, CircuitBreaker, call_with_retries
+
+    outcomes = [ConnectionError('down'), ConnectionError('down'), 'ok']
+
+    def flaky(timeout):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert call_with_retries(flaky) == 'ok'
+
+    class BadRequest(Exception):
+        code = 400
+
+    attempts = []
+
+    def rejected(timeout):
+        attempts.append(timeout)
+        raise BadRequest('bad')
+
+    with pytest.raises(AIRequestError):
+        call_with_retries(rejected)
+    assert len(attempts) == 1  # not worth retrying
+
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record(AIUnavailable('down'))
+    breaker.before_call()
+    breaker.record(AIUnavailable('down'))
+    with pytest.raises(AICircuitOpen):
+        breaker.before_call()
+
+
+def test_repair_json():
+    from flaskstarter.ai import loads_lenient, repair_json
+
+    assert loads_lenient('```json\n{"questions": ["a, ]", "b",],}\n```') == {'questions': ['a, ]', 'b']}
+    assert loads_lenient('Here it is: [1, 2] Hope this helps {') == [1, 2]
+
+    # Cut off at the output limit: failing lets the call be retried
+    for truncated in ('{"questions": ["a", "b', '{"questions": ["a", "b"', '{"questions": ["a"],'):
+        with pytest.raises(ValueError):
+            repair_json(truncated)
+        with pytest.raises(ValueError):
+            loads_lenient(truncated)
+
+
+def test_json_array_stream_split_across_chunks():
+    from flaskstarter.ai import JSONArrayStream
+
+    answer = ('```json\n{"count": 4, "questions": ["Why \\"this\\"?", "a ] b, c", '
+              '{"nested": [1, {"x": "}"}]}, 42], "after": "x"}\n```')
+    for size in (1, 3, 7, len(answer)):
+        stream = JSONArrayStream('questions')
+        elements = []
+        for start in range(0, len(answer), size):
+            elements += stream.feed(answer[start:start + size])
+        assert elements == ['Why "this"?', 'a ] b, c', {'nested': [1, {'x': '}'}]}, 42]
+        assert stream.result()['after'] == 'x'
+
+    stream = JSONArrayStream('questions')
+    assert stream.feed('{"questions": ["ok", tru, "fine"]}') == ['ok', 'fine']
+    assert stream.skipped == 1
+    with pytest.raises(ValueError):
+        stream.result()
+
+
+def test_prompt_budget_cut(app):
+    from flaskstarter.ai import register_prompt, render_prompt, select_version
+    from flaskstarter.content.chunking import estimate_tokens
+
+    register_prompt('test_budget', 1, '''
+        Question: {question}
+        Material:
+        {material}
+        History:
+        {history}
+        ''', truncate={'material': 'head', 'history': 'tail'}, max_tokens=300)
+
+    short = render_prompt('test_budget', question='Q?', material='Short text.', history='')
+    assert short.truncated == () and short.version == 'test_budget@1'
+    assert short.tokens == estimate_tokens(short.text)
+
+    material = '\n\n'.join(f'Paragraph {number}. ' + 'word ' * 40 for number in range(50))
+    history = '\n'.join(f'Answer {number}: ' + 'x' * 60 for number in range(50))
+    rendered = render_prompt('test_budget', question='Q?', material=material, history=history)
+    assert rendered.truncated == ('history', 'material')
+    assert rendered.tokens <= 300
+    assert 'Paragraph 0.' in rendered.text and 'Paragraph 49.' not in rendered.text
+    assert 'Answer 49:' in rendered.text and 'Answer 0:' not in rendered.text
+
+    blank = render_prompt('test_budget', question='Q?', material=' ' * 2000, history='')
+    assert blank.truncated == ('material',) and blank.tokens <= 300
+
+    register_prompt('test_budget', 2, '{question} {material} {history}')
+    assert select_version('test_budget') == 2
+    app.config['PROMPT_VERSIONS'] = {'test_budget': {1: 1, 2: 1}}
+    versions = [select_version('test_budget', user_id) for user_id in range(100)]
+    assert set(versions) == {1, 2}
+    assert versions == [select_version('test_budget', user_id) for user_id in range(100)]
+
+
+def test_compressed_columns(app):
+    from sqlalchemy import text
+    from flaskstarter.learning_marterial_uploader.models import LearningMaterial
+
+    user = Users(name='reader', email='reader@example.com', password='password1', status_code=ACTIVE)
+    db.session.add(user)
+    db.session.commit()
+    roadmap = {'document_title': 'Book', 'structure': [{'level': 1, 'title': 'Chapter ' * 50, 'summary': 'ü'}]}
+    material = LearningMaterial(user_id=user.id, title='Book', source_type='FILE', analysis_roadmap=roadmap)
+    db.session.add(material)
+    db.session.commit()
+
+    stored = db.session.execute(text('SELECT analysis_roadmap FROM learning_materials')).scalar()
+    assert isinstance(stored, bytes) and len(stored) < len(str(roadmap))
+    db.session.expire_all()
+    assert db.session.get(LearningMaterial, material.id).analysis_roadmap == roadmap
+
+
+def test_sqlite_cache_totals_and_eviction(tmp_path):
+    from flaskstarter.sqlite_cache import SQLiteCache
+
+    cache = SQLiteCache(str(tmp_path / 'cache.sqlite'), max_entries=10, max_bytes=1000)
+    for number in range(10):
+        cache.set(f'key{number}', b'x' * 50)
+    cache.set('key0', b'y' * 80)  # replaced, not counted twice
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (10, 530, 0)
+
+    cache.set('key10', b'z' * 50)
+    stats = cache.stats()
+    assert stats['entries'] <= 10 and stats['evictions'] >= 1
+    assert cache.get('key10') == b'z' * 50 and cache.get('key1') is None
+
+    cache.set('big', b'b' * 900)
+    assert cache.stats()['bytes'] <= 1000 and cache.get('big') is not None
+
+    # A file written without the totals is counted when opened
+    conn = cache._connect()
+    conn.execute('DROP TABLE totals')
+    entries = conn.execute('SELECT COUNT(*), SUM(size) FROM entries').fetchone()
+    reopened = SQLiteCache(str(tmp_path / 'cache.sqlite'), max_entries=10, max_bytes=1000)
+    assert (reopened.stats()['entries'], reopened.stats()['bytes']) == entries
+
+
+def test_listing_cache_and_stats(tmp_path):
+    from flaskstarter.caching import cache_stats
+    from flaskstarter.tasks import MyTaskModel
+    from flaskstarter.user import ADMIN
+
+    app = create_app(_test_config(tmp_path, CACHE_TYPE='SimpleCache'))
+    with app.app_context():
+        db.create_all()
+        user = Users(name='user', email='user@example.com', password='secret',
+                     role_code=USER, status_code=ACTIVE)
+        admin = Users(name='admin', email='admin@example.com', password='secret',
+                      role_code=ADMIN, status_code=ACTIVE)
+        db.session.add_all([user, admin, MyTaskModel(task='first', user=user)])
+        db.session.commit()
+
+        assert [task.task for task in MyTaskModel.list_for_user(user.id)] == ['first']
+        assert [task.task for task in MyTaskModel.list_for_user(user.id)] == ['first']
+        before = cache_stats()['tasks']
+
+        # A write drops the listing, the next read reloads it
+        db.session.add(MyTaskModel(task='second', user=user))
+        db.session.commit()
+        assert [task.task for task in MyTaskModel.list_for_user(user.id)] == ['first', 'second']
+        after = cache_stats()['tasks']
+        assert after['hits'] == before['hits'] and after['misses'] == before['misses'] + 1
+        user_id, admin_id = user.id, admin.id
+        db.session.remove()
+
+    # Requests outside the test's app context, each gets its own `g`
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    assert client.get('/cache-stats').status_code == 403
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+    response = client.get('/cache-stats')
+    assert response.status_code == 200 and 'tasks' in response.get_json()
+
+
+def test_cached_user_snapshot(tmp_path):
+    from flaskstarter.caching import cache_get, invalidate_user
+    from flaskstarter.user.models import CachedUser
+
+    app = create_app(_test_config(tmp_path, CACHE_TYPE='SimpleCache'))
+    with app.app_context():
+        db.create_all()
+        user = Users(name='user', email='user@example.com', password='secret',
+                     email_activation_key='key', role_code=USER, status_code=ACTIVE)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        db.session.remove()
+
+        assert isinstance(Users.load_cached(user_id), Users)
+        assert cache_get('user', user_id) == {'id': user_id, 'name': 'user',
+                                              'role_code': USER, 'status_code': ACTIVE}
+
+        cached = Users.load_cached(user_id)
+        assert isinstance(cached, CachedUser)
+        assert cached.is_active and not cached.is_admin() and cached.get_id() == str(user_id)
+        assert cached._user is None
+        assert cached.email == 'user@example.com' and cached.check_password('secret')
+
+        invalidate_user(user_id)
+        assert isinstance(Users.load_cached(user_id), Users)
+        db.session.remove()
+
+
+def test_password_hash_upgrade_and_busy_pool(tmp_path):
+    import threading
+    from flaskstarter.user import PasswordHasher, PasswordHashBusy
+
+    app = create_app(_test_config(tmp_path, PASSWORD_HASH_METHOD='pbkdf2:sha256:1000'))
+    with app.app_context():
+        db.create_all()
+        user = Users(name='user', email='user@example.com', password='secret',
+                     email_activation_key='key', role_code=USER, status_code=ACTIVE)
+        db.session.add(user)
+        db.session.commit()
+        assert user.password.startswith('pbkdf2:sha256:1000$')
+
+        # A new policy: old hashes still verify and are replaced on login
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        del app.extensions['password_hasher']
+        found, authenticated = Users.authenticate('USER@example.com', 'secret')
+        assert authenticated and found.password.startswith('pbkdf2:sha256:2000$')
+        assert Users.authenticate('user@example.com', 'wrong') == (found, False)
+        db.session.remove()
+
+    def occupied(hasher):
+        hasher.hash('warm up')  # starts the pool
+        release = threading.Event()
+        hasher._executor.submit(release.wait)
+        return release
+
+    # The only worker is busy, the next hash gives up after the timeout
+    hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, timeout=0.05)
+    release = occupied(hasher)
+    with pytest.raises(PasswordHashBusy):
+        hasher.hash('secret')
+    release.set()
+    assert hasher.verify(hasher.hash('secret'), 'secret')
+
+    # Logging in then asks to try again rather than failing
+    app.extensions['password_hasher'] = hasher
+    release = occupied(hasher)
+    response = app.test_client().post('/login', data={'login': 'user@example.com', 'password': 'secret'})
+    release.set()
+    hasher.shutdown()
+    assert response.status_code == 200 and b'please try again in a moment' in response.data
+
+
+def test_mail_outbox_flush(tmp_path, monkeypatch):
+    from datetime import timedelta
+    from flaskstarter.emails import SENDING, SENT, OutgoingMail, SMTPSink, outbox, queue_mail
+    from flaskstarter.jobs import FAILED, QUEUED, Job, claim_next, run_job
+    from flaskstarter.utils import get_current_time
+
+    sink = SMTPSink(('localhost', 0)).serve_in_background()
+    app = create_app(_test_config(tmp_path, MAIL_SERVER='localhost', MAIL_PORT=sink.server_address[1],
+                                  MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False,
+                                  MAIL_RATE_LIMIT=0))
+    try:
+        with app.app_context():
+            db.create_all()
+
+            def flush_jobs():
+                return Job.query.filter_by(name=outbox.FLUSH_JOB, status=QUEUED).order_by(Job.run_at).all()
+
+            queue_mail('Hello', '<p>Hi</p>', 'a@example.com')
+            queue_mail('Again', '<p>Hi</p>', ['b@example.com', 'c@example.com'])
+            assert len(flush_jobs()) == 1  # one flush for both
+
+            assert run_job(claim_next('w1'))
+            assert len(sink.messages) == 2
+            assert {mail.status for mail in OutgoingMail.query} == {SENT}
+            assert flush_jobs() == []
+
+            # A batch held by a sender that died is flushed when its lease ends
+            lease_end = get_current_time() + timedelta(seconds=300)
+            db.session.add(OutgoingMail(subject='Stuck', html='<p>Hi</p>', recipients='d@example.com',
+                                        status=SENDING, attempts=1, locked_until=lease_end))
+            db.session.commit()
+            outbox._schedule_next_flush(get_current_time())
+            assert [job.run_at for job in flush_jobs()] == [lease_end]
+
+            # A flush that fails still leaves one scheduled
+            Job.query.delete()
+            db.session.commit()
+            queue_mail('Later', '<p>Hi</p>', 'e@example.com')
+
+            def broken(size):
+                raise RuntimeError('database went away')
+
+            monkeypatch.setattr(outbox, 'claim_batch', broken)
+            failing = claim_next('w1')
+            assert not run_job(failing) and failing.status == FAILED
+            rescheduled = flush_jobs()
+            assert len(rescheduled) == 1 and rescheduled[0].run_at > get_current_time()
+            db.session.remove()
+    finally:
+        sink.shutdown()
+        sink.server_close()
+
+
+def test_chunked_upload(app):
+    import hashlib
+    import os
+    from datetime import datetime, timedelta
+    from flaskstarter.jobs import QUEUED, Job
+    from flaskstarter.learning_marterial_uploader import LearningMaterial
+    from flaskstarter.learning_marterial_uploader.models import UploadSession
+    from flaskstarter.learning_marterial_uploader.storage import get_partial_path
+    from flaskstarter.learning_marterial_uploader.tasks import expire_upload_sessions
+
+    user = Users(name='user', email='user@example.com', password='secret', status_code=ACTIVE)
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+
+    content = os.urandom(300 * 1024)
+    response = client.post('/learning_material_uploader/uploads',
+                           json={'filename': 'notes.txt', 'size': len(content), 'mimetype': 'text/plain'})
+    assert response.status_code == 201
+    upload_id = response.get_json()['upload_id']
+    assert Job.query.filter_by(name='expire_upload_sessions', status=QUEUED).count() == 1
+
+    url = f'/learning_material_uploader/uploads/{upload_id}'
+    assert client.put(f'{url}?offset=0', data=content[:100000]).get_json()['received_bytes'] == 100000
+    assert client.put(f'{url}?offset=0', data=content[:10]).status_code == 409
+    assert client.post(f'{url}/complete').status_code == 409
+    client.put(f'{url}?offset=100000', data=content[100000:])
+
+    response = client.post(f'{url}/complete')
+    assert response.status_code == 200
+    material = db.session.get(LearningMaterial, response.get_json()['material_id'])
+    assert material.content_hash == hashlib.sha256(content).hexdigest()
+    assert db.session.get(UploadSession, upload_id) is None
+    assert Job.query.filter_by(name='analyze_file_material', status=QUEUED).count() == 1
+
+    # An upload left unfinished is dropped by the cleanup job
+    upload_id = client.post('/learning_material_uploader/uploads',
+                            json={'filename': 'more.txt', 'size': 100}).get_json()['upload_id']
+    upload = db.session.get(UploadSession, upload_id)
+    partial_path = get_partial_path(upload)
+    upload.updated_timestamp = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'] + 1)
+    db.session.commit()
+    assert expire_upload_sessions() == {'expired': 1}
+    assert db.session.get(UploadSession, upload_id) is None and not os.path.exists(partial_path)
+
+
+def test_request_ai_stream_validates_elements(tmp_path, monkeypatch):
+    from flaskstarter.ai import AIError
+    from flaskstarter.ai.client import FakeBackend
+    from flaskstarter.ai.schemas import TestQuestions
+    from flaskstarter.utils import request_ai_stream
+
+    answer = {'generated_question_count': 4, 'questions': ['  First?  ', '   ', 3, 'Second?']}
+    monkeypatch.setattr(FakeBackend, 'fake_response', staticmethod(lambda prompt: answer))
+
+    def run(stream):
+        elements = []
+        try:
+            while True:
+                elements.append(next(stream))
+        except StopIteration as stop:
+            return elements, stop.value
+
+    # Strings are expected: the number is left out of the stream, then
+    # fails the answer as a whole
+    app = create_app(_test_config(tmp_path, AI_CACHE_ENABLED=True, AI_CACHE_PATH=str(tmp_path / 'ai.sqlite')))
+    with app.app_context():
+        stream = request_ai_stream('Prompt', 'questions', schema=TestQuestions)
+        assert next(stream) == 'First?'
+        assert next(stream) == 'Second?'
+        with pytest.raises(AIError):
+            next(stream)
+
+        answer['questions'] = ['  First?  ', '   ', 'Second?']
+        elements, result = run(request_ai_stream('Prompt', 'questions', schema=TestQuestions))
+        assert elements == ['First?', 'Second?'] and result.questions == elements
+
+        # Served from the cache, validated the same way
+        answer['questions'] = ['Not asked?']
+        elements, result = run(request_ai_stream('Prompt', 'questions', schema=TestQuestions))
+        assert elements == ['First?', 'Second?'] and result.questions == elements
+
+
+def test_reading_list_fetch(app):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from flaskstarter.content import Fetcher
+    from flaskstarter.jobs import Job
+    from flaskstarter.learning_marterial_uploader import LearningMaterial
+    from flaskstarter.learning_marterial_uploader.storage import read_text
+    from flaskstarter.learning_marterial_uploader.tasks import (_reading_list_failed, analyze_link_material,
+                                                                fetch_reading_list)
+
+    article = ('<html><body><article>' + '<p>A paragraph about learning. ' * 40 +
+               '</p></article></body></html>').encode('utf-8')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/article':
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Content-Length', str(len(article)))
+                self.end_headers()
+                self.wfile.write(article)
+            else:
+                self.send_response(404 if self.path == '/gone' else 500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://localhost:{server.server_address[1]}'
+    try:
+        fetcher = Fetcher()
+        first = fetcher.fetch(f'{base}/article')
+        assert first.ok and first.etag == '"v1"' and not first.not_modified
+        again = fetcher.fetch(f'{base}/article')
+        assert again.ok and again.not_modified and again.content == article
+        assert fetcher.fetch(f'{base}/gone').status == 404
+
+        user = Users(name='reader', email='reader@example.com', password='secret', status_code=ACTIVE)
+        db.session.add(user)
+        db.session.commit()
+        materials = {}
+        for path in ('article', 'gone', 'broken', 'skipped'):
+            materials[path] = LearningMaterial(user_id=user.id, title=path, source_type='URL',
+                                               original_url=f'{base}/{path}', processing_status='PENDING_FETCH')
+        db.session.add_all(materials.values())
+        db.session.commit()
+
+        fetch_reading_list([materials[path].id for path in ('article', 'gone', 'broken')])
+
+        def analysis_jobs(material):
+            return Job.query.filter_by(name='analyze_link_material', payload=f'{{"material_id": {material.id}}}').count()
+
+        assert 'learning' in read_text(materials['article']) and analysis_jobs(materials['article']) == 1
+        # A page that is gone isn't retried, a server error is
+        assert materials['gone'].processing_status == 'ERROR_EXTRACTION' and analysis_jobs(materials['gone']) == 0
+        assert materials['broken'].processing_status == 'PENDING_FETCH' and analysis_jobs(materials['broken']) == 1
+
+        # A batch that died leaves the links it didn't hand over failed
+        _reading_list_failed({'material_ids': [materials[path].id for path in ('broken', 'skipped')]}, None)
+        assert materials['broken'].processing_status == 'PENDING_FETCH'
+        assert materials['skipped'].processing_status == 'ERROR_EXTRACTION'
+
+        gone = LearningMaterial(user_id=user.id, title='gone', source_type='URL',
+                                original_url=f'{base}/gone', processing_status='PENDING_FETCH')
+        db.session.add(gone)
+        db.session.commit()
+        analyze_link_material(gone.id)  # no MaterialProcessingError, nothing to retry
+        assert gone.processing_status == 'ERROR_EXTRACTION'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_attempt_feedback_claims_answers(app):
+    from flask import g
+    from flaskstarter.jobs import QUEUED, RUNNING, SUCCEEDED, Job, claim_next, run_job
+    from flaskstarter.learning_marterial_uploader import LearningMaterial
+    from flaskstarter.test_learning_function.models import Question, Test, UserAnswer
+    from flaskstarter.test_learning_function.tasks import (FEEDBACK_UNAVAILABLE, _feedback_failed,
+                                                           queue_attempt_feedback)
+
+    user = Users(name='student', email='student@example.com', password='secret', status_code=ACTIVE)
+    db.session.add(user)
+    db.session.commit()
+    material = LearningMaterial(user_id=user.id, title='Notes', source_type='URL',
+                                original_url='https://example.com', processing_status='COMPLETED')
+    db.session.add(material)
+    db.session.commit()
+    test_id, attempt_id = Test.create_with_questions(user.id, material.id, 'Quiz', ['Why?', 'How?'])
+    db.session.commit()
+    questions = Question.query.filter_by(test_id=test_id).order_by(Question.order).all()
+
+    def answer(text, question=questions[0], **values):
+        row = UserAnswer(attempt_id=attempt_id, question_id=question.id, answer_text=text, **values)
+        db.session.add(row)
+        db.session.commit()
+        return row
+
+    first, second = answer('Because.'), answer('Like this.', questions[1])
+    # Claimed by another run, left alone by this one
+    taken = answer('Taken.', feedback_job_id=999)
+
+    queue_attempt_feedback(attempt_id)
+    queue_attempt_feedback(attempt_id)
+    jobs = Job.query.filter_by(name='attempt_feedback').all()
+    assert len(jobs) == 1 and jobs[0].status == QUEUED
+
+    job = claim_next('w1')
+    assert job.status == RUNNING
+    queue_attempt_feedback(attempt_id)  # the running job picks new answers up
+    assert Job.query.filter_by(name='attempt_feedback').count() == 1
+
+    assert run_job(job) and job.status == SUCCEEDED and job.result == '{"answers": 2}'
+    db.session.expire_all()
+    assert first.feedback_text.startswith('Good start') and second.feedback_text and first.feedback_job_id == job.id
+    assert taken.feedback_text is None
+
+    # A failed run only gives up on the answers it had claimed
+    late = answer('Late.', feedback_job_id=job.id)
+    g.job_id = job.id
+    _feedback_failed({'attempt_id': attempt_id}, RuntimeError('failed'))
+    db.session.commit()
+    g.pop('job_id')
+    db.session.expire_all()
+    assert late.feedback_text == FEEDBACK_UNAVAILABLE and taken.feedback_text is None
+
+def test_test_bank(app, monkeypatch):
+    from flaskstarter.ai import AIQuotaExceeded
+    from flaskstarter.jobs import SUCCEEDED, claim_next, run_job
+    from flaskstarter.learning_marterial_uploader import LearningMaterial
+    from flaskstarter.learning_marterial_uploader.storage import save_text
+    from flaskstarter.test_learning_function import tasks
+    from flaskstarter.test_learning_function.models import Question, Test
+
+    user = Users(name='student', email='student@example.com', password='secret', status_code=ACTIVE)
+    db.session.add(user)
+    db.session.commit()
+    material = LearningMaterial(user_id=user.id, title='Notes', source_type='URL',
+                                original_url='https://example.com', processing_status='COMPLETED')
+    db.session.add(material)
+    db.session.commit()
+    save_text(material, 'Photosynthesis turns light into chemical energy.')
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+
+    def spec(name):
+        return {'name': name, 'scope': 'Chapter 1', 'goal': 'Exam', 'understanding': 'Basic'}
+
+    url = '/test_learning_function/test_bank'
+    assert client.post(url, json={'material_id': material.id, 'tests': [spec('No')]}).status_code == 400
+    response = client.post(url, json={'material_id': material.id,
+                                      'tests': [spec('Quiz one'), spec('Quiz two'), spec('Broken')]})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    # One prompt fails, the other tests are saved all the same
+    generate = tasks._generate
+
+    def flaky_generate(app, user_id, spec, *args):
+        if spec['name'] == 'Broken':
+            raise AIQuotaExceeded('429')
+        return generate(app, user_id, spec, *args)
+
+    monkeypatch.setattr(tasks, '_generate', flaky_generate)
+    job = claim_next('w1')
+    assert job.id == job_id and run_job(job) and job.status == SUCCEEDED
+
+    state = client.get(f'{url}/{job_id}').get_json()
+    assert state['status'] == SUCCEEDED and state['total'] == 3
+    assert state['done'] == 2 and state['failed'] == 1
+    assert state['errors'] == [{'name': 'Broken', 'error': AIQuotaExceeded.message}]
+    assert sorted(test['name'] for test in state['tests']) == ['Quiz one', 'Quiz two']
+    for saved in state['tests']:
+        test = db.session.get(Test, saved['test_id'])
+        assert test.material_id == material.id and test.spec_goal == 'Exam'
+        assert Question.query.filter_by(test_id=test.id).count() == 5
+
+    events = client.get(f'{url}/{job_id}/events').get_data(as_text=True)
+    assert events.startswith('event: done\n') and '"done": 2' in events
+
+
+def test_duplicate_upload_of_another_user(app, monkeypatch):
+    import hashlib
+    import io
+    import os
+    from collections import namedtuple
+    from datetime import datetime, timedelta, timezone
+    from flaskstarter.ai.client import FakeBackend, FakeFile
+    from flaskstarter.learning_marterial_uploader import LearningMaterial
+    from flaskstarter.learning_marterial_uploader.storage import get_material_path, read_text, save_text
+    from flaskstarter.learning_marterial_uploader.tasks import model_file
+
+    content = b'Chapter 1. Plain text of a shared handout.\n' * 50
+    owner = Users(name='owner', email='owner@example.com', password='secret', status_code=ACTIVE)
+    other = Users(name='other', email='other@example.com', password='secret', status_code=ACTIVE)
+    db.session.add_all([owner, other])
+    db.session.commit()
+
+    roadmap = {'document_title': 'Handout', 'structure': [{'level': 1, 'title': 'Chapter 1', 'summary': 'One.'}]}
+    original = LearningMaterial(user_id=owner.id, title='handout.txt', source_type='FILE', extension='txt',
+                                file_path=os.path.join(str(owner.id), 'handout.txt'),
+                                content_hash=hashlib.sha256(content).hexdigest(),
+                                gemini_file_uri='files/owner-copy', processing_status='COMPLETED')
+    os.makedirs(os.path.dirname(get_material_path(original)))
+    with open(get_material_path(original), 'wb') as f:
+        f.write(content)
+    save_text(original, content.decode('utf-8'))
+    original.set_roadmap(roadmap, 'file_roadmap@1')
+    db.session.add(original)
+    db.session.commit()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(other.id)
+    response = client.post('/learning_material_uploader/upload-file', headers={'Accept': 'application/json'},
+                           data={'learning_material_file': (io.BytesIO(content), 'copy.txt')})
+    copy = db.session.get(LearningMaterial, response.get_json()['material_id'])
+
+    # The analysis is copied, the files stay the owner's
+    assert copy.processing_status == 'COMPLETED' and copy.analysis_roadmap == roadmap
+    assert copy.file_path != original.file_path and os.path.exists(get_material_path(copy))
+    assert copy.extracted_text_path != original.extracted_text_path
+    assert read_text(copy) == read_text(original)
+    assert copy.gemini_file_uri is None
+
+    # A file the provider dropped, or is about to, is uploaded again
+    class Gone(Exception):
+        code = 404
+
+    Expiring = namedtuple('Expiring', 'name expiration_time')
+
+    def get_file(self, name):
+        if name == 'files/owner-copy':
+            raise Gone('File not found')
+        return Expiring(name, datetime.now(timezone.utc) + timedelta(minutes=5))
+
+    monkeypatch.setattr(FakeBackend, 'get_file', get_file)
+    uploaded = model_file(original)
+    assert uploaded.name.startswith('files/fake-') and original.gemini_file_uri == uploaded.name
+    assert isinstance(model_file(original), FakeFile)  # expiring in 5 minutes
+    assert model_file(copy).name.startswith('files/fake-')